@@ -0,0 +1,196 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+"""Benchmarks the computation of the pipeline signatures used for caching.
+
+Loads the tagged workflows of the vistrails in examples/ (or of the .vt files
+given on the command-line) and keeps the largest ones that can be loaded with
+the packages available. A synthetic workflow of basic modules is added, with
+the number of modules given by --modules. It then times computing all their
+signatures with each of the available hash functions, with and without the
+memoization of constant parameter signatures.
+"""
+
+import optparse
+import os
+import sys
+import time
+# put the vistrails code on the python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vistrails.core.application
+from vistrails.core.cache.hasher import Hasher
+from vistrails.core.cache.utils import hash_backends
+
+def load_pipelines(filenames, nb_pipelines):
+    """Returns the nb_pipelines largest workflows that are valid."""
+    from vistrails.core.db.io import load_vistrail
+    from vistrails.core.db.locator import FileLocator
+    from vistrails.core.vistrail.controller import VistrailController
+
+    pipelines = []
+    for filename in filenames:
+        locator = FileLocator(os.path.abspath(filename))
+        try:
+            vistrail = load_vistrail(locator)[0]
+        except Exception, e:
+            print "Skipping %s: %s" % (filename, e)
+            continue
+        controller = VistrailController(vistrail, locator)
+        for version in vistrail.get_tagMap():
+            try:
+                controller.change_selected_version(version)
+            except Exception:
+                continue
+            pipeline = controller.current_pipeline
+            if pipeline is None or not pipeline.is_valid:
+                # Missing packages
+                continue
+            pipelines.append((len(pipeline.modules),
+                              "%s version %d" % (os.path.basename(filename),
+                                                 version),
+                              pipeline))
+    pipelines.sort(reverse=True)
+    return pipelines[:nb_pipelines]
+
+def make_pipeline(nb_modules, width=10):
+    """Builds a workflow of ConcatenateString modules in layers of width,
+    each connected to two modules of the previous layer and with a few
+    distinct constant values."""
+    from vistrails.core.modules.basic_modules import identifier as basic_pkg
+    from vistrails.core.packagemanager import get_package_manager
+    from vistrails.core.vistrail.connection import Connection
+    from vistrails.core.vistrail.module import Module
+    from vistrails.core.vistrail.module_function import ModuleFunction
+    from vistrails.core.vistrail.module_param import ModuleParam
+    from vistrails.core.vistrail.pipeline import Pipeline
+    from vistrails.core.vistrail.port import Port
+
+    version = get_package_manager().get_package(basic_pkg).version
+    pipeline = Pipeline()
+    conn_id = 0
+    for i in xrange(nb_modules):
+        names = ['str3', 'str4']
+        if i < width:
+            names += ['str1', 'str2']
+        functions = [ModuleFunction(name=name,
+                                    parameters=[ModuleParam(
+                                            pos=0, type='String',
+                                            val=str(i % 5))])
+                     for name in names]
+        pipeline.add_module(Module(name='ConcatenateString',
+                                   package=basic_pkg, version=version, id=i,
+                                   functions=functions))
+        if i >= width:
+            for src, port in ((i - width, 'str1'),
+                              (i - width + (i + 1) % width, 'str2')):
+                pipeline.add_connection(Connection(
+                        id=conn_id,
+                        ports=[Port(id=conn_id * 2, type='source',
+                                    moduleId=src, name='value',
+                                    signature='(%s:String)' % basic_pkg),
+                               Port(id=conn_id * 2 + 1, type='destination',
+                                    moduleId=i, name=port,
+                                    signature='(%s:String)' % basic_pkg)]))
+                conn_id += 1
+    pipeline.validate()
+    return pipeline
+
+def time_signatures(pipelines, repeat):
+    start = time.time()
+    for i in xrange(repeat):
+        for pipeline in pipelines:
+            pipeline.refresh_signatures()
+    return time.time() - start
+
+def main(args):
+    parser = optparse.OptionParser(usage="%prog [options] [file.vt ...]")
+    parser.add_option('-m', '--modules', type='int', default=2000,
+                      help="size of the synthetic workflow (0 to disable)")
+    parser.add_option('-r', '--repeat', type='int', default=10,
+                      help="number of times to compute the signatures")
+    options, filenames = parser.parse_args(args)
+    if not filenames:
+        examples = os.path.join(os.path.dirname(os.path.dirname(
+                os.path.abspath(__file__))), 'examples')
+        filenames = [os.path.join(examples, f)
+                     for f in sorted(os.listdir(examples))
+                     if f.endswith('.vt')]
+
+    # The application is only weakly referenced elsewhere
+    app = vistrails.core.application.init({'batch': True,
+                                           'enablePackagesSilently': True,
+                                           'executionLog': False})
+    pipelines = load_pipelines(filenames, 20)
+    if options.modules > 0:
+        pipelines.append((options.modules, "synthetic",
+                          make_pipeline(options.modules)))
+    if not pipelines:
+        print "No workflow could be loaded"
+        return 1
+    print "%d workflows, %d modules:" % (
+            len(pipelines), sum(p[0] for p in pipelines))
+    for nb_modules, name, _ in pipelines:
+        print "  %s: %d modules" % (name, nb_modules)
+    pipelines = [p[2] for p in pipelines]
+
+    max_memoized = Hasher.MAX_PARAMETER_SIGNATURES
+    results = []
+    try:
+        for name in sorted(hash_backends):
+            Hasher.set_hash_backend(name)
+            for memoize in (False, True):
+                # Without memoization, the table is emptied on every insert
+                Hasher.MAX_PARAMETER_SIGNATURES = [0, max_memoized][memoize]
+                Hasher._parameter_signatures.clear()
+                Hasher._connection_signatures.clear()
+                results.append((name, memoize,
+                                time_signatures(pipelines, options.repeat)))
+    finally:
+        Hasher.MAX_PARAMETER_SIGNATURES = max_memoized
+        Hasher.set_hash_backend('sha1')
+
+    reference, = [elapsed for name, memoize, elapsed in results
+                  if name == 'sha1' and not memoize]
+    print
+    print "Computing all signatures %d times:" % options.repeat
+    for name, memoize, elapsed in results:
+        print "  %-8s %-16s %.3fs (%.2fx)" % (
+                name, ["", "memoized"][memoize], elapsed,
+                reference / elapsed)
+    app.finishSession()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,385 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+"""On-disk result cache for the cached interpreter.
+
+The persistent pipeline of the cached interpreter only lives as long as the
+process. DiskCache keeps the output ports of cacheable modules on disk,
+keyed by the subpipeline signature of the module, so that another process
+running the same upstream pipeline can reuse them instead of recomputing.
+
+Only values that can be restored faithfully are stored: Python constants
+(numbers, strings, booleans, None), lists, tuples and dicts of those, numpy
+arrays and files (PathObject). Files are copied into the cache and restored
+through the interpreter's FilePool.
+"""
+
+import cPickle as pickle
+import os
+import shutil
+import tempfile
+import time
+
+from vistrails.core import debug
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+##############################################################################
+
+_simple_types = (type(None), bool, int, long, float, complex, basestring)
+
+
+class _StoredFile(object):
+    """Placeholder for a PathObject in a pickled cache entry.
+    """
+    def __init__(self, name):
+        self.name = name
+
+
+class CacheEntry(object):
+    def __init__(self, signature, path, time, size):
+        self.signature = signature
+        self.path = path
+        self.time = time
+        self.size = size
+
+
+class DiskCache(object):
+    """DiskCache(directory: str, max_size: int)
+
+    Stores the outputs of modules in directory, using at most max_size
+    bytes. When the limit is reached, the least recently used entries are
+    removed.
+
+    Each entry is a subdirectory named after the hex signature of the
+    module, containing the pickled outputs and the copied files.
+    """
+
+    OUTPUTS_FILE = 'outputs.pkl'
+    TMP_PREFIX = '.tmp_'
+    # Temporary directories untouched for that long are from a store that
+    # got interrupted, not one still running in another process
+    TMP_MAX_AGE = 60 * 60
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.elements = {}
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.init_cache()
+
+    def init_cache(self):
+        now = time.time()
+        for signature in os.listdir(self.directory):
+            path = os.path.join(self.directory, signature)
+            if signature.startswith(self.TMP_PREFIX):
+                try:
+                    stale = now - os.stat(path).st_mtime > self.TMP_MAX_AGE
+                except OSError:
+                    # Renamed or removed by its process meanwhile
+                    continue
+                if stale:
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+            outputs = os.path.join(path, self.OUTPUTS_FILE)
+            if not os.path.isfile(outputs):
+                # Leftover from an interrupted store
+                shutil.rmtree(path, ignore_errors=True)
+                continue
+            self.elements[signature] = CacheEntry(signature, path,
+                                                  os.stat(outputs).st_mtime,
+                                                  self._dir_size(path))
+
+    @staticmethod
+    def _dir_size(path):
+        size = 0
+        for root, dirs, files in os.walk(path):
+            for f in files:
+                size += os.path.getsize(os.path.join(root, f))
+        return size
+
+    def size(self):
+        return sum(entry.size for entry in self.elements.itervalues())
+
+    def has(self, signature):
+        return signature in self.elements
+
+    def get_ports(self, signature):
+        """get_ports(signature: str) -> set of str
+
+        Returns the names of the output ports stored for signature, without
+        restoring the values.
+        """
+        outputs = self._read_outputs(signature)
+        if outputs is None:
+            return None
+        return set(outputs)
+
+    def _read_outputs(self, signature):
+        entry = self.elements.get(signature)
+        if entry is None:
+            return None
+        fname = os.path.join(entry.path, self.OUTPUTS_FILE)
+        try:
+            with open(fname, 'rb') as fp:
+                outputs = pickle.load(fp)
+        except Exception, e:
+            debug.warning("Removing unreadable cache entry %s" % signature,
+                          e)
+            self.remove(signature)
+            return None
+        entry.time = time.time()
+        try:
+            os.utime(fname, None)
+        except OSError:
+            pass
+        return outputs
+
+    def load(self, signature, file_pool, ports=()):
+        """load(signature: str, file_pool: FilePool,
+                ports: set) -> dict or None
+
+        Returns the output ports stored for signature, or None if there is
+        no such entry or if some of the given ports were not stored. Files
+        are copied to the given file pool.
+        """
+        outputs = self._read_outputs(signature)
+        if outputs is None or not set(ports) <= set(outputs):
+            return None
+        path = self.elements[signature].path
+
+        def restore(value):
+            if isinstance(value, _StoredFile):
+                fname = os.path.join(path, value.name)
+                if not os.path.isfile(fname):
+                    raise IOError("Missing cached file %s" % fname)
+                return file_pool.make_local_copy(fname)
+            elif isinstance(value, list):
+                return [restore(v) for v in value]
+            elif isinstance(value, tuple):
+                return tuple(restore(v) for v in value)
+            elif isinstance(value, dict):
+                return dict((k, restore(v)) for k, v in value.iteritems())
+            return value
+
+        try:
+            return dict((port, restore(value))
+                        for port, value in outputs.iteritems())
+        except IOError, e:
+            debug.warning("Removing incomplete cache entry %s" % signature,
+                          e)
+            self.remove(signature)
+            return None
+
+    def store(self, signature, outputs):
+        """store(signature: str, outputs: dict) -> bool
+
+        Stores the given output ports under signature. Returns False if
+        some value cannot be stored, in which case nothing is written.
+        """
+        from vistrails.core.modules.basic_modules import PathObject
+
+        if signature in self.elements:
+            return True
+        files = []
+
+        def encode(value):
+            if isinstance(value, _simple_types):
+                return value
+            elif isinstance(value, PathObject):
+                if not os.path.isfile(value.name):
+                    raise TypeError
+                stored = _StoredFile('file_%d' % len(files))
+                files.append((value.name, stored.name))
+                return stored
+            elif numpy is not None and isinstance(value, numpy.ndarray):
+                if value.dtype.hasobject:
+                    raise TypeError
+                return value
+            elif type(value) is list:
+                return [encode(v) for v in value]
+            elif type(value) is tuple:
+                return tuple(encode(v) for v in value)
+            elif type(value) is dict:
+                return dict((encode(k), encode(v))
+                            for k, v in value.iteritems())
+            raise TypeError
+
+        try:
+            encoded = dict((port, encode(value))
+                           for port, value in outputs.iteritems())
+        except TypeError:
+            return False
+
+        # Write everything in a temporary directory, then rename it so that
+        # readers never see a partial entry
+        tmp = tempfile.mkdtemp(prefix=self.TMP_PREFIX, dir=self.directory)
+        try:
+            for src, name in files:
+                shutil.copyfile(src, os.path.join(tmp, name))
+            with open(os.path.join(tmp, self.OUTPUTS_FILE), 'wb') as fp:
+                pickle.dump(encoded, fp, pickle.HIGHEST_PROTOCOL)
+            size = self._dir_size(tmp)
+            if size > self.max_size:
+                shutil.rmtree(tmp, ignore_errors=True)
+                return False
+            path = os.path.join(self.directory, signature)
+            os.rename(tmp, path)
+        except (IOError, OSError, pickle.PicklingError), e:
+            debug.warning("Could not store cache entry %s" % signature, e)
+            shutil.rmtree(tmp, ignore_errors=True)
+            return False
+        self.elements[signature] = CacheEntry(signature, path, time.time(),
+                                              size)
+        self.remove_lru()
+        return True
+
+    def remove_lru(self):
+        """remove_lru() -> None
+
+        Removes least recently used entries until the cache fits in its
+        size limit.
+        """
+        total = self.size()
+        if total <= self.max_size:
+            return
+        elements = sorted(self.elements.itervalues(),
+                          key=lambda entry: entry.time)
+        for entry in elements:
+            if total <= self.max_size:
+                break
+            total -= entry.size
+            self.remove(entry.signature)
+
+    def remove(self, signature):
+        entry = self.elements.pop(signature, None)
+        if entry is not None:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    def clear(self):
+        for signature in self.elements.keys():
+            self.remove(signature)
+
+##############################################################################
+
+import unittest
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        from vistrails.core.modules.module_utils import FilePool
+        self.directory = tempfile.mkdtemp(prefix='vt_diskcache_')
+        self.file_pool = FilePool()
+
+    def tearDown(self):
+        self.file_pool.cleanup()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_roundtrip(self):
+        cache = DiskCache(self.directory, 1024 * 1024)
+        outputs = {'value': 42, 'list': [1.5, u'a', (None, True)],
+                   'dict': {'a': 1}}
+        self.assertTrue(cache.store('abcd', outputs))
+        self.assertEqual(cache.load('abcd', self.file_pool), outputs)
+        self.assertIsNone(cache.load('0123', self.file_pool))
+
+        # A new instance finds the existing entries
+        cache = DiskCache(self.directory, 1024 * 1024)
+        self.assertTrue(cache.has('abcd'))
+        self.assertEqual(cache.get_ports('abcd'),
+                         set(['value', 'list', 'dict']))
+        self.assertEqual(cache.load('abcd', self.file_pool, ['value']),
+                         outputs)
+        self.assertIsNone(cache.load('abcd', self.file_pool, ['self']))
+
+    def test_tmp_dirs(self):
+        """Only removes the temporary directories of interrupted stores.
+        """
+        running = tempfile.mkdtemp(prefix=DiskCache.TMP_PREFIX,
+                                   dir=self.directory)
+        interrupted = tempfile.mkdtemp(prefix=DiskCache.TMP_PREFIX,
+                                       dir=self.directory)
+        old = time.time() - DiskCache.TMP_MAX_AGE - 60
+        os.utime(interrupted, (old, old))
+        os.mkdir(os.path.join(self.directory, 'abcd'))
+        cache = DiskCache(self.directory, 1024 * 1024)
+        self.assertEqual(os.listdir(self.directory),
+                         [os.path.basename(running)])
+        self.assertEqual(cache.elements, {})
+
+    def test_file(self):
+        from vistrails.core.modules.basic_modules import PathObject
+        cache = DiskCache(self.directory, 1024 * 1024)
+        src = self.file_pool.create_file()
+        with open(src.name, 'w') as fp:
+            fp.write('some data')
+        self.assertTrue(cache.store('abcd', {'file': src}))
+        os.remove(src.name)
+        result = cache.load('abcd', self.file_pool)['file']
+        self.assertIsInstance(result, PathObject)
+        self.assertNotEqual(result.name, src.name)
+        with open(result.name) as fp:
+            self.assertEqual(fp.read(), 'some data')
+
+    def test_unstorable(self):
+        cache = DiskCache(self.directory, 1024 * 1024)
+        self.assertFalse(cache.store('abcd', {'value': object()}))
+        self.assertFalse(cache.has('abcd'))
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_lru(self):
+        cache = DiskCache(self.directory, 3000)
+        cache.store('a', {'value': 'a' * 1000})
+        cache.store('b', {'value': 'b' * 1000})
+        cache.elements['a'].time -= 10
+        cache.elements['b'].time -= 20
+        # 'b' is older but gets used
+        cache.load('b', self.file_pool)
+        cache.store('c', {'value': 'c' * 1000})
+        self.assertFalse(cache.has('a'))
+        self.assertTrue(cache.has('b'))
+        self.assertTrue(cache.has('c'))
+        self.assertLessEqual(cache.size(), 3000)
+
+    def test_numpy(self):
+        if numpy is None:
+            self.skipTest("numpy is not available")
+        cache = DiskCache(self.directory, 1024 * 1024)
+        array = numpy.arange(10.0)
+        self.assertTrue(cache.store('abcd', {'value': array}))
+        self.assertTrue((cache.load('abcd', self.file_pool)['value'] ==
+                         array).all())
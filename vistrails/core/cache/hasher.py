@@ -33,27 +33,42 @@
 ##
 ###############################################################################
 """Hasher class for vistrail items."""
-from vistrails.core.cache.utils import hash_list
-
-try:
-    import hashlib
-    sha_hash = hashlib.sha1
-except ImportError:
-    import sha
-    sha_hash = sha.new
+from vistrails.core.cache.utils import hash_list, new_hash, set_hash_backend
 
 ##############################################################################
 
 class Hasher(object):
 
+    # The same constants and connections get hashed over and over, so their
+    # signatures are kept (not those from custom hashers, which might depend
+    # on more than the value)
+    _parameter_signatures = {}
+    _connection_signatures = {}
+    MAX_PARAMETER_SIGNATURES = 100000
+
+    @staticmethod
+    def set_hash_backend(name):
+        """set_hash_backend(name: str) -> None
+
+        Selects the hash function used for all signatures, see
+        vistrails.core.cache.utils.hash_backends.
+        """
+        set_hash_backend(name)
+        Hasher._parameter_signatures.clear()
+        Hasher._connection_signatures.clear()
+
     @staticmethod
     def parameter_signature(p, constant_hasher_map={}):
         k = (p.identifier, p.type, p.namespace)
         custom_hasher = constant_hasher_map.get(k, None)
         if custom_hasher:
             return custom_hasher(p)
-        else:
-            hasher = sha_hash()
+        key = (k, p.strValue, p.name, p.evaluatedStrValue)
+        signatures = Hasher._parameter_signatures
+        try:
+            return signatures[key]
+        except KeyError:
+            hasher = new_hash()
             u = hasher.update
             u(p.type)
             u(p.identifier)
@@ -61,11 +76,15 @@ class Hasher(object):
             u(p.strValue)
             u(p.name)
             u(p.evaluatedStrValue)
-            return hasher.digest()
+            sig = hasher.digest()
+            if len(signatures) >= Hasher.MAX_PARAMETER_SIGNATURES:
+                signatures.clear()
+            signatures[key] = sig
+            return sig
 
     @staticmethod
     def function_signature(function, constant_hasher_map={}):
-        hasher = sha_hash()
+        hasher = new_hash()
         u = hasher.update
         u(function.name)
         u(function.returnType)
@@ -76,7 +95,7 @@ class Hasher(object):
 
     @staticmethod
     def control_param_signature(control_param, constant_hasher_map={}):
-        hasher = sha_hash()
+        hasher = new_hash()
         u = hasher.update
         u(control_param.name)
         u(control_param.value)
@@ -84,11 +103,20 @@ class Hasher(object):
 
     @staticmethod
     def connection_signature(c):
-        hasher = sha_hash()
-        u = hasher.update
-        u(c.source.name)
-        u(c.destination.name)
-        return hasher.digest()
+        key = (c.source.name, c.destination.name)
+        signatures = Hasher._connection_signatures
+        try:
+            return signatures[key]
+        except KeyError:
+            hasher = new_hash()
+            u = hasher.update
+            u(key[0])
+            u(key[1])
+            sig = hasher.digest()
+            if len(signatures) >= Hasher.MAX_PARAMETER_SIGNATURES:
+                signatures.clear()
+            signatures[key] = sig
+            return sig
 
     @staticmethod
     def connection_subpipeline_signature(c, source_sig, dest_sig):
@@ -96,7 +124,7 @@ class Hasher(object):
         subpipelines
 
         """
-        hasher = sha_hash()
+        hasher = new_hash()
         u = hasher.update
         u(Hasher.connection_signature(c))
         u(source_sig)
@@ -105,7 +133,7 @@ class Hasher(object):
 
     @staticmethod
     def module_signature(obj, constant_hasher_map={}):
-        hasher = sha_hash()
+        hasher = new_hash()
         u = hasher.update
         u(obj.module_descriptor.name)
         u(obj.module_descriptor.package)
@@ -126,7 +154,7 @@ class Hasher(object):
         WARNING: For efficiency, upstream_sigs is mutated!
 
         """
-        hasher = sha_hash()
+        hasher = new_hash()
         hasher.update(module_sig)
         upstream_sigs.sort()
         for pipeline_connection_sig in upstream_sigs:
@@ -140,7 +168,7 @@ class Hasher(object):
         signatures, assuming the list order is irrelevant
 
         """
-        hasher = sha_hash()
+        hasher = new_hash()
         for h in sorted(sig_list):
             hasher.update(h)
         return hasher.digest()
@@ -34,18 +34,86 @@
 ###############################################################################
 """Helper functions for cache package."""
 
+import sys
+
 try:
     import hashlib
     sha_hash = hashlib.sha1
+    hash_backends = {'sha1': hashlib.sha1, 'md5': hashlib.md5}
+    if hasattr(hashlib, 'blake2b'):
+        hash_backends['blake2b'] = lambda: hashlib.blake2b(digest_size=16)
 except ImportError:
     import sha
     sha_hash = sha.new
+    hash_backends = {'sha1': sha.new}
+try:
+    import xxhash
+except ImportError:
+    pass
+else:
+    if hasattr(xxhash, 'xxh128'):
+        hash_backends['xxh128'] = xxhash.xxh128
+
+_hash_backend = sha_hash
 
 ##############################################################################
 
+def new_hash():
+    """new_hash() -> hash object
+
+    Returns a new hash object from the backend selected by
+    set_hash_backend(), used to compute the signatures.
+    """
+    return _hash_backend()
+
+def get_hash_backend():
+    """get_hash_backend() -> callable
+
+    Returns the hash function currently used to compute the signatures.
+    """
+    return _hash_backend
+
+def set_hash_backend(name):
+    """set_hash_backend(name: str) -> None
+
+    Selects the hash function used to compute the signatures, among the
+    hash_backends available.
+    """
+    global _hash_backend
+    try:
+        _hash_backend = hash_backends[name]
+    except KeyError:
+        raise ValueError("Unknown signature hash %r, available: %s" % (
+                         name, ", ".join(sorted(hash_backends))))
+
 def hash_list(lst, hasher_f, constant_hasher_map={}):
-    hasher = sha_hash()
+    hasher = _hash_backend()
     hash_l = [hasher_f(el, constant_hasher_map) for el in lst]
     hash_l.sort()
     for hel in hash_l: hasher.update(hel)
     return hasher.digest()
+
+def estimate_size(value, seen=None):
+    """estimate_size(value) -> int
+
+    Returns a rough estimate of the memory used by a value, in bytes.
+    Lists, tuples, sets and dicts are walked recursively and objects
+    exposing 'nbytes' (such as numpy arrays) count their buffer; other
+    objects only count their own size.
+    """
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, (int, long)):
+        return nbytes
+    size = sys.getsizeof(value, 0)
+    if isinstance(value, dict):
+        for k, v in value.iteritems():
+            size += estimate_size(k, seen) + estimate_size(v, seen)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for v in value:
+            size += estimate_size(v, seen)
+    return size
@@ -35,6 +35,7 @@
 import glob
 import os
 import sqlite3
+import time
 from itertools import chain
 
 from entity import Entity
@@ -47,6 +48,8 @@ from parameter_exploration import ParameterExplorationEntity
 
 from vistrails.core.db.locator import FileLocator, BaseLocator
 from vistrails.core.db.io import load_vistrail
+from vistrails.core.query import extract_text
+from vistrails.core.query.version import SearchCompiler
 import vistrails.core.system
 import vistrails.db.services.io
 from vistrails.core import debug
@@ -59,6 +62,104 @@ schema = ["create table entity(id integer primary key, type integer, "
           "create table workspaces(id text primary key)",
           "insert into workspaces values ('Default')"]
 
+# Also applied to existing databases
+indexes = ["create table if not exists entity_file(url text primary key, "
+           "mtime real, size integer)",
+           "create index if not exists entity_url on entity(url)",
+           "create index if not exists entity_type on entity(type)",
+           "create index if not exists entity_children_parent "
+           "on entity_children(parent)",
+           "create index if not exists entity_children_child "
+           "on entity_children(child)"]
+
+# Text of the versions of the indexed vistrails, for search_versions()
+# This needs the trigram tokenizer (SQLite 3.34), the search is done in Python
+# without it
+version_index = ["create virtual table if not exists version_text "
+                 "using fts5(user, name, notes, modules, params, "
+                 "tokenize='trigram')",
+                 "create table if not exists version(id integer primary key, "
+                 "url text, version integer, date real)",
+                 "create index if not exists version_url on version(url)"]
+
+_missing = object()
+
+def iter_version_texts(vistrail):
+    """ Yields (version, date, user, name, notes, modules, params) for each
+    version of the vistrail, as stored in the version index.
+
+    The pipelines are not materialized: the actions are replayed along the
+    version tree, keeping only the module names and parameter values.
+    """
+    children = {}
+    for action in vistrail.actionMap.itervalues():
+        children.setdefault(action.prevId, []).append(action)
+    tag_map = vistrail.get_tagMap()
+    modules = {}
+    functions = {} # function id -> module id
+    params = {} # parameter id -> (function id, value)
+
+    stack = list(children.get(0, ()))
+    while stack:
+        action = stack.pop()
+        if isinstance(action, list):
+            for objects, key, value in reversed(action):
+                if value is _missing:
+                    del objects[key]
+                else:
+                    objects[key] = value
+            continue
+
+        undo = []
+        def set_object(objects, key, value):
+            undo.append((objects, key, objects.get(key, _missing)))
+            if value is _missing:
+                objects.pop(key, None)
+            else:
+                objects[key] = value
+        for op in action.operations:
+            what = op.db_what
+            if what in ('module', 'abstraction', 'group'):
+                objects = modules
+            elif what == 'function':
+                objects = functions
+            elif what == 'parameter':
+                objects = params
+            else:
+                continue
+            if op.vtType == 'delete':
+                set_object(objects, op.db_objectId, _missing)
+                continue
+            if what == 'function':
+                value = op.db_parentObjId
+            elif what == 'parameter':
+                value = (op.db_parentObjId, op.db_data.db_val)
+            else:
+                value = op.db_data.db_name
+            if op.vtType == 'change':
+                set_object(objects, op.db_oldObjId, _missing)
+                set_object(objects, op.db_newObjId, value)
+            else:
+                set_object(objects, op.db_objectId, value)
+
+        if action.db_date is not None:
+            date = time.mktime(action.db_date.timetuple())
+        else:
+            date = None
+        name = '%s\n%s' % (tag_map.get(action.id, ''),
+                            vistrail.get_description(action.id))
+        if vistrail.has_notes(action.id):
+            notes = extract_text(vistrail.get_notes(action.id))
+        else:
+            notes = ''
+        yield (action.id, date, action.user or '', name, notes,
+               '\n'.join(sorted(set(modules.itervalues()))),
+               '\n'.join(value for function, value in params.itervalues()
+                          if functions.get(function) in modules))
+
+        stack.append(undo)
+        stack.extend(children.get(action.id, ()))
+
 class Collection(object):
     entity_types = dict((x.type_id, x)
                         for x in [VistrailEntity, WorkflowEntity, 
@@ -70,9 +171,13 @@ class Collection(object):
         else:
             self.database = database
 
+        # Only the entities that were needed so far are read from the
+        # database; see get_entity()
         self.entities = {}
+        self.urls = {} # url -> entity, for the entities in self.entities
         self.deleted_entities = {}
         self.temp_entities = {}
+        self.file_stats = {} # url -> (mtime, size), not yet saved
         self.workspaces = {}
         self.currentWorkspace = 'Default'
         self.listeners = [] # listens for entity creation removal
@@ -90,6 +195,23 @@ class Collection(object):
                 debug.critical("Could not create vistrail index schema", e)
         else:
             self.conn = sqlite3.connect(self.database)
+        try:
+            cur = self.conn.cursor()
+            for s in indexes:
+                cur.execute(s)
+            self.conn.commit()
+        except Exception, e:
+            debug.critical("Could not create vistrail index tables", e)
+        try:
+            cur = self.conn.cursor()
+            for s in version_index:
+                cur.execute(s)
+            self.conn.commit()
+        except sqlite3.Error, e:
+            debug.log("Version search index is not available", e)
+            self.has_version_index = False
+        else:
+            self.has_version_index = True
         self.load_entities()
 
     #Singleton technique
@@ -128,31 +250,25 @@ class Collection(object):
         cur.execute('delete from entity_children;')
         cur.execute('delete from workspaces;')
         cur.execute('delete from entity_workspace;')
+        cur.execute('delete from entity_file;')
+        if self.has_version_index:
+            cur.execute('delete from version_text;')
+            cur.execute('delete from version;')
 
     def get_current_entities(self):
         """NOTE: returns an iterator"""
+        self.load_all_entities()
         return chain(self.entities.itervalues(), 
                      self.temp_entities.itervalues())
 
     def load_entities(self):
+        """ Reads the workspaces and the entities they contain; other
+        entities are read when needed """
         cur = self.conn.cursor()
         cur.execute("select max(id) from entity;")
         for row in cur.fetchall():
             n = row[0]
             self.max_id = n if n is not None else 0
-        
-        cur.execute("select * from entity;")
-        for row in cur.fetchall():
-            entity = self.load_entity(*row)
-            if entity is not None:
-                self.entities[entity.id] = entity
-
-        # now need to map children to correct places
-        cur.execute("select * from entity_children;")
-        for row in cur.fetchall():
-            if row[0] in self.entities and row[1] in self.entities:
-                self.entities[row[0]].children.append(self.entities[row[1]])
-                self.entities[row[1]].parent = self.entities[row[0]]
 
         cur.execute("select * from workspaces;")
         for row in cur.fetchall():
@@ -161,10 +277,81 @@ class Collection(object):
         cur.execute("select * from entity_workspace;")
         for row in cur.fetchall():
             e_id, workspace = row
-            if e_id in self.entities:
+            entity = self.get_entity(e_id)
+            if entity is not None:
                 if workspace not in self.workspaces:
                     self.workspaces[workspace] = []
-                self.workspaces[workspace].append(self.entities[e_id])
+                self.workspaces[workspace].append(entity)
+
+    def load_all_entities(self):
+        """ Reads all the entities from the database """
+        cur = self.conn.cursor()
+        cur.execute("select * from entity;")
+        for row in cur.fetchall():
+            if (row[0] not in self.entities and
+                    row[0] not in self.deleted_entities):
+                self._add_loaded_entity(row)
+
+        children = {}
+        cur.execute("select * from entity_children;")
+        for parent, child in cur.fetchall():
+            if child in self.entities:
+                children.setdefault(parent, []).append(self.entities[child])
+        for entity in self.entities.itervalues():
+            if entity.load_children is not None:
+                entity.children = children.get(entity.id, [])
+                for child in entity.children:
+                    child.parent = entity
+
+    def _add_loaded_entity(self, row):
+        entity = self.load_entity(*row)
+        if entity is not None:
+            entity.load_children = self._load_children
+            self.entities[entity.id] = entity
+            self.urls[entity.url] = entity
+        return entity
+
+    def _load_children(self, entity):
+        cur = self.conn.cursor()
+        cur.execute("select entity.* from entity_children, entity "
+                    "where entity_children.parent=? "
+                    "and entity.id=entity_children.child "
+                    "order by entity.id", (entity.id,))
+        children = []
+        for row in cur.fetchall():
+            if row[0] in self.deleted_entities:
+                continue
+            child = self.entities.get(row[0])
+            if child is None:
+                child = self._add_loaded_entity(row)
+            if child is not None:
+                child.parent = entity
+                children.append(child)
+        return children
+
+    def get_entity(self, id):
+        """ Returns the entity with this id, reading it and its ancestors
+        from the database if needed """
+        if id in self.entities:
+            return self.entities[id]
+        if id in self.deleted_entities:
+            return None
+        cur = self.conn.cursor()
+        cur.execute("select parent from entity_children where child=?",
+                    (id,))
+        row = cur.fetchone()
+        if row is not None:
+            parent = self.get_entity(row[0])
+            if parent is None:
+                return None
+            # Reading the parent's children reads this one
+            parent.children
+            return self.entities.get(id)
+        cur.execute("select * from entity where id=?", (id,))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        return self._add_loaded_entity(row)
 
     def save_entities(self):
         # TODO delete entities with no workspace
@@ -177,6 +364,11 @@ class Collection(object):
                 self.save_entity(entity)
                 
         cur = self.conn.cursor()
+        cur.executemany("insert or replace into entity_file values (?, ?, ?)",
+                        ((url, mtime, size) for url, (mtime, size)
+                         in self.file_stats.iteritems()))
+        self.file_stats = {}
+
         cur.execute('delete from workspaces;')
         cur.executemany("insert into workspaces values (?)", 
                         [(i,) for i in self.workspaces])
@@ -200,6 +392,7 @@ class Collection(object):
             entity.id = self.max_id
         entity.was_updated = True
         self.entities[entity.id] = entity
+        self.urls[entity.url] = entity
         for child in entity.children:
             child.parent = entity
             self.add_entity(child)
@@ -243,6 +436,8 @@ class Collection(object):
             self.deleted_entities[entity.id] = entity
             if entity.id in self.entities:
                 del self.entities[entity.id]
+            if self.urls.get(entity.url) is entity:
+                del self.urls[entity.url]
         for child in entity.children:
             self.delete_entity(child)
 
@@ -288,18 +483,101 @@ class Collection(object):
         self.add_entity(entity)
         return entity
 
+    def get_file_stat(self, url):
+        """ Returns the (mtime, size) of the file when it was last indexed,
+        or None """
+        if url in self.file_stats:
+            return self.file_stats[url]
+        cur = self.conn.cursor()
+        cur.execute("select mtime, size from entity_file where url=?", (url,))
+        return cur.fetchone()
+
+    def is_version_indexed(self, url):
+        """ Returns whether the versions of this vistrail are in the version
+        index (always True if there is no index) """
+        if not self.has_version_index:
+            return True
+        cur = self.conn.cursor()
+        cur.execute("select 1 from version where url=? limit 1", (url,))
+        return cur.fetchone() is not None
+
+    def index_versions(self, url, vistrail):
+        """ Replaces the versions of this vistrail in the version index """
+        if not self.has_version_index:
+            return
+        self.unindex_versions(url)
+        cur = self.conn.cursor()
+        for row in iter_version_texts(vistrail):
+            cur.execute("insert into version(url, version, date) "
+                        "values (?, ?, ?)", (url, row[0], row[1]))
+            cur.execute("insert into version_text(rowid, user, name, notes, "
+                        "modules, params) values (?, ?, ?, ?, ?, ?)",
+                        (cur.lastrowid,) + row[2:])
+
+    def unindex_versions(self, url):
+        if not self.has_version_index:
+            return
+        cur = self.conn.cursor()
+        cur.execute("delete from version_text where rowid in "
+                    "(select id from version where url=?)", (url,))
+        cur.execute("delete from version where url=?", (url,))
+
+    def search_versions(self, search_str, use_regex=False, urls=None):
+        """ search_versions(search_str: str, use_regex: bool,
+                            urls: list) -> dict
+
+        Runs a version search (see core.query.version) on the version index
+        and returns the matching versions as {url: set(version)}, optionally
+        only for the given urls. Returns None if the search can't be done
+        using the index; it has to be run on the vistrails instead.
+
+        """
+        if not self.has_version_index:
+            return None
+        sql = SearchCompiler(search_str, use_regex).searchStmt.to_sql()
+        if sql is None:
+            return None
+        condition, params = sql
+        if urls is not None:
+            urls = list(urls)
+            condition = '(%s) and url in (%s)' % (
+                    condition, ', '.join('?' * len(urls)))
+            params = params + urls
+        cur = self.conn.cursor()
+        cur.execute("select url, version from version where %s" % condition,
+                    params)
+        result = {}
+        for url, version in cur:
+            result.setdefault(url, set()).add(version)
+        return result
+
     def update_from_directory(self, directory):
+        """ Indexes the vistrails in directory, skipping the files that
+        didn't change since they were last indexed """
         filenames = glob.glob(os.path.join(directory, '*.vt'))
         for filename in filenames:
             locator = FileLocator(filename)
             url = locator.to_url()
+            st = os.stat(filename)
+            stat = (st.st_mtime, st.st_size)
+            if (self.get_file_stat(url) == stat and
+                    self.fromUrl(url) is not None and
+                    self.is_version_indexed(url)):
+                continue
             self.updateVistrail(url)
+            self.file_stats[url] = stat
 
     def fromUrl(self, url):
         """ Check if entity with this url exist in index and return it """
-        for e in self.entities.itervalues():
-            if e.url == url:
-                return e
+        entity = self.urls.get(url)
+        if entity is not None and entity.id in self.entities:
+            return entity
+        cur = self.conn.cursor()
+        cur.execute("select id from entity where url=? order by id", (url,))
+        for row in cur.fetchall():
+            entity = self.get_entity(row[0])
+            if entity is not None and entity.url == url:
+                return entity
         return None
 
     def urlExists(self, url):
@@ -314,8 +592,7 @@ class Collection(object):
         Update the specified entity url. Delete or reload as necessary.
         Need to make sure workspaces are updated if the entity is changed.
         """
-        entities = [e for e in self.entities.itervalues() if e.url == url]
-        entity = entities[0] if len(entities) else None
+        entity = self.fromUrl(url)
         while entity and entity.parent:
             entity = entity.parent 
             url = entity.url
@@ -335,8 +612,99 @@ class Collection(object):
             entity = self.create_vistrail_entity(vistrail)
             for p in workspaces:
                 self.add_to_workspace(entity, p)
+            self.index_versions(url, vistrail)
             return entity
         else:
             # probably an unsaved vistrail
-            pass
+            self.unindex_versions(url)
 #            debug.critical("Locator is not valid!")
+
+
+import unittest
+
+class TestCollection(unittest.TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+        self.database = os.path.join(self.directory, 'index.db')
+        examples = vistrails.core.system.vistrails_examples_directory()
+        for name in ('head.vt', 'triangle_area.vt'):
+            shutil.copy(os.path.join(examples, name), self.directory)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def test_incremental(self):
+        """Reopening reads entities lazily; unchanged files are skipped"""
+        collection = Collection(self.database)
+        collection.update_from_directory(self.directory)
+        url = FileLocator(os.path.join(self.directory, 'head.vt')).to_url()
+        entity = collection.fromUrl(url)
+        collection.add_to_workspace(entity)
+        children = sorted(child.url for child in entity.children)
+        total = len(collection.entities)
+        self.assertTrue(children)
+        collection.commit()
+        collection.conn.close()
+
+        collection = Collection(self.database)
+        self.assertEqual(collection.entities.keys(), [entity.id])
+        self.assertEqual(collection.workspaces['Default'][0].url, url)
+        loaded = collection.fromUrl(url)
+        self.assertEqual(sorted(child.url for child in loaded.children),
+                         children)
+        self.assertTrue(all(child.parent is loaded
+                            for child in loaded.children))
+        # Entities are found from their url, with their ancestors
+        child = Collection(self.database).fromUrl(children[0])
+        self.assertEqual(child.parent.url, url)
+        grandchild_url = child.children[0].url
+        grandchild = Collection(self.database).fromUrl(grandchild_url)
+        self.assertEqual(grandchild.parent.parent.url, url)
+
+        updated = []
+        def updateVistrail(url, vistrail=None):
+            updated.append(url)
+        collection.updateVistrail = updateVistrail
+        collection.update_from_directory(self.directory)
+        self.assertEqual(updated, [])
+        filename = os.path.join(self.directory, 'triangle_area.vt')
+        st = os.stat(filename)
+        os.utime(filename, (st.st_atime, st.st_mtime + 10))
+        collection.update_from_directory(self.directory)
+        self.assertEqual(updated, [FileLocator(filename).to_url()])
+
+        self.assertEqual(len(list(collection.get_current_entities())), total)
+        collection.conn.close()
+
+    def test_search_versions(self):
+        """The version index gives the same results as matching in Python"""
+        from vistrails.core.query.version import SearchCompiler
+        collection = Collection(self.database)
+        if not collection.has_version_index:
+            self.skipTest("the version index is not available")
+        collection.update_from_directory(self.directory)
+        filename = os.path.join(self.directory, 'head.vt')
+        url = FileLocator(filename).to_url()
+        vistrail = load_vistrail(FileLocator(filename))[0]
+        for search_str in ['module:vtkRender', 'user:E', 'name:a', 'param:0.',
+                           'vt', 'module:vtk after:1 jan 2000',
+                           'module:vtk before:1 jan 2000', 'name:head']:
+            stmt = SearchCompiler(search_str).searchStmt
+            expected = set(action.id
+                           for action in vistrail.actionMap.itervalues()
+                           if stmt.match(vistrail, action))
+            result = collection.search_versions(search_str, urls=[url])
+            self.assertEqual(result.get(url, set()), expected)
+        self.assertTrue(collection.search_versions('module:vtkRender')[url])
+        self.assertIsNone(collection.search_versions('vtk', use_regex=True))
+
+        # Saving re-indexes the vistrail
+        tag = vistrail.get_tagMap().iterkeys().next()
+        vistrail.set_tag(tag, 'zanzibar')
+        collection.updateVistrail(url, vistrail)
+        self.assertEqual(collection.search_versions('name:anzib'),
+                         {url: set([tag])})
+        collection.conn.close()
@@ -41,11 +41,24 @@ class Entity(object):
 
     def __init__(self):
         self.parent = None
-        self.children = []
+        self._children = []
+        # Set by Collection on entities read from the index, so that their
+        # children are only read when needed
+        self.load_children = None
         self.image_fnames = []
         self.was_updated = False
         self.is_open = False
 
+    def _get_children(self):
+        if self.load_children is not None:
+            load_children, self.load_children = self.load_children, None
+            self._children = load_children(self)
+        return self._children
+    def _set_children(self, children):
+        self.load_children = None
+        self._children = children
+    children = property(_get_children, _set_children)
+
     def load(self, *args):
         (self.id, 
          _, 
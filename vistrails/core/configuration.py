@@ -60,10 +60,14 @@ autoConnect: Automatically connect dragged in modules
 autoSave: Automatically save backup vistrails every two minutes
 batch: Run in batch mode instead of interactive mode
 cache: Cache previous results so they may be used in future computations
+cacheMemoryLimit: Memory used by cached results before evicting some (MB)
 dataDir: Default data directory
 db: The name for the database to load the vistrail from
 dbDefault: Save vistrails in a database by default
 debugLevel: How much information should VisTrails log
+diskCache: Store cacheable results on disk to reuse them across sessions
+diskCacheDir: Directory of the on-disk result cache
+diskCacheSize: On-disk result cache size (MB)
 defaultFileType: Default file type/extension for vistrails (.vt or .xml)
 detachHistoryView: Show the version tree in a separate window
 dotVistrails: User configuration directory
@@ -71,6 +75,8 @@ enablePackagesSilently: Automatically enable packages when needed
 errorLog: Write errors to a log file
 execute: Execute any specified workflows
 executionLog: Track execution provenance when running workflows
+executionLogStore: SQLite database indexing streamed module executions
+executionLogStream: File to which execution provenance is appended
 fileDir: Default vistrail directory
 fixedSpreadsheetCells: Draw spreadsheet cells at a fixed size
 handlerDontAsk: Do not ask about extension handling at startup
@@ -82,6 +88,7 @@ jobAutorun: Run jobs automatically when they finish
 jobCheckInterval: How often to check for jobs (in seconds)
 jobList: List running workflows
 jobInfo: List jobs in running workflow
+lazyPackages: Initialize packages when they are first used
 logDir: Log files directory
 maxRecentVistrails: Number of recent vistrails
 maximizeWindows: VisTrails windows should be maximized
@@ -89,8 +96,12 @@ migrateTags: Move tags to upgraded versions
 multiHeads: Use multiple screens for VisTrails windows
 multithread: Server will start a thread for each request
 packageDir: System packages directory
+parallelExecution: Run independent modules concurrently
+parallelThreads: Number of threads used to run modules concurrently
 parameterExploration: Run parameter exploration instead of workflow
 parameters: List of parameters to use when running workflow
+pipelineCacheSize: Number of materialized pipelines kept in memory
+pipelineCheckpoints: Actions between cached pipelines in the version tree
 port: The port for the database to load the vistrail from
 repositoryHTTPURL: Remote package repository URL
 repositoryLocalPath: Local package repository directory
@@ -110,6 +121,7 @@ showSplash: Show VisTrails splash screen during startup
 showSpreadsheetOnly: Hides the VisTrails main window
 showVariantErrors: Show error when variant input value doesn't match type during execution
 showWindow: Show the main window
+signatureHash: Hash function used for the cache signatures
 singleInstance: Do not allow more than one instance of VisTrails to run at once
 spreadsheetDumpCells: Defines the location for generated cells
 spreadsheetDumpPDF: Whether the spreadsheet should dump images in PDF format
@@ -153,6 +165,13 @@ cache: Boolean
 
     Cache previous results so they may be used in future computations.
 
+cacheMemoryLimit: Integer
+
+    The approximate amount of memory (in MB) cached results can use. When
+    it is exceeded after an execution, the results that were used least
+    recently and take the most memory are discarded, along with the
+    modules that depend on them. 0 means no limit.
+
 dataDir: Path
 
     The location that VisTrails uses as a default directory for data.
@@ -171,6 +190,20 @@ debugLevel: Integer
     Critical errors only, 1: Critical errors and warnings, 2: Critical
     errors, warnings, and log messages).
 
+diskCache: Boolean
+
+    Store the results of cacheable modules on disk so that they can be
+    reused by later sessions running the same upstream pipeline.
+
+diskCacheDir: Path
+
+    The directory used to store the on-disk result cache.
+
+diskCacheSize: Integer
+
+    The size (in MB) of the on-disk result cache. The least recently used
+    results are removed when it is full.
+
 defaultFileType: String
 
     Defaults to .vt but could be .xml.
@@ -201,6 +234,18 @@ executionLog: Boolean
 
     Track execution provenance when running workflows.
 
+executionLogStore: Path
+
+    If set along with executionLogStream, the module executions are also
+    added to this SQLite database (see vistrails.core.log.store), which
+    can be queried for the time spent in each module or cache hit rates.
+
+executionLogStream: Path
+
+    If set, each execution is appended to this file as it finishes,
+    instead of being kept in memory until the vistrail is saved. The
+    executions written there are not saved with the vistrail.
+
 fileDir: Path
 
     The location that VisTrails uses as a default directory for
@@ -247,6 +292,12 @@ jobInfo: Boolean
 
     List jobs in running workflow
 
+lazyPackages: Boolean
+
+    Only initialize the enabled packages when one of their modules is first
+    looked up, instead of at startup. This makes batch runs of workflows
+    that only use a few packages start faster.
+
 logDir: Path
 
     The path that indicates where log files should be stored.
@@ -304,6 +355,18 @@ packageDir: Path
     The directory to look for VisTrails core packages (use
     userPackageDir for user-defined packages).
 
+parallelExecution: Boolean
+
+    Run the modules of a workflow whose inputs are ready concurrently on
+    worker threads. The sinks of the workflow still run on the main
+    thread. Parallel execution can also be enabled for a single module
+    through its 'parallel' control parameter.
+
+parallelThreads: Integer
+
+    The number of worker threads used for parallel execution (0 means
+    one per processor).
+
 parameterExploration: Boolean
 
     Open and execute parameter exploration specified by the
@@ -313,6 +376,20 @@ parameters: String
 
     List of parameters to use when running workflow.
 
+pipelineCacheSize: Integer
+
+    The number of materialized pipelines each open vistrail keeps in
+    memory, so that switching back to them is fast. The pipelines that
+    were used least recently are discarded first; tagged versions count
+    towards that limit like the checkpoints. 0 means no limit.
+
+pipelineCheckpoints: Integer
+
+    When switching to a version, a copy of the pipeline is also kept for
+    the versions along the way whose depth in the version tree is a
+    multiple of this number, so that materializing any version takes at
+    most that many actions from a cached pipeline. 0 disables checkpoints.
+
 port: Integer
 
     The port for the database to load the vistrail from.
@@ -412,6 +489,13 @@ showWindow: Boolean
 
     Show the main VisTrails window.
 
+signatureHash: String
+
+    The hash function used to compute the signatures that identify
+    pipelines in the cache: sha1 (the default), md5, blake2b (Python
+    3.6+) or xxh128 (if the xxhash module is installed). Changing it
+    invalidates cached and on-disk results.
+
 singleInstance: Boolean
 
     Whether or not VisTrails should only allow one instance to be
@@ -637,8 +721,24 @@ base_config = {
     [ConfigField('autoSave', True, bool, ConfigType.ON_OFF),
      ConfigField('dbDefault', False, bool, ConfigType.ON_OFF),
      ConfigField('cache', True, bool, ConfigType.ON_OFF),
+     ConfigField('cacheMemoryLimit', 0, int, depends_on="cache"),
+     ConfigField('diskCache', False, bool, ConfigType.ON_OFF,
+                 depends_on="cache"),
+     ConfigField('diskCacheDir', "results", ConfigPath,
+                 depends_on="diskCache"),
+     ConfigField('diskCacheSize', 1024, int, depends_on="diskCache"),
+     ConfigField('signatureHash', 'sha1', str, depends_on="cache"),
+     ConfigField('pipelineCacheSize', 200, int),
+     ConfigField('pipelineCheckpoints', 50, int),
      ConfigField('stopOnError', True, bool, ConfigType.ON_OFF),
+     ConfigField('parallelExecution', False, bool, ConfigType.ON_OFF),
+     ConfigField('parallelThreads', 0, int,
+                 depends_on="parallelExecution"),
      ConfigField('executionLog', True, bool, ConfigType.ON_OFF),
+     ConfigField('executionLogStream', None, ConfigPath,
+                 depends_on="executionLog"),
+     ConfigField('executionLogStore', None, ConfigPath,
+                 depends_on="executionLogStream"),
      ConfigField('errorLog', True, bool, ConfigType.ON_OFF),
      ConfigField('defaultFileType', system.vistrails_default_file_type(), str,
                  widget_type="combo",
@@ -701,6 +801,7 @@ base_config = {
      ConfigField('installBundles', True, bool, ConfigType.ON_OFF),
      ConfigField('installBundlesWithPip', False, bool, ConfigType.ON_OFF,
                  depends_on="installBundles"),
+     ConfigField('lazyPackages', False, bool, ConfigType.ON_OFF),
      ConfigField('repositoryLocalPath', None, ConfigPath),
      ConfigField('repositoryHTTPURL', "http://www.vistrails.org/packages",
                  ConfigURL)],
@@ -60,7 +60,7 @@ class Bidict(dict):
         v = self[key]
         dict.__delitem__(self, key)
         # Might not be true if mapping was not bijective
-        if v in self.inverse:
+        if self.inverse.get(v) == key:
             del self.inverse[v]
 
     def __copy__(self):
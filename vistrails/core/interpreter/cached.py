@@ -37,8 +37,15 @@ import base64
 import copy
 import gc
 import cPickle as pickle
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import Queue
+import threading
 
+from vistrails.core.cache.disk import DiskCache
+from vistrails.core.cache.utils import estimate_size
 from vistrails.core.common import InstanceObject, VistrailsInternalError
+from vistrails.core.configuration import get_vistrails_configuration
 from vistrails.core.data_structures.bijectivedict import Bidict
 from vistrails.core import debug
 import vistrails.core.interpreter.base
@@ -48,11 +55,13 @@ from vistrails.core.log.controller import DummyLogController
 from vistrails.core.modules.basic_modules import identifier as basic_pkg, \
                                                  Generator
 from vistrails.core.modules.module_registry import get_module_registry
+from vistrails.core.modules.sub_module import Group
 from vistrails.core.modules.vistrails_module import ModuleBreakpoint, \
     ModuleConnector, ModuleError, ModuleErrors, ModuleHadError, \
     ModuleSuspended, ModuleWasSuspended
 from vistrails.core.utils import DummyView
 import vistrails.core.system
+from vistrails.core.vistrail.module_control_param import ModuleControlParam
 import vistrails.core.vistrail.pipeline
 
 
@@ -190,6 +199,69 @@ class ViewUpdatingLogController(object):
     def add_exec(self, exec_):
         return self.log.add_exec(exec_)
 
+###############################################################################
+# Parallel execution helpers
+
+class MainThreadCalls(object):
+    """Defers the calls made from worker threads until the main thread runs
+    them.
+
+    The views and the execution hooks usually touch the GUI, so they can
+    only be used from the main thread.
+    """
+    def __init__(self):
+        self.main_thread = threading.current_thread()
+        self.pending = Queue.Queue()
+
+    def wrap(self, callable_):
+        def wrapper(*args, **kwargs):
+            if threading.current_thread() is self.main_thread:
+                self.run_pending()
+                callable_(*args, **kwargs)
+            else:
+                self.pending.put((callable_, args, kwargs))
+        return wrapper
+
+    def run_pending(self):
+        while True:
+            try:
+                callable_, args, kwargs = self.pending.get_nowait()
+            except Queue.Empty:
+                return
+            callable_(*args, **kwargs)
+
+
+class DeferredView(object):
+    """Wraps a view so that it is only updated from the main thread.
+    """
+    def __init__(self, view, calls):
+        self._view = view
+        self._calls = calls
+
+    def __getattr__(self, name):
+        return self._calls.wrap(getattr(self._view, name))
+
+
+class LockedLogging(object):
+    """Wraps a logging object so that modules running on worker threads
+    don't update the log concurrently.
+    """
+    def __init__(self, logging_obj, lock):
+        self._logging = logging_obj
+        self._lock = lock
+
+    def __getattr__(self, name):
+        attr = getattr(self._logging, name)
+        if not callable(attr):
+            return attr
+        def locked(*args, **kwargs):
+            with self._lock:
+                result = attr(*args, **kwargs)
+            if isinstance(result, ViewUpdatingLogController.Loop):
+                result = LockedLogging(result, self._lock)
+            return result
+        return locked
+
 ###############################################################################
 
 Variant_desc = None
@@ -210,6 +282,15 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         self._objects = {}
         self.filePool = self._file_pool
         self._streams = []
+        self._disk_cache = None
+        self._disk_cache_checked = False
+        conf = get_vistrails_configuration()
+        limit = conf is not None and conf.check('cacheMemoryLimit')
+        self._memory_limit = (limit or 0) * 1024 * 1024
+        self._last_used = {}
+        self._output_sizes = {}
+        self._use_count = 0
+        self._execution_depth = 0
 
     def clear(self):
         self._file_pool.cleanup()
@@ -217,6 +298,8 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         for obj in self._objects.itervalues():
             obj.clear()
         self._objects = {}
+        self._last_used = {}
+        self._output_sizes = {}
 
     def __del__(self):
         self.clear()
@@ -235,6 +318,8 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         for v in dependencies:
             self._persistent_pipeline.delete_module(v)
             del self._objects[v]
+            self._last_used.pop(v, None)
+            self._output_sizes.pop(v, None)
 
     def clean_non_cacheable_modules(self):
         """clean_non_cacheable_modules() -> None
@@ -258,6 +343,282 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
                    if mod.module_descriptor.identifier == identifier]
         self.clean_modules(modules)
 
+    def output_size(self, i):
+        """output_size(i: persistent module id) -> int
+
+        Returns the estimated memory used by the outputs of a module, once it
+        has been computed.
+        """
+        try:
+            return self._output_sizes[i]
+        except KeyError:
+            obj = self._objects[i]
+            if not obj.upToDate:
+                return 0
+            size = estimate_size(dict((port, value)
+                                      for port, value
+                                      in obj.outputPorts.iteritems()
+                                      if port != 'self'))
+            self._output_sizes[i] = size
+            return size
+
+    def enforce_memory_limit(self):
+        """enforce_memory_limit() -> None
+
+        Removes modules from the persistent pipeline until the estimated size
+        of the cached outputs fits in the cacheMemoryLimit setting.
+
+        Modules are picked by how many executions ago they were last used,
+        multiplied by the size of their outputs. Removing a module also
+        removes everything downstream of it. Modules used by the last
+        execution are always kept.
+        """
+        if not self._memory_limit:
+            return
+        total = sum(self.output_size(i) for i in self._objects)
+        while total > self._memory_limit:
+            candidates = [((self._use_count - self._last_used.get(i, 0)) *
+                           self.output_size(i), i)
+                          for i in self._objects
+                          if self._last_used.get(i, 0) < self._use_count]
+            candidates = [c for c in candidates if c[0] > 0]
+            if not candidates:
+                break
+            self.clean_modules([max(candidates)[1]])
+            total = sum(self.output_size(i) for i in self._objects)
+
+    def get_disk_cache(self):
+        """get_disk_cache() -> DiskCache
+
+        Returns the on-disk result cache, setting it up from the
+        configuration the first time. Returns None if it is disabled.
+        """
+        if not self._disk_cache_checked:
+            self._disk_cache_checked = True
+            self._disk_cache = None
+            conf = get_vistrails_configuration()
+            if conf is not None and conf.check('diskCache'):
+                directory = vistrails.core.system.get_vistrails_directory(
+                        'diskCacheDir', conf)
+                if directory is None:
+                    debug.warning("diskCacheDir is not set, disabling the "
+                                  "on-disk result cache")
+                    return None
+                try:
+                    self._disk_cache = DiskCache(
+                            directory, conf.diskCacheSize * 1024 * 1024)
+                except (IOError, OSError), e:
+                    debug.warning("Could not use %s for the on-disk result "
+                                  "cache" % directory, e)
+        return self._disk_cache
+
+    def disk_cacheable_modules(self):
+        """disk_cacheable_modules() -> set of persistent module ids
+
+        Returns the modules that are cacheable and only depend on cacheable
+        modules, i.e. whose results are entirely determined by their
+        subpipeline signature.
+        """
+        non_cacheable = [i for (i, obj) in self._objects.iteritems()
+                         if not obj.is_cacheable()]
+        if not non_cacheable:
+            return set(self._objects)
+        g = self._persistent_pipeline.graph
+        tainted = set(g.vertices_topological_sort(non_cacheable))
+        return set(self._objects) - tainted
+
+    def restore_from_disk_cache(self, disk_cache, module_ids):
+        """restore_from_disk_cache(disk_cache: DiskCache,
+                                     module_ids: list) -> set
+
+        Sets the outputs of the given persistent modules from the on-disk
+        cache when possible, so that neither they nor their upstream modules
+        get computed. Returns the ids of the restored modules.
+        """
+        restored = set()
+        cacheable = self.disk_cacheable_modules()
+        g = self._persistent_pipeline.graph
+        for i in module_ids:
+            obj = self._objects[i]
+            if i not in cacheable or obj.upToDate or \
+                    not disk_cache.has(obj.signature):
+                continue
+            # Don't restore if a connection uses a port that wasn't stored
+            # (like 'self')
+            used_ports = set(self._persistent_pipeline.connections[c]
+                                 .source.name
+                             for (_, c) in g.edges_from(i))
+            outputs = disk_cache.load(obj.signature, self._file_pool,
+                                      used_ports)
+            if outputs is None:
+                continue
+            for port, value in outputs.iteritems():
+                obj.set_output(port, value)
+            obj.upToDate = True
+            obj.restored_outputs = True
+            restored.add(i)
+        return restored
+
+    def store_in_disk_cache(self, disk_cache, module_ids):
+        """store_in_disk_cache(disk_cache: DiskCache,
+                                 module_ids: list) -> None
+
+        Writes the outputs of the given persistent modules, that were just
+        computed, to the on-disk cache.
+        """
+        cacheable = self.disk_cacheable_modules()
+        for i in module_ids:
+            obj = self._objects.get(i)
+            if obj is None or i not in cacheable or obj.restored_outputs:
+                continue
+            outputs = dict((port, value)
+                           for port, value in obj.outputPorts.iteritems()
+                           if port != 'self')
+            disk_cache.store(obj.signature, outputs)
+
+    def get_parallel_threads(self, tmp_id_to_module_map):
+        """get_parallel_threads(tmp_id_to_module_map) -> int
+
+        Returns the number of worker threads to use to execute the
+        pipeline, or 0 to execute it serially on the main thread.
+
+        Parallel execution is enabled for every module by the
+        parallelExecution setting, or for specific modules through the
+        'parallel' control parameter.
+        """
+        conf = get_vistrails_configuration()
+        enabled = conf is not None and conf.check('parallelExecution')
+        if not enabled:
+            enabled = any(
+                    obj.control_params.get(ModuleControlParam.PARALLEL_KEY,
+                                           '').lower() == 'true'
+                    for obj in tmp_id_to_module_map.itervalues())
+        if not enabled:
+            return 0
+        nb_threads = conf is not None and conf.check('parallelThreads')
+        if not nb_threads:
+            nb_threads = multiprocessing.cpu_count()
+        return max(nb_threads, 1)
+
+    def runs_in_worker(self, obj):
+        """runs_in_worker(obj: Module) -> bool
+
+        Whether this module can be updated on a worker thread.
+        """
+        if obj.upToDate or isinstance(obj, Group):
+            # Nothing to compute, or Groups that change the persistent
+            # pipeline
+            return False
+        value = obj.control_params.get(ModuleControlParam.PARALLEL_KEY)
+        if value:
+            return value.lower() == 'true'
+        conf = get_vistrails_configuration()
+        return bool(conf is not None and conf.check('parallelExecution'))
+
+    def update_parallel(self, pipeline, tmp_id_to_module_map, sinks,
+                        logging_obj, main_thread_calls, nb_threads,
+                        stop_on_error):
+        """update_parallel(...) -> bool
+
+        Updates the modules upstream of the given sinks, running modules
+        whose upstream modules are done on a pool of worker threads.
+        Errors are reported on the main thread like for the serial
+        execution. Returns True if the execution should be aborted.
+        """
+        if not sinks:
+            return False
+        graph = pipeline.graph
+        upstream = set(graph.inverse_immutable().vertices_topological_sort(
+                sinks))
+        upstream.difference_update(sinks)
+        waiting = dict((i, set(m for (m, _) in graph.edges_to(i)) & upstream)
+                       for i in upstream)
+        ready = [i for i, deps in waiting.iteritems() if not deps]
+        done = Queue.Queue()
+
+        def update(i, obj):
+            try:
+                obj.update()
+            except BaseException, e:
+                return i, e
+            return i, None
+
+        pool = ThreadPool(nb_threads)
+        running = 0
+        abort = False
+        try:
+            while ready or running:
+                while ready and not abort:
+                    i = ready.pop()
+                    obj = tmp_id_to_module_map[i]
+                    if self.runs_in_worker(obj):
+                        pool.apply_async(update, (i, obj),
+                                         callback=done.put)
+                    else:
+                        done.put(update(i, obj))
+                    running += 1
+                if not running:
+                    break
+                try:
+                    i, error = done.get(timeout=0.1)
+                except Queue.Empty:
+                    main_thread_calls.run_pending()
+                    continue
+                running -= 1
+                main_thread_calls.run_pending()
+                if error is not None:
+                    failed, abort_now = self.report_update_error(
+                            error, logging_obj)
+                    if abort_now or (failed and stop_on_error):
+                        abort = True
+                    if failed:
+                        # Downstream modules will not be run
+                        continue
+                for (m, _) in graph.edges_from(i):
+                    if m in waiting:
+                        waiting[m].discard(i)
+                        if not waiting[m]:
+                            ready.append(m)
+        finally:
+            pool.close()
+            pool.join()
+            main_thread_calls.run_pending()
+        return abort
+
+    def report_update_error(self, e, logging_obj):
+        """report_update_error(e: Exception, logging_obj) -> (bool, bool)
+
+        Reports an exception raised by a module's update(), the way the
+        serial execution loop does. Returns whether the module failed and
+        whether the execution should be aborted.
+        """
+        if isinstance(e, ModuleWasSuspended):
+            return False, False
+        elif isinstance(e, ModuleHadError):
+            return True, False
+        elif isinstance(e, AbortExecution):
+            return True, True
+        elif isinstance(e, ModuleSuspended):
+            e.module.logging.end_update(e.module, e, was_suspended=True)
+            return False, False
+        elif isinstance(e, ModuleErrors):
+            abort = False
+            for me in e.module_errors:
+                me.module.logging.end_update(me.module, me)
+                logging_obj.signalError(me.module, me)
+                abort = abort or me.abort
+            return True, abort
+        elif isinstance(e, ModuleError):
+            e.module.logging.end_update(e.module, e, e.errorTrace)
+            logging_obj.signalError(e.module, e)
+            return True, e.abort
+        elif isinstance(e, ModuleBreakpoint):
+            e.module.logging.end_update(e.module)
+            logging_obj.signalError(e.module, e)
+            return True, True
+        debug.unexpected_exception(e)
+        return True, True
+
     def make_connection(self, conn, src, dst):
         """make_connection(self, conn, src, dst)
         Builds a execution-time connection between modules.
@@ -413,12 +774,27 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
                 if connector:
                     obj.set_input_port(f.name, connector, is_method=True)
 
+        # Restore new modules from the on-disk cache
+        disk_cache = self.get_disk_cache()
+        if disk_cache is not None:
+            self.restore_from_disk_cache(
+                    disk_cache,
+                    [tmp_to_persistent_module_map[i]
+                     for i in module_added_set
+                     if tmp_to_persistent_module_map[i] not in to_delete])
+
         # Create the new connections
         for i in conn_added_set:
             persistent_id = conn_map[i]
             conn = self._persistent_pipeline.connections[persistent_id]
             src = self._objects[conn.sourceId]
             dst = self._objects[conn.destinationId]
+            if src.restored_outputs and \
+                    conn.source.name not in src.outputPorts:
+                # The disk cache didn't have this output, compute the module
+                # after all
+                src.restored_outputs = False
+                src.upToDate = False
             self.make_connection(conn, src, dst)
 
         if self.done_summon_hook:
@@ -429,6 +805,7 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         tmp_id_to_module_map = {}
         for i, j in tmp_to_persistent_module_map.iteritems():
             tmp_id_to_module_map[i] = self._objects[j]
+            self._last_used[j] = self._use_count
         return (tmp_id_to_module_map, tmp_to_persistent_module_map.inverse,
                 module_added_set, conn_added_set, to_delete, errors)
 
@@ -462,12 +839,24 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         def get_remapped_id(id):
             return persistent_to_tmp_id_map[id]
 
+        nb_threads = self.get_parallel_threads(tmp_id_to_module_map)
+        if nb_threads:
+            # Modules running on worker threads report through the main
+            # thread
+            main_thread_calls = MainThreadCalls()
+            view = DeferredView(view, main_thread_calls)
+            module_executed_hook = [main_thread_calls.wrap(hook)
+                                    for hook in module_executed_hook]
         logging_obj = ViewUpdatingLogController(
                 logger=logger,
                 view=view,
                 remap_id=get_remapped_id,
                 ids=pipeline.modules.keys(),
                 module_executed_hook=module_executed_hook)
+        if nb_threads:
+            module_logging = LockedLogging(logging_obj, threading.RLock())
+        else:
+            module_logging = logging_obj
 
         # PARAMETER CHANGES SETUP
         parameter_changes = []
@@ -480,7 +869,7 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         # Update **all** modules in the current pipeline
         for i, obj in tmp_id_to_module_map.iteritems():
             obj.in_pipeline = True # set flag to indicate in pipeline
-            obj.logging = logging_obj
+            obj.logging = module_logging
             obj.change_parameter = make_change_parameter(obj)
             
             # Update object pipeline information
@@ -510,6 +899,22 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         self._streams.append(Generator.generators)
         Generator.generators = []
 
+        abort = False
+        if nb_threads:
+            # Update the upstream modules concurrently; the sinks are then
+            # updated on the main thread below
+            if sinks is not None:
+                sink_ids = [sink for sink in sinks
+                            if sink in tmp_id_to_module_map]
+            else:
+                sink_ids = pipeline.graph.sinks()
+            abort = self.update_parallel(pipeline, tmp_id_to_module_map,
+                                         sink_ids, logging_obj,
+                                         main_thread_calls, nb_threads,
+                                         stop_on_error)
+            if abort:
+                persistent_sinks = []
+
         # Update new sinks
         for obj in persistent_sinks:
             abort = False
@@ -577,6 +982,10 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
 
         Generator.generators = self._streams.pop()
 
+        disk_cache = self.get_disk_cache()
+        if disk_cache is not None:
+            self.store_in_disk_cache(disk_cache, logging_obj.executed)
+
         if self.done_update_hook:
             self.done_update_hook(self._persistent_pipeline, self._objects)
                 
@@ -724,18 +1133,29 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         new_kwargs['logger'] = logger
         self.annotate_workflow_execution(logger, reason, aliases, params)
 
-        res = self.setup_pipeline(pipeline, **new_kwargs)
-        modules_added = res[2]
-        conns_added = res[3]
-        to_delete = res[4]
-        errors = res[5]
-        if len(errors) == 0:
-            res = self.execute_pipeline(pipeline, *(res[:2]), **new_kwargs)
-        else:
-            res = (to_delete, res[0], errors, {}, {}, {}, [])
-            for (i, error) in errors.iteritems():
-                view.set_module_error(i, error)
-        self.finalize_pipeline(pipeline, *(res[:-1]), **new_kwargs)
+        # Nested executions count as part of the outer one, so that they
+        # don't evict the modules it is using
+        if self._execution_depth == 0:
+            self._use_count += 1
+        self._execution_depth += 1
+        try:
+            res = self.setup_pipeline(pipeline, **new_kwargs)
+            modules_added = res[2]
+            conns_added = res[3]
+            to_delete = res[4]
+            errors = res[5]
+            if len(errors) == 0:
+                res = self.execute_pipeline(pipeline, *(res[:2]),
+                                            **new_kwargs)
+            else:
+                res = (to_delete, res[0], errors, {}, {}, {}, [])
+                for (i, error) in errors.iteritems():
+                    view.set_module_error(i, error)
+            self.finalize_pipeline(pipeline, *(res[:-1]), **new_kwargs)
+        finally:
+            self._execution_depth -= 1
+        if self._execution_depth == 0:
+            self.enforce_memory_limit()
 
         result = InstanceObject(objects=res[1],
                               errors=res[2],
@@ -780,7 +1200,7 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         connection_id_map = Bidict()
         modules_added = set()
         connections_added = set()
-        pipeline.refresh_signatures()
+        pipeline.compute_signatures()
         # we must traverse vertices in topological sort order
         verts = pipeline.graph.vertices_topological_sort()
         for new_module_id in verts:
@@ -829,7 +1249,7 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         object_map = {}
         module_id_map = {}
         connection_id_map = {}
-        pipeline.refresh_signatures()
+        pipeline.compute_signatures()
         # we must traverse vertices in topological sort order
         verts = pipeline.graph.vertices_topological_sort()
         for module_id in verts:
@@ -870,6 +1290,24 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
             CachedInterpreter.__instance.create()
         objs = gc.collect()
 
+    @staticmethod
+    def set_memory_limit(limit):
+        """set_memory_limit(limit: int) -> None
+
+        Changes the memory limit of the cached results, in MB (0 disables
+        it), evicting modules right away if needed.
+        """
+        instance = CachedInterpreter.__instance
+        if instance:
+            instance._memory_limit = (limit or 0) * 1024 * 1024
+            if instance._execution_depth == 0:
+                instance.enforce_memory_limit()
+
+    @staticmethod
+    def reset_disk_cache():
+        if CachedInterpreter.__instance:
+            CachedInterpreter.__instance._disk_cache_checked = False
+
     @staticmethod
     def clear_package(identifier):
         if CachedInterpreter.__instance:
@@ -928,6 +1366,159 @@ class TestCachedInterpreter(unittest.TestCase):
         finally:
             StandardOutput.compute = old_compute
 
+    @staticmethod
+    def make_concatenate_pipeline(strings, connections=[],
+                                  control_params={}):
+        """Builds a pipeline of ConcatenateString modules.
+
+        strings is a list of (str1, str2) values, None leaving the port
+        unset; connections is a list of (source index, destination index,
+        destination port).
+        """
+        from vistrails.core.packagemanager import get_package_manager
+        from vistrails.core.vistrail.connection import Connection
+        from vistrails.core.vistrail.module import Module
+        from vistrails.core.vistrail.module_function import ModuleFunction
+        from vistrails.core.vistrail.module_param import ModuleParam
+        from vistrails.core.vistrail.pipeline import Pipeline
+        from vistrails.core.vistrail.port import Port
+
+        version = get_package_manager().get_package(basic_pkg).version
+        pipeline = Pipeline()
+        for i, values in enumerate(strings):
+            functions = [ModuleFunction(name=name,
+                                        parameters=[ModuleParam(pos=0,
+                                                                type='String',
+                                                                val=val)])
+                         for name, val in zip(('str1', 'str2'), values)
+                         if val is not None]
+            module = Module(name='ConcatenateString', package=basic_pkg,
+                            version=version, id=i, functions=functions)
+            for name, value in control_params.get(i, {}).iteritems():
+                module.add_control_parameter(
+                        ModuleControlParam(name=name, value=value))
+            pipeline.add_module(module)
+        for i, (src, dst, dst_port) in enumerate(connections):
+            pipeline.add_connection(Connection(
+                    id=i,
+                    ports=[Port(id=i*2, type='source', moduleId=src,
+                                name='value',
+                                signature='(%s:String)' % basic_pkg),
+                           Port(id=i*2+1, type='destination', moduleId=dst,
+                                name=dst_port,
+                                signature='(%s:String)' % basic_pkg)]))
+        return pipeline
+
+    def test_disk_cache(self):
+        import shutil
+        import tempfile
+        from vistrails.core.modules.basic_modules import ConcatenateString
+
+        computed = []
+        old_compute = ConcatenateString.compute
+        def compute(self):
+            computed.append(self)
+            old_compute(self)
+        ConcatenateString.compute = compute
+        directory = tempfile.mkdtemp(prefix='vt_diskcache_')
+        try:
+            for i in xrange(2):
+                # A new interpreter doesn't have the in-memory cache
+                interpreter = CachedInterpreter()
+                interpreter._disk_cache = DiskCache(directory, 1024 * 1024)
+                interpreter._disk_cache_checked = True
+                result = interpreter.execute(self.make_concatenate_pipeline(
+                        [('disk', 'cache')]))
+                self.assertFalse(result.errors)
+                self.assertEqual(result.objects[0].get_output('value'),
+                                 'diskcache')
+                interpreter.clear()
+            self.assertEqual(len(computed), 1)
+        finally:
+            ConcatenateString.compute = old_compute
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def test_memory_limit(self):
+        """Modules not used recently are evicted above the memory limit."""
+        interpreter = CachedInterpreter()
+        try:
+            interpreter._memory_limit = 1024 * 1024
+            interpreter.execute(self.make_concatenate_pipeline(
+                    [('a' * 256 * 1024, 'b')]))
+            self.assertEqual(len(interpreter._objects), 1)
+            first, = interpreter._objects
+            # A second pipeline with a large result goes over the limit; the
+            # first one is evicted, the one just used is kept
+            interpreter.execute(self.make_concatenate_pipeline(
+                    [('c' * 1024 * 1024, 'd')]))
+            self.assertEqual(len(interpreter._objects), 1)
+            self.assertNotIn(first, interpreter._objects)
+            self.assertNotIn(first, interpreter._persistent_pipeline.modules)
+            # Without the limit, nothing is evicted
+            interpreter._memory_limit = 0
+            interpreter.execute(self.make_concatenate_pipeline(
+                    [('a' * 256 * 1024, 'b')]))
+            self.assertEqual(len(interpreter._objects), 2)
+        finally:
+            interpreter.clear()
+
+    def test_parallel(self):
+        """Two independent branches run at the same time."""
+        from vistrails.core.modules.basic_modules import ConcatenateString
+
+        started = []
+        both_started = threading.Event()
+        old_compute = ConcatenateString.compute
+        def compute(self):
+            if self.get_input('str1') in ('a', 'b'):
+                started.append(threading.current_thread())
+                if len(started) == 2:
+                    both_started.set()
+                # Only returns if the other branch runs concurrently
+                both_started.wait(5)
+            old_compute(self)
+        ConcatenateString.compute = compute
+        parallel = {ModuleControlParam.PARALLEL_KEY: 'true'}
+        try:
+            pipeline = self.make_concatenate_pipeline(
+                    [('a', '1'), ('b', '2'), (None, None)],
+                    [(0, 2, 'str1'), (1, 2, 'str2')],
+                    {0: parallel, 1: parallel})
+            interpreter = CachedInterpreter()
+            result = interpreter.execute(pipeline)
+            self.assertFalse(result.errors)
+            self.assertTrue(both_started.is_set())
+            self.assertNotIn(threading.current_thread(), started)
+            self.assertEqual(result.objects[2].get_output('value'), 'a1b2')
+            interpreter.clear()
+        finally:
+            ConcatenateString.compute = old_compute
+
+    def test_parallel_error(self):
+        """Errors on worker threads are reported like serial ones."""
+        from vistrails.core.modules.basic_modules import ConcatenateString
+
+        old_compute = ConcatenateString.compute
+        def compute(self):
+            if self.get_input('str1') == 'fail':
+                raise ModuleError(self, "failed on purpose")
+            old_compute(self)
+        ConcatenateString.compute = compute
+        parallel = {ModuleControlParam.PARALLEL_KEY: 'true'}
+        try:
+            pipeline = self.make_concatenate_pipeline(
+                    [('fail', '1'), ('b', '2'), (None, None)],
+                    [(0, 2, 'str1'), (1, 2, 'str2')],
+                    {0: parallel, 1: parallel})
+            interpreter = CachedInterpreter()
+            result = interpreter.execute(pipeline)
+            self.assertEqual(set(result.errors), set([0]))
+            self.assertIn("failed on purpose", result.errors[0].msg)
+            self.assertFalse(result.executed[2])
+            interpreter.clear()
+        finally:
+            ConcatenateString.compute = old_compute
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -32,6 +32,8 @@
 ## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
 ##
 ###############################################################################
+from vistrails.core.cache.hasher import Hasher
+from vistrails.core import debug
 import vistrails.core.interpreter.cached
 import vistrails.core.interpreter.noncached
 
@@ -44,14 +46,34 @@ __default_interpreter = cached_interpreter
 ##############################################################################
 
 def set_cache_configuration(field, value):
-    assert field == 'cache'
-    if value:
-        set_default_interpreter(cached_interpreter)
+    if field == 'cache':
+        if value:
+            set_default_interpreter(cached_interpreter)
+        else:
+            set_default_interpreter(noncached_interpreter)
+    elif field == 'cacheMemoryLimit':
+        cached_interpreter.set_memory_limit(value)
+    elif field == 'signatureHash':
+        try:
+            Hasher.set_hash_backend(value)
+        except ValueError, e:
+            debug.critical("Invalid signatureHash setting", e)
+            return
+        # Cached signatures were computed with the previous function
+        cached_interpreter.flush()
     else:
-        set_default_interpreter(noncached_interpreter)
+        assert field in ('diskCache', 'diskCacheDir', 'diskCacheSize')
+        # The disk cache is set up again from the configuration on the
+        # next execution
+        cached_interpreter.reset_disk_cache()
 
 def connect_to_configuration(configuration):
-    configuration.subscribe('cache', set_cache_configuration)
+    for field in ('cache', 'cacheMemoryLimit', 'diskCache', 'diskCacheDir',
+                  'diskCacheSize', 'signatureHash'):
+        configuration.subscribe(field, set_cache_configuration)
+    if configuration.check('signatureHash'):
+        set_cache_configuration('signatureHash',
+                                configuration.signatureHash)
 
 def get_default_interpreter():
     """Returns an instance of the default interpreter class."""
@@ -46,6 +46,10 @@ class Interpreter(vistrails.core.interpreter.cached.CachedInterpreter):
                                  (i, mod) in self._objects.iteritems()]
         self.clean_modules(non_cacheable_modules)
 
+    def get_disk_cache(self):
+        # Caching is disabled altogether
+        return None
+
     __instance = None
     @staticmethod
     def get():
@@ -72,7 +72,9 @@ class DummyLogController(object):
 class LogController(object):
     """The top-level log controller.
 
-    This holds a log.
+    This holds a log. If a stream is given (see
+    vistrails.core.log.stream.LogStreamWriter), executions are written to it
+    as they finish and removed from the log.
     """
     local_machine = Machine(
             id=-1,
@@ -82,8 +84,9 @@ class LogController(object):
             processor=vistrails.core.system.current_processor(),
             ram=vistrails.core.system.guess_total_memory())
 
-    def __init__(self, log, machine=None):
+    def __init__(self, log, machine=None, stream=None):
         self.log = log
+        self.stream = stream
         self.module_execs = {}      # vistrails_module -> *Exec
         self.parent_execs = {}      # vistrails_module -> *Exec
         self.children_execs = {}    # vistrails_module -> [*Exec]
@@ -133,7 +136,8 @@ class LogController(object):
         """Signals the start of the execution of a pipeline.
         """
         return LogWorkflowExecController(self.log, self.machine, parent_exec,
-                                         vistrail, pipeline, currentVersion)
+                                         vistrail, pipeline, currentVersion,
+                                         self.stream)
 
 
 class LogLoopController(object):
@@ -159,12 +163,16 @@ class LogLoopController(object):
             execs.discard(self.loop_exec)
         except KeyError:
             pass
+        if self.controller.stream is not None:
+            self.controller.stream.finish_item(self.loop_exec)
 
     def start_iteration(self, looped_module, iteration):
         """Signals that we are executing a module as an iteration of the loop.
         """
         loop_iteration = self._create_loop_iteration(iteration)
         self.loop_exec.add_loop_iteration(loop_iteration)
+        if self.controller.stream is not None:
+            self.controller.stream.start_item(loop_iteration, self.loop_exec)
         self.controller.parent_execs[looped_module] = loop_iteration
 
     def finish_iteration(self, looped_module):
@@ -175,6 +183,8 @@ class LogLoopController(object):
 
         loop_iteration.ts_end = vistrails.core.system.current_time()
         loop_iteration.completed = 1
+        if self.controller.stream is not None:
+            self.controller.stream.finish_item(loop_iteration)
 
 
 class LogWorkflowController(LogController):
@@ -200,8 +210,8 @@ class LogWorkflowController(LogController):
            finished with the same error as the module if it fails before they
            end
     """
-    def __init__(self, log, machine, parent_exec, workflow_exec):
-        super(LogWorkflowController, self).__init__(log, machine)
+    def __init__(self, log, machine, parent_exec, workflow_exec, stream=None):
+        super(LogWorkflowController, self).__init__(log, machine, stream)
         self.parent_exec = parent_exec
         self.workflow_exec = workflow_exec
 
@@ -213,7 +223,7 @@ class LogWorkflowController(LogController):
         if parent_exec in self.module_execs:
             parent_exec = self.module_execs[parent_exec]
         return LogWorkflowController(self.log, self.machine, parent_exec,
-                                     self.workflow_exec)
+                                     self.workflow_exec, self.stream)
 
     def get_iteration_from_module(self, module):
         """If executing this module as part of a loop, gets the iteration;
@@ -247,6 +257,9 @@ class LogWorkflowController(LogController):
                             self.workflow_exec):
             if parent_exec is not None:
                 parent_exec.add_item_exec(module_exec)
+                if self.stream is not None:
+                    self.stream.start_item(module_exec, parent_exec,
+                                           getattr(module, 'signature', None))
                 return
         assert False
 
@@ -263,7 +276,10 @@ class LogWorkflowController(LogController):
                     parent_exec.add_loop_exec(loop_exec)
                 break
         else:
-            self.workflow_exec.add_item_exec(loop_exec)
+            parent_exec = self.workflow_exec
+            parent_exec.add_item_exec(loop_exec)
+        if self.stream is not None:
+            self.stream.start_item(loop_exec, parent_exec)
         self.children_execs.setdefault(loop_module, set()).add(loop_exec)
         return LogLoopController(self, loop_exec, loop_module)
 
@@ -304,6 +320,10 @@ class LogWorkflowController(LogController):
             else:
                 child.completed = -1
                 child.error = error
+            if self.stream is not None:
+                self.stream.finish_item(child)
+        if self.stream is not None:
+            self.stream.finish_item(module_exec)
 
     def insert_module_annotations(self, module, a_dict):
         """Adds an annotation on the execution object for this module.
@@ -345,7 +365,7 @@ class LogWorkflowExecController(LogWorkflowController):
     obtained through recursing(), don't.
     """
     def __init__(self, log, machine, parent_exec, vistrail=None, pipeline=None,
-                 currentVersion=None):
+                 currentVersion=None, stream=None):
         if vistrail is not None:
             parent_type = Vistrail.vtType
             parent_id = vistrail.id
@@ -371,8 +391,10 @@ class LogWorkflowExecController(LogWorkflowController):
                 session=session,
                 machines=[machine])
         log.add_workflow_exec(workflow_exec)
+        if stream is not None:
+            stream.start_workflow(workflow_exec)
 
-        super(LogWorkflowExecController, self).__init__(log, machine, parent_exec, workflow_exec)
+        super(LogWorkflowExecController, self).__init__(log, machine, parent_exec, workflow_exec, stream)
 
     def finish_workflow_execution(self, errors, suspended=False):
         """Signals the end of the execution of a pipeline.
@@ -384,3 +406,6 @@ class LogWorkflowExecController(LogWorkflowController):
             self.workflow_exec.completed = -1
         else:
             self.workflow_exec.completed = 1
+        if self.stream is not None:
+            self.stream.finish_workflow(self.workflow_exec)
+            self.log.db_delete_workflow_exec(self.workflow_exec)
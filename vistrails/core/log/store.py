@@ -0,0 +1,339 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+"""Columnar store of module executions, for analytic queries.
+
+A ProvenanceStore keeps one row per module execution in an indexed SQLite
+table, with the columns needed to aggregate costs over many runs (module
+name, signature, machine, start time, duration, cached flag, completion and
+error), so that questions such as "which modules cost the most this week"
+are answered by the database without reading any XML log.
+
+It is filled either by a LogStreamWriter while executing, or by importing
+existing logs with add_workflow_exec(), import_log() or import_stream().
+"""
+
+import datetime
+import sqlite3
+import time
+
+from vistrails.core.log.group_exec import GroupExec
+from vistrails.core.log.loop_exec import LoopExec, LoopIteration
+from vistrails.core.log.module_exec import ModuleExec
+from vistrails.core.log.workflow_exec import WorkflowExec
+
+
+schema = ["create table if not exists workflow_exec("
+          "id integer primary key, user text, parent_type text, "
+          "parent_id integer, parent_version integer, ts_start real, "
+          "duration real, completed integer)",
+          "create table if not exists module_exec("
+          "workflow_exec integer, module_id integer, module_name text, "
+          "signature text, machine text, ts_start real, duration real, "
+          "cached integer, completed integer, error text)",
+          "create index if not exists module_exec_ts_start "
+          "on module_exec(ts_start)",
+          "create index if not exists module_exec_module_name "
+          "on module_exec(module_name, ts_start)",
+          "create index if not exists module_exec_signature "
+          "on module_exec(signature)",
+          "create index if not exists module_exec_workflow_exec "
+          "on module_exec(workflow_exec)"]
+
+
+def to_timestamp(ts):
+    """Converts a datetime (as found in the logs) to seconds since epoch.
+
+    Numbers are returned unchanged, and None stays None.
+    """
+    if ts is None or isinstance(ts, (int, long, float)):
+        return ts
+    return time.mktime(ts.timetuple()) + ts.microsecond / 1e6
+
+def _duration(ts_start, ts_end):
+    if ts_start is None or ts_end is None:
+        return None
+    delta = ts_end - ts_start
+    return delta.days * 86400.0 + delta.seconds + delta.microseconds / 1e6
+
+
+class ProvenanceStore(object):
+    """SQLite table of module executions.
+
+    Rows are buffered and inserted flush_size at a time; the transaction is
+    committed when a workflow execution is finished, at the end of an
+    import, or on flush().
+    """
+    def __init__(self, database=None, flush_size=1000):
+        if database is None:
+            database = ':memory:'
+        self.database = database
+        self.flush_size = flush_size
+        self.conn = sqlite3.connect(database, check_same_thread=False)
+        cur = self.conn.cursor()
+        for s in schema:
+            cur.execute(s)
+        self.conn.commit()
+        self._rows = []
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def _insert_rows(self):
+        if self._rows:
+            self.conn.executemany("insert into module_exec values "
+                                  "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                  self._rows)
+            self._rows = []
+
+    def flush(self):
+        self._insert_rows()
+        self.conn.commit()
+
+    ##########################################################################
+    # Filling the store
+
+    def start_workflow_exec(self, workflow_exec):
+        """Adds a row for a workflow execution and returns its id.
+        """
+        cur = self.conn.execute(
+                "insert into workflow_exec (user, parent_type, parent_id, "
+                "parent_version, ts_start, completed) "
+                "values (?, ?, ?, ?, ?, ?)",
+                (workflow_exec.user, workflow_exec.parent_type,
+                 workflow_exec.parent_id, workflow_exec.parent_version,
+                 to_timestamp(workflow_exec.ts_start),
+                 workflow_exec.completed))
+        return cur.lastrowid
+
+    def add_module_exec(self, workflow_row, module_exec, machines,
+                        signature=None):
+        """Adds a module or group execution, and the executions nested in it.
+
+        machines maps machine ids to Machine objects, as
+        WorkflowExec.machines does.
+        """
+        stack = [(module_exec, signature)]
+        while stack:
+            item, signature = stack.pop()
+            if item.vtType == ModuleExec.vtType:
+                name = item.module_name
+                children = [loop for loop in item.loop_execs]
+            elif item.vtType == GroupExec.vtType:
+                name = item.group_name
+                children = list(item.item_execs)
+            elif item.vtType == LoopExec.vtType:
+                stack.extend((i, None) for i in item.loop_iterations)
+                continue
+            elif item.vtType == LoopIteration.vtType:
+                stack.extend((i, None) for i in item.item_execs)
+                continue
+            else:
+                continue
+            machine = machines.get(item.machine_id)
+            self._rows.append((
+                    workflow_row, item.module_id, name, signature,
+                    machine.name if machine is not None else None,
+                    to_timestamp(item.ts_start),
+                    _duration(item.ts_start, item.ts_end),
+                    item.cached, item.completed, item.error or None))
+            stack.extend((c, None) for c in children)
+        if len(self._rows) >= self.flush_size:
+            self._insert_rows()
+
+    def finish_workflow_exec(self, workflow_row, workflow_exec, commit=True):
+        """Records the end of a workflow execution, with the executions still
+        attached to it, and commits unless commit is False.
+        """
+        for item in workflow_exec.item_execs:
+            self.add_module_exec(workflow_row, item, workflow_exec.machines)
+        self.conn.execute(
+                "update workflow_exec set duration=?, completed=? "
+                "where id=?",
+                (_duration(workflow_exec.ts_start, workflow_exec.ts_end),
+                 workflow_exec.completed, workflow_row))
+        if commit:
+            self.flush()
+
+    def add_workflow_exec(self, workflow_exec, commit=True):
+        """Adds a whole workflow execution, for instance from a saved log.
+        """
+        workflow_row = self.start_workflow_exec(workflow_exec)
+        self.finish_workflow_exec(workflow_row, workflow_exec, commit)
+        return workflow_row
+
+    def import_log(self, log):
+        """Adds all the workflow executions of a Log, in one transaction.
+        """
+        for workflow_exec in log.workflow_execs:
+            self.add_workflow_exec(workflow_exec, False)
+        self.flush()
+
+    def import_stream(self, filename):
+        """Adds the workflow executions of a file written by LogStreamWriter,
+        reading one workflow execution at a time, in one transaction.
+        """
+        from vistrails.core.log.stream import iter_workflow_execs
+        for workflow_exec in iter_workflow_execs(filename):
+            self.add_workflow_exec(workflow_exec, False)
+        self.flush()
+
+    ##########################################################################
+    # Queries
+
+    def _where(self, since, until, module_name=None):
+        clauses = ["duration is not null"]
+        params = []
+        if since is not None:
+            clauses.append("ts_start >= ?")
+            params.append(to_timestamp(since))
+        if until is not None:
+            clauses.append("ts_start < ?")
+            params.append(to_timestamp(until))
+        if module_name is not None:
+            clauses.append("module_name = ?")
+            params.append(module_name)
+        return ' where ' + ' and '.join(clauses), params
+
+    def module_costs(self, since=None, until=None, limit=None):
+        """Returns the total time spent in each module, most costly first.
+
+        Returns a list of (module_name, executions, total, mean, max) tuples;
+        cached executions are counted as executions but cost nothing. since
+        and until are datetimes or timestamps.
+        """
+        where, params = self._where(since, until)
+        query = ("select module_name, count(*), sum(duration), "
+                 "avg(duration), max(duration) from module_exec" + where +
+                 " group by module_name order by sum(duration) desc")
+        if limit is not None:
+            query += " limit %d" % int(limit)
+        return self.conn.execute(query, params).fetchall()
+
+    def cache_hit_rates(self, since=None, until=None):
+        """Returns how often each module was found in the cache.
+
+        Returns a list of (module_name, executions, cached, rate) tuples,
+        ordered by module name.
+        """
+        where, params = self._where(since, until)
+        rows = self.conn.execute(
+                "select module_name, count(*), sum(cached != 0) "
+                "from module_exec" + where +
+                " group by module_name order by module_name",
+                params).fetchall()
+        return [(name, count, cached, float(cached) / count)
+                for name, count, cached in rows]
+
+    def timing_histogram(self, module_name, bins=10, since=None, until=None):
+        """Returns a histogram of the duration of a module's executions.
+
+        Returns (edges, counts), where edges has bins + 1 values and counts
+        bins values, like numpy.histogram(). Cached executions are ignored.
+        """
+        where, params = self._where(since, until, module_name)
+        where += " and cached = 0"
+        low, high = self.conn.execute(
+                "select min(duration), max(duration) from module_exec" +
+                where, params).fetchone()
+        if low is None:
+            return [], []
+        width = (high - low) / bins or 1.0
+        edges = [low + i * width for i in xrange(bins + 1)]
+        counts = [0] * bins
+        for b, count in self.conn.execute(
+                "select cast((duration - ?) / ? as integer) as b, count(*) "
+                "from module_exec" + where + " group by b",
+                [low, width] + params):
+            counts[min(b, bins - 1)] += count
+        return edges, counts
+
+
+import unittest
+
+class TestProvenanceStore(unittest.TestCase):
+    def make_workflow_exec(self, start, durations, cached=()):
+        from vistrails.core.log.machine import Machine
+
+        workflow_exec = WorkflowExec(id=1, user='user', ts_start=start,
+                                     ts_end=start, completed=1,
+                                     parent_type='vistrail', parent_id=1,
+                                     parent_version=3)
+        workflow_exec.add_machine(Machine(id=1, name='host'))
+        ts = start
+        for i, (name, duration) in enumerate(durations):
+            end = ts + datetime.timedelta(seconds=duration)
+            module_exec = ModuleExec(id=i, module_id=i, module_name=name,
+                                     machine_id=1, ts_start=ts, ts_end=end,
+                                     cached=int(i in cached), completed=1)
+            workflow_exec.add_item_exec(module_exec)
+            ts = end
+        workflow_exec.ts_end = ts
+        return workflow_exec
+
+    def test_queries(self):
+        store = ProvenanceStore()
+        week = datetime.datetime(2014, 3, 10)
+        # This one is too old
+        store.add_workflow_exec(self.make_workflow_exec(
+                week - datetime.timedelta(days=3), [('Old', 100.0)]))
+        store.add_workflow_exec(self.make_workflow_exec(
+                week, [('A', 1.0), ('B', 5.0), ('A', 2.0), ('A', 0.0)],
+                cached=(3,)))
+        store.add_workflow_exec(self.make_workflow_exec(
+                week + datetime.timedelta(days=1), [('A', 3.0), ('C', 0.5)]))
+
+        costs = store.module_costs(since=week)
+        self.assertEqual([(n, c, t) for n, c, t, _, _ in costs],
+                         [('A', 4, 6.0), ('B', 1, 5.0), ('C', 1, 0.5)])
+        self.assertEqual(store.module_costs(since=week, limit=1)[0][0], 'A')
+        self.assertEqual(store.module_costs()[0][0], 'Old')
+
+        self.assertEqual(store.cache_hit_rates(since=week),
+                         [('A', 4, 1, 0.25), ('B', 1, 0, 0.0),
+                          ('C', 1, 0, 0.0)])
+
+        edges, counts = store.timing_histogram('A', bins=2)
+        self.assertEqual(edges, [1.0, 2.0, 3.0])
+        self.assertEqual(counts, [1, 2])
+        self.assertEqual(store.timing_histogram('D'), ([], []))
+
+        row = store.conn.execute(
+                "select machine, ts_start from module_exec "
+                "where module_name='C'").fetchone()
+        self.assertEqual(row[0], 'host')
+        self.assertAlmostEqual(row[1], to_timestamp(
+                week + datetime.timedelta(days=1, seconds=3)))
@@ -0,0 +1,408 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+"""Append-only execution log.
+
+A LogStreamWriter can be given to a LogController in place of keeping the
+whole Log in memory: each module, group, loop and loop iteration execution
+is written to the file as soon as it is finished, and is then removed from
+its parent, so that only the executions in progress are kept. The file is a
+sequence of records, each made of a header line followed by the XML
+serialization of one object; iter_workflow_execs() reads them back one
+workflow execution at a time, and read_log() builds a whole Log.
+
+The finished module executions can also be added to a ProvenanceStore (see
+vistrails.core.log.store), along with the signature of their module.
+"""
+
+import os
+import threading
+import time
+
+from vistrails.core.db.io import serialize, unserialize
+from vistrails.core.log.group_exec import GroupExec
+from vistrails.core.log.log import Log
+from vistrails.core.log.loop_exec import LoopExec, LoopIteration
+from vistrails.core.log.module_exec import ModuleExec
+from vistrails.core.log.store import ProvenanceStore
+from vistrails.core.log.workflow_exec import WorkflowExec
+
+
+_exec_classes = dict((klass.vtType, klass)
+                     for klass in (WorkflowExec, ModuleExec, GroupExec,
+                                   LoopExec, LoopIteration))
+
+
+def _add_child(parent, child):
+    if parent.vtType == LoopExec.vtType:
+        parent.add_loop_iteration(child)
+    elif parent.vtType == ModuleExec.vtType:
+        parent.add_loop_exec(child)
+    else:
+        parent.add_item_exec(child)
+
+def _remove_child(parent, child):
+    if parent.vtType == LoopExec.vtType:
+        parent.db_delete_loop_iteration(child)
+    elif parent.vtType == ModuleExec.vtType:
+        parent.db_delete_loop_exec(child)
+    else:
+        parent.db_delete_item_exec(child)
+
+
+class LogStreamWriter(object):
+    """Writes executions to an append-only file as they finish.
+
+    Records are buffered and written once flush_size of them are pending, or
+    when flush_interval seconds have passed since the last write, and at the
+    end of each workflow execution. If a ProvenanceStore is given, module
+    executions are also added to it.
+    """
+    def __init__(self, filename, flush_size=1000, flush_interval=1.0,
+                 store=None):
+        self.filename = filename
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.store = store
+        self._file = open(filename, 'ab')
+        self._lock = threading.RLock()
+        self._pending = []
+        self._last_flush = time.time()
+        self._next_workflow = 0
+        self._workflows = {}    # id(workflow_exec) -> workflow key
+        self._parents = {}      # id(*Exec) -> (parent, workflow key,
+                                #               signature)
+        self._store_rows = {}   # workflow key -> (row id, machines)
+
+    def _write(self, kind, workflow, obj, parent=None):
+        xml = serialize(obj)
+        if parent is not None:
+            parent_type, parent_id = parent.vtType, parent.db_id
+        else:
+            parent_type, parent_id = '-', -1
+        self._pending.append('%s %d %s %s %d %d\n%s\n' % (
+                kind, workflow, obj.vtType, parent_type, parent_id,
+                len(xml), xml))
+        if (len(self._pending) >= self.flush_size or
+                time.time() - self._last_flush >= self.flush_interval):
+            self.flush()
+
+    def start_workflow(self, workflow_exec):
+        """Records the start of a workflow execution.
+        """
+        with self._lock:
+            workflow = self._next_workflow
+            self._next_workflow += 1
+            self._workflows[id(workflow_exec)] = workflow
+            self._write('start', workflow, workflow_exec)
+            if self.store is not None:
+                self._store_rows[workflow] = (
+                        self.store.start_workflow_exec(workflow_exec),
+                        workflow_exec.machines)
+
+    def start_item(self, item_exec, parent_exec, signature=None):
+        """Remembers the parent of an execution that was just started.
+        """
+        with self._lock:
+            try:
+                workflow = self._workflows[id(parent_exec)]
+            except KeyError:
+                try:
+                    workflow = self._parents[id(parent_exec)][1]
+                except KeyError:
+                    return
+            self._parents[id(item_exec)] = (parent_exec, workflow, signature)
+
+    def finish_item(self, item_exec):
+        """Writes a finished execution and removes it from its parent.
+        """
+        with self._lock:
+            try:
+                parent_exec, workflow, signature = self._parents.pop(
+                        id(item_exec))
+            except KeyError:
+                return
+            self._write('exec', workflow, item_exec, parent_exec)
+            _remove_child(parent_exec, item_exec)
+            if (self.store is not None and
+                    item_exec.vtType in (ModuleExec.vtType, GroupExec.vtType)):
+                row, machines = self._store_rows[workflow]
+                self.store.add_module_exec(row, item_exec, machines,
+                                           signature)
+
+    def finish_workflow(self, workflow_exec):
+        """Writes a finished workflow execution, with the executions that
+        are still attached to it.
+        """
+        with self._lock:
+            workflow = self._workflows.pop(id(workflow_exec), None)
+            if workflow is None:
+                return
+            self._write('end', workflow, workflow_exec)
+            self.flush()
+            if self.store is not None:
+                row, machines = self._store_rows.pop(workflow)
+                self.store.finish_workflow_exec(row, workflow_exec)
+
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                self._file.write(''.join(self._pending))
+                self._pending = []
+            self._file.flush()
+            self._last_flush = time.time()
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._file.close()
+            if self.store is not None:
+                self.store.close()
+
+
+_log_streams = {}
+_log_streams_lock = threading.Lock()
+
+def get_log_stream(filename, store_filename=None):
+    """Returns the LogStreamWriter for that file, creating it if needed.
+
+    If store_filename is given, a new writer also fills a ProvenanceStore in
+    that SQLite database.
+    """
+    filename = os.path.abspath(filename)
+    with _log_streams_lock:
+        try:
+            return _log_streams[filename]
+        except KeyError:
+            store = None
+            if store_filename:
+                store = ProvenanceStore(store_filename)
+            stream = _log_streams[filename] = LogStreamWriter(filename,
+                                                              store=store)
+            return stream
+
+
+def iter_workflow_execs(filename):
+    """Reads the workflow executions from a file written by LogStreamWriter.
+
+    Workflow executions are yielded in the order they finished, each with
+    all of its items; only the executions of the workflows that are still
+    being read are kept in memory. Workflow executions that never finished
+    are yielded at the end, with the items that were written. A truncated
+    last record is ignored.
+    """
+    workflows = {}  # workflow key -> [start record, objects, pending]
+
+    def add(workflow, obj, parent_type, parent_id):
+        objects, pending = workflows.setdefault(workflow, [None, {}, {}])[1:]
+        key = (obj.vtType, obj.db_id)
+        children = pending.pop(key, ())
+        for child in sorted(children, key=lambda c: c.db_id):
+            _add_child(obj, child)
+        objects[key] = obj
+        if parent_type != '-':
+            parent = objects.get((parent_type, parent_id))
+            if parent is not None:
+                _add_child(parent, obj)
+            else:
+                pending.setdefault((parent_type, parent_id), []).append(obj)
+
+    def finish(workflow, workflow_exec=None):
+        start, objects, pending = workflows.pop(workflow)
+        if workflow_exec is None:
+            if start is None:
+                return None
+            workflow_exec = start
+        # Items whose parent was never written are kept on the workflow
+        for key in sorted(pending.keys()):
+            for child in sorted(pending[key], key=lambda c: c.db_id):
+                workflow_exec.add_item_exec(child)
+        return workflow_exec
+
+    f = open(filename, 'rb')
+    try:
+        while True:
+            header = f.readline()
+            if not header.endswith('\n'):
+                break
+            try:
+                (kind, workflow, vt_type, parent_type, parent_id,
+                 length) = header.split()
+                workflow, parent_id, length = (int(workflow), long(parent_id),
+                                               int(length))
+            except ValueError:
+                break
+            xml = f.read(length + 1)
+            if len(xml) != length + 1:
+                break
+            obj = unserialize(xml[:-1], _exec_classes[vt_type])
+            if kind == 'start':
+                workflows.setdefault(workflow, [None, {}, {}])[0] = obj
+            elif kind == 'exec':
+                add(workflow, obj, parent_type, parent_id)
+            elif kind == 'end':
+                workflows.setdefault(workflow, [None, {}, {}])
+                add(workflow, obj, '-', -1)
+                yield finish(workflow, obj)
+        for workflow in sorted(workflows.keys()):
+            workflow_exec = finish(workflow)
+            if workflow_exec is not None:
+                yield workflow_exec
+    finally:
+        f.close()
+
+def read_log(filename):
+    """Builds a Log from a file written by LogStreamWriter.
+
+    Workflow executions are given new ids, since several logs can write to
+    the same file.
+    """
+    log = Log()
+    for workflow_exec in iter_workflow_execs(filename):
+        workflow_exec.db_id = log.id_scope.getNewId(WorkflowExec.vtType)
+        log.add_workflow_exec(workflow_exec)
+    return log
+
+
+import unittest
+
+class TestLogStream(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        fd, self.filename = tempfile.mkstemp(suffix='.log')
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def run_loop(self, stream, iterations):
+        from vistrails.core.log.controller import LogController
+        from vistrails.core.vistrail.pipeline import Pipeline
+
+        log = Log()
+        pipeline = Pipeline()
+        pipeline.id = 1
+        logger = LogController(log, stream=stream)
+        wf_logger = logger.start_workflow_execution(None, pipeline=pipeline)
+        loop, looped, other = object(), object(), object()
+        wf_logger.start_execution(other, 2, 'Other')
+        wf_logger.finish_execution(other, None)
+        wf_logger.start_execution(loop, 1, 'Map')
+        loop_logger = wf_logger.start_loop_execution(loop, iterations)
+        for i in xrange(iterations):
+            loop_logger.start_iteration(looped, i)
+            wf_logger.start_execution(looped, 3, 'Looped')
+            wf_logger.insert_module_annotations(looped, {'i': str(i)})
+            wf_logger.finish_execution(looped, None)
+            loop_logger.finish_iteration(looped)
+        loop_logger.finish_loop_execution()
+        wf_logger.finish_execution(loop, 'failed', 'trace')
+        wf_logger.finish_workflow_execution(['failed'])
+        return log
+
+    def check_log(self, log, iterations):
+        self.assertEqual(len(log.workflow_execs), 1)
+        workflow_exec = log.workflow_execs[0]
+        self.assertEqual(workflow_exec.completed, -1)
+        self.assertEqual([e.module_name for e in workflow_exec.item_execs],
+                         ['Other', 'Map'])
+        map_exec = workflow_exec.item_execs[1]
+        self.assertEqual(map_exec.completed, -1)
+        self.assertEqual(map_exec.annotations[0].value, 'trace')
+        loop_exec, = map_exec.loop_execs
+        self.assertEqual([it.iteration for it in loop_exec.loop_iterations],
+                         range(iterations))
+        for i, iteration in enumerate(loop_exec.loop_iterations):
+            module_exec, = iteration.item_execs
+            self.assertEqual(module_exec.completed, 1)
+            self.assertEqual(module_exec.annotations[0].value, str(i))
+
+    def test_stream(self):
+        """Streamed executions are removed from memory and read back"""
+        stream = LogStreamWriter(self.filename, flush_size=10)
+        log = self.run_loop(stream, 25)
+        self.assertEqual(len(log.workflow_execs), 0)
+        stream.close()
+        self.check_log(self.run_loop(None, 25), 25)
+        self.check_log(read_log(self.filename), 25)
+
+    def test_store(self):
+        """Module executions are added to the store as they finish"""
+        stream = LogStreamWriter(self.filename, store=ProvenanceStore())
+        self.run_loop(stream, 5)
+        store = stream.store
+        self.assertEqual(
+                sorted((name, count) for name, count, _, _, _ in
+                       store.module_costs()),
+                [('Looped', 5), ('Map', 1), ('Other', 1)])
+        self.assertEqual(store.conn.execute(
+                "select count(*) from module_exec "
+                "where machine is not null").fetchone(), (7,))
+        self.assertEqual(store.conn.execute(
+                "select completed from workflow_exec").fetchall(), [(-1,)])
+        stream.close()
+
+    def test_flush(self):
+        """Records are written in bounded batches"""
+        stream = LogStreamWriter(self.filename, flush_size=10,
+                                 flush_interval=3600)
+        try:
+            stream.start_workflow(WorkflowExec(id=1))
+            self.assertEqual(os.path.getsize(self.filename), 0)
+            for i in xrange(9):
+                stream.start_workflow(WorkflowExec(id=i + 2))
+            self.assertNotEqual(os.path.getsize(self.filename), 0)
+            self.assertEqual(stream._pending, [])
+        finally:
+            stream.close()
+
+    def test_truncated(self):
+        """Unfinished workflows and truncated records are recovered"""
+        stream = LogStreamWriter(self.filename)
+        self.run_loop(stream, 3)
+        self.run_loop(stream, 2)
+        stream.close()
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        # Cut the 'end' record of the second workflow execution
+        with open(self.filename, 'wb') as f:
+            f.write(data[:data.rindex('end ') + 20])
+        workflow_execs = list(iter_workflow_execs(self.filename))
+        self.assertEqual(len(workflow_execs), 2)
+        self.assertEqual(workflow_execs[0].completed, -1)
+        self.assertEqual(workflow_execs[1].completed, 0)
+        self.assertEqual([e.module_name
+                          for e in workflow_execs[1].item_execs],
+                         ['Other', 'Map'])
@@ -35,6 +35,7 @@
 """basic_modules defines basic VisTrails Modules that are used in most
 pipelines."""
 import vistrails.core.cache.hasher
+from vistrails.core.cache.utils import new_hash
 from vistrails.core.debug import format_exception
 from vistrails.core.modules.module_registry import get_module_registry
 from vistrails.core.modules.vistrails_module import Module, new_module, \
@@ -56,13 +57,6 @@ import shutil
 import zipfile
 import urllib
 
-try:
-    import hashlib
-    sha_hash = hashlib.sha1
-except ImportError:
-    import sha
-    sha_hash = sha.new
-
 ###############################################################################
 
 version = '2.1.1'
@@ -397,7 +391,7 @@ def path_parameter_hasher(p):
         t = get_mtime(p.strValue)
     except OSError:
         return h
-    hasher = sha_hash()
+    hasher = new_hash()
     hasher.update(h)
     hasher.update(str(t))
     return hasher.digest()
@@ -972,6 +966,33 @@ class Unpickle(Module):
 
 ##############################################################################
 
+# Compiled code of the source modules, by hash of the source
+_compiled_code = {}
+_COMPILED_CODE_MAX = 256
+
+def compile_code(code_str):
+    """compile_code(code_str: str) -> code
+
+    Compiles a piece of code for run_code(), reusing the code object if the
+    same source was already compiled.
+    """
+    hasher = new_hash()
+    if isinstance(code_str, unicode):
+        hasher.update(code_str.encode('utf-8'))
+    else:
+        hasher.update(code_str)
+    key = hasher.digest()
+    try:
+        return _compiled_code[key]
+    except KeyError:
+        pass
+    # Python 2.6 needs code to end with newline
+    code = compile(code_str + '\n', '<string>', 'exec')
+    if len(_compiled_code) >= _COMPILED_CODE_MAX:
+        _compiled_code.clear()
+    _compiled_code[key] = code
+    return code
+
 class CodeRunnerMixin(object):
     def __init__(self):
         self.output_ports_order = []
@@ -1011,8 +1032,7 @@ class CodeRunnerMixin(object):
                         'self': self})
         if 'source' in locals_:
             del locals_['source']
-        # Python 2.6 needs code to end with newline
-        exec code_str + '\n' in locals_, locals_
+        exec compile_code(code_str) in locals_, locals_
         if use_output:
             for k in self.output_ports_order:
                 if locals_.get(k) != None:
@@ -1031,16 +1051,21 @@ class PythonSource(CodeRunnerMixin, NotCacheable, Module):
     fail(error_message).
 
     If you want a PythonSource execution to be cached, call
-    cache_this().
+    cache_this(). If the code only depends on its inputs, set the 'pure'
+    port instead: it will then be cached like other modules, by its source
+    and the signature of its inputs.
     """
     _settings = ModuleSettings(
         configure_widget=("vistrails.gui.modules.python_source_configure:"
                              "PythonSourceConfigurationWidget"))
-    _input_ports = [IPort('source', 'String', optional=True, default="")]
+    _input_ports = [IPort('source', 'String', optional=True, default=""),
+                    IPort('pure', 'Boolean', optional=True, default=False)]
     _output_pors = [OPort('self', 'Module')]
 
     def compute(self):
         s = urllib.unquote(str(self.get_input('source')))
+        if self.get_input('pure'):
+            self.is_cacheable = lambda *args, **kwargs: True
         self.run_code(s, use_input=True, use_output=True)
 
 ##############################################################################
@@ -1620,6 +1645,32 @@ class TestPythonSource(unittest.TestCase):
                 ]))
         self.assertEqual(results[-1], "nb is 42")
 
+    def test_pure(self):
+        """PythonSource is only cacheable if it is declared pure"""
+        import urllib2
+        from vistrails.tests.utils import execute, intercept_result
+        source = urllib2.quote('r = self.is_cacheable()')
+        for pure in (False, True):
+            with intercept_result(PythonSource, 'r') as results:
+                self.assertFalse(execute([
+                        ('PythonSource', 'org.vistrails.vistrails.basic', [
+                            ('source', [('String', source)]),
+                            ('pure', [('Boolean', str(pure))]),
+                        ]),
+                    ],
+                    add_port_specs=[
+                        (0, 'output', 'r',
+                         'org.vistrails.vistrails.basic:Boolean'),
+                    ]))
+            self.assertEqual(results, [pure])
+
+    def test_compiled_code(self):
+        """The code is only compiled once"""
+        code = compile_code('a = 1')
+        self.assertIs(compile_code('a = 1'), code)
+        self.assertIsNot(compile_code('a = 2'), code)
+        self.assertIs(compile_code(u'a = 1'), code)
+
 
 class TestNumericConversions(unittest.TestCase):
     def test_full(self):
@@ -528,6 +528,10 @@ class ModuleRegistry(DBRegistry):
     def set_defaults(self, other=None):
         self._root_descriptor = None
         self.signals = ModuleRegistrySignals()
+        # Called with a package identifier before looking it up, so that
+        # packages can be initialized on demand (see
+        # PackageManager.initialize_lazy_package())
+        self.lazy_package_loader = None
         self.setup_indices()
         if other is None:
             # _constant_hasher_map stores callables for custom parameter
@@ -686,6 +690,8 @@ class ModuleRegistry(DBRegistry):
     # Per-module registry functions
 
     def get_package_by_name(self, identifier, package_version=''):
+        if self.lazy_package_loader is not None:
+            self.lazy_package_loader(identifier)
         package_version = package_version or ''
         package_version_key = (identifier, package_version)
 #         if package_version is not None and package_version.strip() == "":
@@ -713,6 +719,8 @@ class ModuleRegistry(DBRegistry):
 
     def has_descriptor_with_name(self, identifier, name, namespace='',
                                  package_version='', module_version=''):
+        if self.lazy_package_loader is not None:
+            self.lazy_package_loader(identifier)
         namespace = namespace or ''
         package_version = package_version or ''
         module_version = module_version or ''
@@ -749,6 +757,8 @@ class ModuleRegistry(DBRegistry):
 
         Raises a ModuleRegistryException if lookup fails.
         """
+        if self.lazy_package_loader is not None:
+            self.lazy_package_loader(identifier)
         namespace = namespace or ''
         package_version = package_version or ''
         module_version = module_version or ''
@@ -853,6 +863,8 @@ class ModuleRegistry(DBRegistry):
         legacy vistrails to new ones. For one, it is slow on misses. 
 
         """
+        if self.lazy_package_loader is not None:
+            self.lazy_package_loader(None)
         matches = []
         for pkg in self.package_list:
             matches.extend((pkg, key) for key in pkg.descriptors.iterkeys()
@@ -39,7 +39,7 @@ import random
 import uuid
 
 from vistrails.core.cache.hasher import Hasher
-from vistrails.core.cache.utils import hash_list
+from vistrails.core.cache.utils import hash_list, new_hash
 from vistrails.core.modules import module_registry
 from vistrails.core.modules.basic_modules import identifier as basic_pkg
 from vistrails.core.modules.config import ModuleSettings, IPort, OPort
@@ -48,17 +48,10 @@ from vistrails.core.modules.vistrails_module import Module, InvalidOutput, new_m
 from vistrails.core.utils import VistrailsInternalError
 import os.path
 
-try:
-    import hashlib
-    sha_hash = hashlib.sha1
-except ImportError:
-    import sha
-    sha_hash = sha.new
-
 ##############################################################################
 
 def random_signature(pipeline, obj, chm):
-    hasher = sha_hash()
+    hasher = new_hash()
     hasher.update(str(random.random()))
     return hasher.digest()
 
@@ -34,11 +34,15 @@
 ###############################################################################
 from base64 import b16encode, b16decode
 import copy
+import cPickle
+from itertools import count, izip, product
 import json
+import multiprocessing
+import os
 import time
-from itertools import izip, product
 import warnings
 
+from vistrails.core.cache.utils import new_hash
 from vistrails.core.data_structures.bijectivedict import Bidict
 from vistrails.core import debug
 from vistrails.core.configuration import get_vistrails_configuration
@@ -46,12 +50,6 @@ from vistrails.core.modules.config import ModuleSettings, IPort, OPort
 from vistrails.core.vistrail.module_control_param import ModuleControlParam
 from vistrails.core.utils import VistrailsDeprecation, deprecated, \
                                  xor, long2bytes
-try:
-    import hashlib
-    sha1_hash = hashlib.sha1
-except ImportError:
-    import sha
-    sha1_hash = sha.new
 
 class NeedsInputPort(Exception):
     def __init__(self, obj, port):
@@ -184,6 +182,64 @@ class DummyModuleLogging(object):
 
 _dummy_logging = DummyModuleLogging()
 
+################################################################################
+# Process-pool looping
+
+# Looped modules waiting for a pool, keyed by a token sent to the workers.
+# Workers are forked, so they find the function creating the iterations and
+# its inputs here without having to pickle them
+_loop_tasks = {}
+_loop_tokens = count()
+_in_loop_worker = False
+
+def _init_loop_worker():
+    global _in_loop_worker
+    _in_loop_worker = True
+
+def _run_loop_chunk(args):
+    """Runs some iterations of a looped module in a worker process.
+
+    Returns a list of (status, ...) tuples that Module.set_loop_result()
+    replays in the parent process.
+    """
+    token, iterations = args
+    make_iteration, port_names, elements = _loop_tasks[token]
+    results = []
+    for i in iterations:
+        iteration = make_iteration(port_names, elements, i)
+        # The logging object is the parent's: it reports to its view and log,
+        # and might wrap a lock another of its threads held when we forked
+        iteration.logging = _dummy_logging
+        try:
+            iteration.update()
+        except ModuleSuspended, e:
+            try:
+                cPickle.dumps(e.handle, cPickle.HIGHEST_PROTOCOL)
+                handle = e.handle
+            except Exception:
+                handle = None
+            results.append(('suspended', e.msg, handle))
+            continue
+        except ModuleError, e:
+            results.append(('error', e.msg, e.errorTrace))
+            continue
+        except ModuleErrors, e:
+            results.append(('error', str(e), None))
+            continue
+        outputs = dict((port, value)
+                       for port, value in iteration.outputPorts.iteritems()
+                       if port != 'self')
+        try:
+            cPickle.dumps(outputs, cPickle.HIGHEST_PROTOCOL)
+        except Exception, e:
+            results.append(('error',
+                            "Results of iteration %d can't be sent back "
+                            "from the worker process: %s" % (i, e),
+                            None))
+        else:
+            results.append(('ok', outputs))
+    return results
+
 ################################################################################
 # Serializable
 
@@ -332,6 +388,10 @@ class Module(Serializable):
         # execution log
         self.annotate_output = False
 
+        # set when the outputs were restored from the on-disk result cache,
+        # in which case the upstream modules don't need to be updated
+        self.restored_outputs = False
+
     def transfer_attrs(self, module):
         if module.cache != 1:
             self.is_cacheable = lambda *args: False
@@ -563,7 +623,7 @@ class Module(Serializable):
         elif self.computed:
             return
         self.logging.begin_update(self)
-        if not self.setJobCache():
+        if not (self.restored_outputs or self.setJobCache()):
             self.update_upstream()
         if self.upToDate:
             if not self.computed:
@@ -652,6 +712,109 @@ class Module(Serializable):
             return self.control_params[ModuleControlParam.LOOP_KEY]
         return default
 
+    def get_loop_processes(self):
+        """Returns the number of processes the iterations of this module
+        should run on, or 0 to run them in this process.
+
+        """
+        value = self.control_params.get(
+                ModuleControlParam.LOOP_PROCESSES_KEY)
+        if not value or _in_loop_worker:
+            return 0
+        try:
+            processes = int(value)
+        except ValueError:
+            raise ModuleError(self, "Invalid number of loop processes: %r" %
+                                    value)
+        if not hasattr(os, 'fork'):
+            # Workers need to inherit the module, they can't unpickle it
+            debug.warning("Running iterations in processes needs fork(), "
+                          "running them in this process instead")
+            return 0
+        if processes <= 0:
+            processes = multiprocessing.cpu_count()
+        return processes
+
+    def make_loop_iteration(self, port_names, elements, i):
+        """Creates the copy of this module that runs iteration i.
+
+        """
+        module = copy.copy(self)
+        module.list_depth = self.list_depth - 1
+        module.had_error = False
+        module.was_suspended = False
+
+        if not self.upToDate: # pragma: no partial
+            ## Type checking if first iteration and last iteration level
+            if i == 0 and self.list_depth == 1:
+                self.typeChecking(module, port_names, elements)
+
+            module.upToDate = False
+            module.computed = False
+            self.setInputValues(module, port_names, elements[i], i)
+        return module
+
+    def run_loop_processes(self, processes, port_names, elements,
+                           make_iteration=None):
+        """Runs the iterations on a pool of forked processes.
+
+        This generates the results of the iterations in order, to be given to
+        set_loop_result(). Iterations are sent to the workers in chunks.
+        make_iteration(port_names, elements, i) creates the module to update
+        for iteration i, it defaults to make_loop_iteration().
+
+        """
+        if make_iteration is None:
+            make_iteration = self.make_loop_iteration
+        num_inputs = len(elements)
+        chunksize, extra = divmod(num_inputs, processes * 4)
+        if extra:
+            chunksize += 1
+        chunks = [xrange(i, min(i + chunksize, num_inputs))
+                  for i in xrange(0, num_inputs, chunksize)]
+
+        token = next(_loop_tokens)
+        _loop_tasks[token] = (make_iteration, port_names, elements)
+        try:
+            pool = multiprocessing.Pool(min(processes, len(chunks)),
+                                        _init_loop_worker)
+            try:
+                for chunk in pool.imap(_run_loop_chunk,
+                                       [(token, c) for c in chunks]):
+                    for result in chunk:
+                        yield result
+            finally:
+                pool.terminate()
+        finally:
+            del _loop_tasks[token]
+
+    def set_loop_result(self, result):
+        """Replays an iteration that was run by run_loop_processes().
+
+        This makes the same logging calls update() would have made, sets the
+        outputs computed by the worker, or raises its error.
+
+        """
+        self.logging.begin_update(self)
+        self.had_error = True
+        self.logging.begin_compute(self)
+        status = result[0]
+        if status == 'suspended':
+            self.had_error, self.was_suspended = False, True
+            raise ModuleSuspended(self, result[1], handle=result[2])
+        elif status == 'error':
+            error = ModuleError(self, result[1])
+            if result[2] is not None:
+                error.errorTrace = result[2]
+            raise error
+        self.outputPorts.update(result[1])
+        self.computed = True
+        if self.annotate_output:
+            self.annotate_output_values()
+        self.upToDate = True
+        self.had_error = False
+        self.logging.end_update(self)
+
     def compute_all(self):
         """This method executes the module once for each input.
            Similarly to controlflow's fold.
@@ -684,45 +847,45 @@ class Module(Serializable):
         elements, port_names = self.do_combine(combine_type, inputs, port_names)
         num_inputs = len(elements)
         loop = self.logging.begin_loop_execution(self, num_inputs)
+        processes = self.get_loop_processes()
+        if processes and num_inputs > 1:
+            results = self.run_loop_processes(processes, port_names, elements)
+        else:
+            results = None
         ## Update everything for each value inside the list
         outputs = {}
-        for i in xrange(num_inputs):
-            self.logging.update_progress(self, float(i)/num_inputs)
-            module = copy.copy(self)
-            module.list_depth = self.list_depth - 1
-            module.had_error = False
-            module.was_suspended = False
-
-            if not self.upToDate: # pragma: no partial
-                ## Type checking if first iteration and last iteration level
-                if i == 0 and self.list_depth == 1:
-                    self.typeChecking(module, port_names, elements)
+        try:
+            for i in xrange(num_inputs):
+                self.logging.update_progress(self, float(i)/num_inputs)
+                module = self.make_loop_iteration(port_names, elements, i)
 
-                module.upToDate = False
-                module.computed = False
-                self.setInputValues(module, port_names, elements[i], i)
+                loop.begin_iteration(module, i)
 
-            loop.begin_iteration(module, i)
+                try:
+                    if results is None:
+                        module.update()
+                    else:
+                        module.set_loop_result(results.next())
+                except ModuleSuspended, e:
+                    e.loop_iteration = i
+                    module.logging.end_update(module, e, was_suspended=True)
+                    suspended.append(e)
+                    loop.end_iteration(module)
+                    continue
 
-            try:
-                module.update()
-            except ModuleSuspended, e:
-                e.loop_iteration = i
-                module.logging.end_update(module, e, was_suspended=True)
-                suspended.append(e)
                 loop.end_iteration(module)
-                continue
-
-            loop.end_iteration(module)
 
-            ## Getting the result from the output port
-            for nameOutput in module.outputPorts:
-                if nameOutput not in outputs:
-                    outputs[nameOutput] = []
-                output = module.get_output(nameOutput)
-                outputs[nameOutput].append(output)
+                ## Getting the result from the output port
+                for nameOutput in module.outputPorts:
+                    if nameOutput not in outputs:
+                        outputs[nameOutput] = []
+                    output = module.get_output(nameOutput)
+                    outputs[nameOutput].append(output)
 
-            self.logging.update_progress(self, i * 1.0 / num_inputs)
+                self.logging.update_progress(self, i * 1.0 / num_inputs)
+        finally:
+            if results is not None:
+                results.close()
 
         if suspended:
             raise ModuleSuspended(
@@ -1068,11 +1231,12 @@ class Module(Serializable):
             # anywhere though...
             # The fake signature is
             # XOR(signature(loop module), iteration, hash(inputPort))
-            inputPort_hash = sha1_hash()
+            inputPort_hash = new_hash()
             inputPort_hash.update(inputPort)
+            signature = b16decode(self.signature.upper())
             module.signature = b16encode(xor(
-                    b16decode(self.signature.upper()),
-                    long2bytes(iteration, 20),
+                    signature,
+                    long2bytes(iteration, len(signature)),
                     inputPort_hash.digest()))
 
     Variant_desc = None
@@ -1876,3 +2040,44 @@ class TestImplicitLooping(unittest.TestCase):
 
     def test_list_custom(self):
         self.run_vt("test-list-custom.vt")
+
+    def run_concatenate_loop(self, control_params=[], view=None):
+        from vistrails.core.modules.basic_modules import ConcatenateString
+        from vistrails.tests.utils import execute, intercept_result
+        with intercept_result(ConcatenateString, 'value') as results:
+            self.assertFalse(execute([
+                    ('List', 'org.vistrails.vistrails.basic', [
+                        ('value', [('List', repr(list('abcdefghij')))]),
+                    ]),
+                    ('ConcatenateString', 'org.vistrails.vistrails.basic', [
+                        ('str2', [('String', '!')]),
+                    ]),
+                ],
+                [
+                    (0, 'value', 1, 'str1'),
+                ],
+                control_params=control_params,
+                view=view))
+        return results
+
+    def test_loop_processes(self):
+        """Runs the iterations on a process pool, keeping their order.
+        """
+        expected = [c + '!' for c in 'abcdefghij']
+        results = self.run_concatenate_loop()
+        self.assertEqual(results, expected + [expected])
+        results = self.run_concatenate_loop(
+                [(1, ModuleControlParam.LOOP_PROCESSES_KEY, '3')])
+        # Iterations were computed in the workers, only the final list was
+        # set here
+        self.assertEqual(results, [expected])
+
+    def test_loop_processes_logging(self):
+        """Checks that the workers don't report to the parent's view.
+        """
+        from vistrails.tests.utils import record_view_calls
+        with record_view_calls() as (view, calls):
+            self.run_concatenate_loop(
+                    [(1, ModuleControlParam.LOOP_PROCESSES_KEY, '3')], view)
+        self.assertIn((os.getpid(), 'set_module_computing'), calls)
+        self.assertEqual(set(pid for pid, name in calls), set([os.getpid()]))
@@ -41,10 +41,12 @@ import inspect
 import itertools
 import os
 import sys
+import time
 import warnings
 
 from vistrails.core import debug, get_vistrails_application, system
-from vistrails.core.configuration import ConfigurationObject
+from vistrails.core.configuration import ConfigurationObject, \
+    get_vistrails_configuration
 import vistrails.core.data_structures.graph
 import vistrails.core.db.io
 from vistrails.core.modules.module_registry import ModuleRegistry, \
@@ -171,6 +173,12 @@ class PackageManager(object):
         self._abstraction_pkg = None
         self._currently_importing_package = None
 
+        # Packages whose initialization is deferred until they are first
+        # looked up, see initialize_lazy_package()
+        self._lazy_packages = {} # identifier or old identifier -> Package
+        self._load_times = {} # codepath: str -> seconds
+        self._init_times = {} # codepath: str -> seconds
+
         # Setup a global __import__ hook that calls Package#import_override()
         # for all imports executed from that package
         import __builtin__
@@ -254,6 +262,8 @@ class PackageManager(object):
         self._package_list = {}
         self._package_versions = {}
         self._old_identifier_map = {}
+        self._lazy_packages = {}
+        self._registry.lazy_package_loader = None
         global _package_manager
         _package_manager = None
 
@@ -299,6 +309,9 @@ class PackageManager(object):
         from vistrails.core.interpreter.cached import CachedInterpreter
         CachedInterpreter.clear_package(pkg.identifier)
 
+        self._forget_lazy_package(pkg)
+        self._load_times.pop(codepath, None)
+        self._init_times.pop(codepath, None)
         self._dependency_graph.delete_vertex(pkg.identifier)
         del self._package_versions[pkg.identifier][pkg.version]
         if len(self._package_versions[pkg.identifier]) == 0:
@@ -333,6 +346,8 @@ class PackageManager(object):
         return self.get_available_package(codepath)
 
     def get_package(self, identifier, version=None):
+        if identifier in self._lazy_packages:
+            self.initialize_lazy_package(identifier)
         # check if it's an old identifier
         identifier = self._old_identifier_map.get(identifier, identifier)
         try:
@@ -460,10 +475,11 @@ class PackageManager(object):
                 self._dependency_graph.add_edge(package.identifier, dep_name)
 
     def late_enable_package(self, codepath, prefix_dictionary={},
-                            needs_add=True):
+                            needs_add=True, lazy=False):
         """late_enable_package enables a package 'late', that is,
         after VisTrails initialization. All dependencies need to be
-        already enabled.
+        already enabled. If lazy is True, the package only gets initialized
+        when it is first looked up.
         """
         if needs_add:
             if codepath in self._package_list:
@@ -487,12 +503,15 @@ class PackageManager(object):
             self._old_identifier_map[old_id] = pkg.identifier
         try:
             self.add_dependencies(pkg)
-            #check_requirements is now called in pkg.initialize()
-            #pkg.check_requirements()
-            self._registry.initialize_package(pkg)
-            self._registry.signals.emit_new_package(pkg.identifier, True)
-            app.send_notification("package_added", codepath)
-            self.add_menu_items(pkg)
+            if lazy:
+                self.add_lazy_package(pkg)
+            else:
+                #check_requirements is now called in pkg.initialize()
+                #pkg.check_requirements()
+                self._registry.initialize_package(pkg)
+                self._registry.signals.emit_new_package(pkg.identifier, True)
+                app.send_notification("package_added", codepath)
+                self.add_menu_items(pkg)
             self._startup.set_package_to_enabled(codepath)
         except Exception, e:
             del self._package_versions[pkg.identifier][pkg.version]
@@ -570,7 +589,9 @@ class PackageManager(object):
                 prefix = prefix_dictionary.get(package.codepath)
                 if prefix is None:
                     prefix = self._default_prefix_dict.get(package.codepath)
+                start = time.time()
                 package.load(prefix)
+                self._load_times[package.codepath] = time.time() - start
             except Package.LoadFailed, e:
                 debug.critical("Package %s failed to load and will be "
                                "disabled" % package.name, e)
@@ -652,36 +673,125 @@ class PackageManager(object):
             raise self.DependencyCycle(e.back_edge[0],
                                        e.back_edge[1])
 
+        lazy = get_vistrails_configuration().check('lazyPackages')
         for name in sorted_packages:
             pkg = self.get_package(name)
             if not pkg.initialized():
-                #check_requirements is now called in pkg.initialize()
-                #pkg.check_requirements()
-                try:
-                    self._registry.initialize_package(pkg)
-                except MissingRequirement, e:
-                    if report_missing_dependencies:
-                        debug.critical("Package <codepath %s> is missing a "
-                                       "requirement: %s" % (
-                                           pkg.codepath, e.requirement),
-                                       e)
-                    self.late_disable_package(pkg.codepath)
-                except Package.InitializationFailed, e:
-                    debug.critical("Initialization of package <codepath %s> "
-                                   "failed and will be disabled" %
-                                   pkg.codepath,
-                                   e)
-                    # We disable the package manually to skip over things
-                    # we know will not be necessary - the only thing needed is
-                    # the reference in the package list
-                    self.late_disable_package(pkg.codepath)
+                # basic_modules and abstraction are always needed
+                if lazy and pkg.codepath not in self._default_prefix_dict:
+                    self.add_lazy_package(pkg)
                 else:
-                    self.add_menu_items(pkg)
-                    app = get_vistrails_application()
-                    app.send_notification("package_added", pkg.codepath)
+                    self.initialize_package(pkg, report_missing_dependencies)
 
+        debug.log("Package startup times:\n%s" % self.startup_report())
         self._startup.save_persisted_startup()
 
+    def initialize_package(self, pkg, report_missing_dependencies=True):
+        """initialize_package(pkg: Package, report_missing_dependencies: bool)
+                -> bool
+        Initializes a loaded package in the registry, once its dependencies
+        are initialized. If this fails, the package is disabled and False is
+        returned.
+
+        """
+        #check_requirements is now called in pkg.initialize()
+        #pkg.check_requirements()
+        start = time.time()
+        try:
+            self._registry.initialize_package(pkg)
+        except MissingRequirement, e:
+            if report_missing_dependencies:
+                debug.critical("Package <codepath %s> is missing a "
+                               "requirement: %s" % (
+                                   pkg.codepath, e.requirement),
+                               e)
+            self.late_disable_package(pkg.codepath)
+            return False
+        except Package.InitializationFailed, e:
+            debug.critical("Initialization of package <codepath %s> "
+                           "failed and will be disabled" %
+                           pkg.codepath,
+                           e)
+            # We disable the package manually to skip over things
+            # we know will not be necessary - the only thing needed is
+            # the reference in the package list
+            self.late_disable_package(pkg.codepath)
+            return False
+        self._init_times[pkg.codepath] = time.time() - start
+        self.add_menu_items(pkg)
+        app = get_vistrails_application()
+        app.send_notification("package_added", pkg.codepath)
+        return True
+
+    def add_lazy_package(self, pkg):
+        """add_lazy_package(pkg: Package) -> None
+        Defers the initialization of a loaded package: it is only added to
+        the registry, without its modules, and will get initialized the
+        first time it is looked up (see initialize_lazy_package()).
+
+        """
+        self._registry.add_package(pkg)
+        for identifier in itertools.chain([pkg.identifier],
+                                          pkg.old_identifiers):
+            self._lazy_packages[identifier] = pkg
+        self._registry.lazy_package_loader = self.initialize_lazy_package
+
+    def _forget_lazy_package(self, pkg):
+        for identifier, lazy_pkg in self._lazy_packages.items():
+            if lazy_pkg is pkg:
+                del self._lazy_packages[identifier]
+        if not self._lazy_packages:
+            self._registry.lazy_package_loader = None
+
+    def initialize_lazy_package(self, identifier=None):
+        """initialize_lazy_package(identifier: str) -> None
+        Initializes a package whose initialization was deferred, after the
+        deferred packages it depends on. This is called by the registry
+        before looking up a package. If identifier is None, all the deferred
+        packages are initialized.
+
+        """
+        if identifier is None:
+            identifiers = set(pkg.identifier
+                              for pkg in self._lazy_packages.itervalues())
+        elif identifier in self._lazy_packages:
+            identifiers = [self._lazy_packages[identifier].identifier]
+        else:
+            return
+        for identifier in identifiers:
+            for dep_id in self.all_dependencies(identifier):
+                pkg = self._lazy_packages.get(dep_id)
+                if pkg is None:
+                    continue
+                # Forget it first, initialize_package() looks it up
+                self._forget_lazy_package(pkg)
+                debug.log("Initializing deferred package %s" % pkg.codepath)
+                if self.initialize_package(pkg):
+                    self._registry.signals.emit_new_package(pkg.identifier,
+                                                            True)
+
+    def startup_report(self):
+        """startup_report() -> str
+        Returns the time spent loading and initializing each package, the
+        slowest first.
+
+        """
+        def total(codepath):
+            return (self._load_times.get(codepath, 0.0) +
+                    self._init_times.get(codepath, 0.0))
+        lines = []
+        for codepath in sorted(self._package_list, key=total, reverse=True):
+            pkg = self._package_list[codepath]
+            if codepath in self._init_times:
+                init = '%.3fs' % self._init_times[codepath]
+            elif pkg.identifier in self._lazy_packages:
+                init = 'deferred'
+            else:
+                init = '-'
+            lines.append("  %-20s load %.3fs, initialize %s" % (
+                         codepath, self._load_times.get(codepath, 0.0), init))
+        return '\n'.join(lines)
+
     def add_menu_items(self, pkg):
         """add_menu_items(pkg: Package) -> None
         If the package implemented the function menu_items(),
@@ -951,3 +1061,33 @@ class TestImports(unittest.TestCase):
                     'vistrails.tests.resources.import_targets.test5',
                     'vistrails.tests.resources.import_targets.test6']:
             self.assertIn(dep, deps)
+
+    def test_lazy_package(self):
+        pm = get_package_manager()
+        registry = pm._registry
+        was_enabled = pm.has_package('org.vistrails.vistrails.pythoncalc')
+        if was_enabled:
+            pm.late_disable_package('pythonCalc')
+        try:
+            # Twice: disabling it forgets its timings from the first time
+            for i in xrange(2):
+                self.assertNotIn('pythonCalc', pm.startup_report())
+                pm.late_enable_package('pythonCalc', lazy=True)
+                try:
+                    pkg = pm.get_package_by_codepath('pythonCalc')
+                    self.assertFalse(pkg.initialized())
+                    self.assertIn('deferred', pm.startup_report())
+
+                    # Looking up one of its modules initializes it, also from
+                    # an old identifier
+                    descriptor = registry.get_descriptor_by_name(
+                            'edu.utah.sci.vistrails.pythoncalc', 'PythonCalc')
+                    self.assertEqual(descriptor.name, 'PythonCalc')
+                    self.assertTrue(pkg.initialized())
+                    self.assertNotIn('deferred', pm.startup_report())
+                    self.assertIsNone(registry.lazy_package_loader)
+                finally:
+                    pm.late_disable_package('pythonCalc')
+        finally:
+            if was_enabled:
+                pm.late_enable_package('pythonCalc')
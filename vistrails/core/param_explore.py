@@ -173,6 +173,7 @@ class InterpolateDiscreteParam(object):
             p.strValue = str(v)
             f.params.append(p)
         m.functions.append(f)
+        pipeline.invalidate_signatures(m.id)
 
 class ActionBasedParameterExploration(object):
     """
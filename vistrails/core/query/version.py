@@ -58,6 +58,16 @@ class SearchStmt(object):
     def run(self, v, n):
         pass
 
+    def to_sql(self):
+        """to_sql() -> (str, list) or None
+
+        Compiles the statement to a condition on the version index of the
+        Collection (see Collection.search_versions()), with its parameters.
+        Returns None if it can't be compiled.
+
+        """
+        return ('1', [])
+
     def __call__(self):
         """Make SearchStmt behave just like a QueryObject."""
         return self
@@ -396,6 +406,9 @@ class BeforeSearchStmt(TimeSearchStmt):
         t = time.mktime(time_strptime(action.date, "%d %b %Y %H:%M:%S"))
         return t <= self.date
 
+    def to_sql(self):
+        return ('coalesce(date <= ?, 0)', [self.date])
+
 class AfterSearchStmt(TimeSearchStmt):
     def match(self, vistrail, action):
         if not action.date:
@@ -403,6 +416,9 @@ class AfterSearchStmt(TimeSearchStmt):
         t = time.mktime(time_strptime(action.date, "%d %b %Y %H:%M:%S"))
         return t >= self.date
 
+    def to_sql(self):
+        return ('coalesce(date >= ?, 0)', [self.date])
+
 class RegexEnabledSearchStmt(SearchStmt):
     def __init__(self, content, use_regex):
         self.content = content
@@ -414,7 +430,21 @@ class RegexEnabledSearchStmt(SearchStmt):
         if self.use_regex:
             return self.regex.match(v)
         else:
-            return v in self.content
+            return self.content.lower() in v.lower()
+
+    def _text_sql(self, column):
+        # Regular expressions can't be looked up in the index
+        if self.use_regex:
+            return None
+        # The index is made of trigrams, shorter strings are scanned for
+        if len(self.content) < 3:
+            condition = 'instr(lower(%s), ?)' % column
+            param = self.content.lower()
+        else:
+            condition = 'version_text match ?'
+            param = '%s : "%s"' % (column, self.content.replace('"', '""'))
+        return ('id in (select rowid from version_text where %s)' % condition,
+                [param])
 
 class UserSearchStmt(RegexEnabledSearchStmt):
     def match(self, vistrail, action):
@@ -422,6 +452,9 @@ class UserSearchStmt(RegexEnabledSearchStmt):
             return False
         return self._content_matches(action.user)
 
+    def to_sql(self):
+        return self._text_sql('user')
+
 class NotesSearchStmt(RegexEnabledSearchStmt):
     def match(self, vistrail, action):
         if vistrail.has_notes(action.id):
@@ -429,6 +462,9 @@ class NotesSearchStmt(RegexEnabledSearchStmt):
             return self._content_matches(plainNotes)
         return False
 
+    def to_sql(self):
+        return self._text_sql('notes')
+
 class NameSearchStmt(RegexEnabledSearchStmt):
     def match(self, vistrail, action):
         m = 0
@@ -439,6 +475,9 @@ class NameSearchStmt(RegexEnabledSearchStmt):
             m = self._content_matches(vistrail.get_description(action.timestep))
         return bool(m)
 
+    def to_sql(self):
+        return self._text_sql('name')
+
 class ModuleSearchStmt(RegexEnabledSearchStmt):
     def match(self, vistrail, action):
         pipeline = vistrail.getPipeline(action.timestep)
@@ -447,6 +486,22 @@ class ModuleSearchStmt(RegexEnabledSearchStmt):
                 return True
         return False
 
+    def to_sql(self):
+        return self._text_sql('modules')
+
+class ParameterSearchStmt(RegexEnabledSearchStmt):
+    def match(self, vistrail, action):
+        pipeline = vistrail.getPipeline(action.timestep)
+        for module in pipeline.modules.itervalues():
+            for function in module.functions:
+                for param in function.params:
+                    if self._content_matches(param.strValue):
+                        return True
+        return False
+
+    def to_sql(self):
+        return self._text_sql('params')
+
 class AndSearchStmt(SearchStmt):
     def __init__(self, lst):
         self.matchList = lst
@@ -455,6 +510,8 @@ class AndSearchStmt(SearchStmt):
             if not s.match(vistrail, action):
                 return False
         return True
+    def to_sql(self):
+        return _combine_sql(self.matchList, 'and', '1')
 
 class OrSearchStmt(SearchStmt):
     def __init__(self, lst):
@@ -464,12 +521,32 @@ class OrSearchStmt(SearchStmt):
             if s.match(vistrail, action):
                 return True
         return False
+    def to_sql(self):
+        return _combine_sql(self.matchList, 'or', '0')
 
 class NotSearchStmt(SearchStmt):
     def __init__(self, stmt):
         self.stmt = stmt
     def match(self, vistrail, action):
-        return not self.stmt.match(action)
+        return not self.stmt.match(vistrail, action)
+    def to_sql(self):
+        sql = self.stmt.to_sql()
+        if sql is None:
+            return None
+        return ('not (%s)' % sql[0], sql[1])
+
+def _combine_sql(stmts, operator, empty):
+    conditions = []
+    params = []
+    for stmt in stmts:
+        sql = stmt.to_sql()
+        if sql is None:
+            return None
+        conditions.append('(%s)' % sql[0])
+        params.extend(sql[1])
+    if not conditions:
+        return (empty, [])
+    return ((' %s ' % operator).join(conditions), params)
 
 class TrueSearch(SearchStmt):
     def __init__(self):
@@ -518,7 +595,7 @@ class SearchCompiler(object):
         while len(tokStream):
             tok = tokStream[0]
             if ':' in tok:
-                return (AndSearchStmt(lst, use_regex), tokStream)
+                return (AndSearchStmt(lst), tokStream)
             lst.append(NotesSearchStmt(tok, use_regex))
             tokStream = tokStream[1:]
         return (AndSearchStmt(lst), [])
@@ -544,6 +621,17 @@ class SearchCompiler(object):
             lst.append(ModuleSearchStmt(tok, use_regex))
             tokStream = tokStream[1:]
         return (AndSearchStmt(lst), [])
+    def parseParameter(self, tokStream, use_regex):
+        if len(tokStream) == 0:
+            raise SearchParseError('Expected token, got end of search')
+        lst = []
+        while len(tokStream):
+            tok = tokStream[0]
+            if ':' in tok:
+                return (AndSearchStmt(lst), tokStream)
+            lst.append(ParameterSearchStmt(tok, use_regex))
+            tokStream = tokStream[1:]
+        return (AndSearchStmt(lst), [])
     def parseBefore(self, tokStream, use_regex):
         old_tokstream = tokStream
         try:
@@ -601,6 +689,7 @@ class SearchCompiler(object):
                 'after': parseAfter,
                 'name': parseName,
                 'module': parseModule,
+                'param': parseParameter,
                 'any': parseAny}
                 
             
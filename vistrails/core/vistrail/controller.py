@@ -52,6 +52,7 @@ from vistrails.core.layout.workflow_layout import WorkflowLayout, \
     Pipeline as LayoutPipeline, Defaults as LayoutDefaults
 from vistrails.core.log.controller import LogController, DummyLogController
 from vistrails.core.log.log import Log
+from vistrails.core.log.stream import get_log_stream
 from vistrails.core.modules.abstraction import identifier as abstraction_pkg, \
     version as abstraction_ver
 from vistrails.core.modules.basic_modules import identifier as basic_pkg
@@ -209,12 +210,121 @@ class VistrailController(object):
 
     def flush_pipeline_cache(self):
         self._pipelines = {0: Pipeline()}
+        # version -> value of _pipeline_clock when it was last used
+        self._pipeline_uses = {0: 0}
+        self._pipeline_clock = 0
+        self._version_depths = {}
+
+    def _use_cached_pipeline(self, version):
+        self._pipeline_clock += 1
+        self._pipeline_uses[version] = self._pipeline_clock
+
+    def get_cached_pipeline(self, version):
+        """get_cached_pipeline(version: int) -> Pipeline
+
+        Returns a copy of a pipeline from the cache, marking it as recently
+        used.
+
+        """
+        pipeline = self._pipelines[version]
+        self._use_cached_pipeline(version)
+        return copy.copy(pipeline)
+
+    def cache_pipeline(self, version, pipeline):
+        """cache_pipeline(version: int, pipeline: Pipeline) -> None
+
+        Stores a pipeline in the cache, discarding the least recently used
+        ones if there are more than pipelineCacheSize. The empty pipeline of
+        version 0 is always kept.
+
+        """
+        self._pipelines[version] = pipeline
+        self._use_cached_pipeline(version)
+        limit = get_vistrails_configuration().check('pipelineCacheSize')
+        if limit and len(self._pipelines) > limit + 1:
+            uses = self._pipeline_uses
+            versions = sorted((v for v in self._pipelines if v != 0),
+                              key=uses.__getitem__)
+            for old_version in versions[:len(self._pipelines) - limit - 1]:
+                del self._pipelines[old_version]
+                del uses[old_version]
+
+    def get_version_depth(self, version):
+        """get_version_depth(version: int) -> int
+
+        Returns the number of actions between the root and version.
+
+        """
+        depths = self._version_depths
+        am = self.vistrail.actionMap
+        path = []
+        while version != 0 and version not in depths:
+            path.append(version)
+            version = am[version].parent
+        depth = depths.get(version, 0)
+        for version in reversed(path):
+            depth += 1
+            depths[version] = depth
+        return depth
+
+    def materialize_from_checkpoint(self, version, interval):
+        """materialize_from_checkpoint(version: int, interval: int) -> Pipeline
+
+        Builds the pipeline for version by replaying its actions from the
+        closest pipeline among the cached ones, the current one and the
+        checkpoint: its ancestor whose depth is a multiple of interval. The
+        checkpoint is materialized and cached if needed, so that at most
+        interval actions are replayed from then on.
+
+        """
+        am = self.vistrail.actionMap
+        depth = self.get_version_depth(version)
+        checkpoint_depth = depth - depth % interval
+        current = self.current_version
+        if current <= 0 or self.current_pipeline is None:
+            current = None
+
+        chain = []
+        base = version
+        while (depth > checkpoint_depth and
+               base not in self._pipelines and base != current):
+            chain.append(am[base])
+            base = am[base].parent
+            depth -= 1
+
+        if base in self._pipelines:
+            result = self.get_cached_pipeline(base)
+        elif base == current:
+            result = copy.copy(self.current_pipeline)
+        else:
+            # Materialize the checkpoint from the closest cached ancestor
+            closest = base
+            while closest not in self._pipelines:
+                closest = am[closest].parent
+            if closest == 0:
+                result = self.vistrail.getPipeline(base)
+            else:
+                result = self.get_cached_pipeline(closest)
+                result.perform_action(
+                        self.vistrail.general_action_chain(closest, base))
+            if self._cache_pipelines:
+                self.cache_pipeline(base, copy.copy(result))
+
+        chain.reverse()
+        result.perform_action_chain(chain)
+        return result
 
     def logging_on(self):
         return get_vistrails_configuration().check('executionLog')
             
     def get_logger(self):
         if self.logging_on():
+            config = get_vistrails_configuration()
+            stream_file = config.check('executionLogStream')
+            if stream_file:
+                stream = get_log_stream(stream_file,
+                                        config.check('executionLogStore'))
+                return LogController(self.log, stream=stream)
             return LogController(self.log)
         else:
             return DummyLogController
@@ -3411,7 +3521,7 @@ class VistrailController(object):
                     return result
             # Fast check: if target is cached, copy it and we're done.
             elif version in self._pipelines:
-                result = copy.copy(self._pipelines[version])
+                result = self.get_cached_pipeline(version)
             else:
                 # Find the closest upstream pipeline to the current one
                 cv = self._current_full_graph.inverse_immutable().closest_vertex
@@ -3430,10 +3540,17 @@ class VistrailController(object):
                 # FIXME I'm assuming copying the pipeline has zero cost.
                 # Formulate a better cost model
                 if cost_to_closest_version < cost_to_current_version:
-                    if closest == 0:
+                    checkpoints = get_vistrails_configuration().check(
+                            'pipelineCheckpoints')
+                    if checkpoints:
+                        # As many actions as from the closest pipeline, but
+                        # the checkpoint on the way is kept
+                        result = self.materialize_from_checkpoint(
+                                version, checkpoints)
+                    elif closest == 0:
                         result = self.vistrail.getPipeline(version)
                     else:
-                        result = copy.copy(self._pipelines[closest])
+                        result = self.get_cached_pipeline(closest)
                         action = self.vistrail.general_action_chain(closest, 
                                                                     version)
                         result.perform_action(action)
@@ -3456,9 +3573,9 @@ class VistrailController(object):
                             if not allow_fail:
                                 raise
                         else:
-                            self._pipelines[version] = copy.copy(result)
+                            self.cache_pipeline(version, copy.copy(result))
                     else:
-                        self._pipelines[version] = copy.copy(result)
+                        self.cache_pipeline(version, copy.copy(result))
             if do_validate:
                 try:
                     self.validate(result)
@@ -3692,9 +3809,9 @@ class VistrailController(object):
                 # check for db log
                 log = Log()
                 if isinstance(self.locator, vistrails.core.db.locator.DBLocator):
-                    connection = self.locator.get_connection()
-                    db_log = open_vt_log_from_db(connection, 
-                                                 self.vistrail.db_id)
+                    with self.locator.connection() as connection:
+                        db_log = open_vt_log_from_db(connection, 
+                                                     self.vistrail.db_id)
                     Log.convert(db_log)
                     for workflow_exec in db_log.workflow_execs:
                         workflow_exec.db_id = \
@@ -4005,3 +4122,90 @@ class VistrailController(object):
         return self.move_modules_ops(moves)
         
             
+
+
+################################################################################
+
+import unittest
+
+
+class TestPipelineCheckpoints(unittest.TestCase):
+    def setUp(self):
+        conf = get_vistrails_configuration()
+        self.saved = (conf.pipelineCheckpoints, conf.pipelineCacheSize)
+        conf.pipelineCheckpoints = 4
+        conf.pipelineCacheSize = 3
+
+    def tearDown(self):
+        conf = get_vistrails_configuration()
+        conf.pipelineCheckpoints, conf.pipelineCacheSize = self.saved
+
+    def make_controller(self):
+        from vistrails.core.vistrail.vistrail import Vistrail
+
+        controller = VistrailController(Vistrail(), None, auto_save=False)
+        controller.change_selected_version(0)
+        module = controller.add_module(basic_pkg, 'String')
+        controller.change_selected_version(controller.current_version)
+        branch = controller.current_version
+        versions = []
+        for i in xrange(10):
+            controller.update_function(
+                    controller.current_pipeline.modules[module.id],
+                    'value', ['main %d' % i])
+            versions.append(controller.current_version)
+        controller.change_selected_version(branch)
+        for i in xrange(3):
+            controller.update_function(
+                    controller.current_pipeline.modules[module.id],
+                    'value', ['branch %d' % i])
+            versions.append(controller.current_version)
+        return controller, module.id, versions
+
+    def get_value(self, pipeline, module_id):
+        function, = pipeline.modules[module_id].functions
+        return function.params[0].strValue
+
+    @staticmethod
+    def cached_versions(controller):
+        """Returns the cached versions, from least to most recently used.
+        """
+        return sorted(controller._pipelines,
+                      key=controller._pipeline_uses.__getitem__)
+
+    def test_switch(self):
+        controller, module_id, versions = self.make_controller()
+        controller.flush_pipeline_cache()
+        for version in [versions[9], versions[2], versions[12], versions[7],
+                        versions[0], versions[10], versions[9]]:
+            controller.change_selected_version(version)
+            self.assertEqual(
+                    self.get_value(controller.current_pipeline, module_id),
+                    self.get_value(controller.vistrail.getPipeline(version),
+                                   module_id))
+
+    def test_checkpoints(self):
+        controller, module_id, versions = self.make_controller()
+        controller.flush_pipeline_cache()
+        controller.change_selected_version(versions[9])
+        # module added at depth 1, last update at depth 11
+        self.assertEqual(controller.get_version_depth(versions[9]), 11)
+        self.assertEqual(set(controller._pipelines),
+                         set([0, versions[6]]))
+        # going back from the current version is cheaper, no checkpoint
+        controller.change_selected_version(versions[5])
+        self.assertEqual(set(controller._pipelines),
+                         set([0, versions[6]]))
+        # from the other branch, the checkpoint is cheaper
+        controller.change_selected_version(versions[12])
+        controller.change_selected_version(versions[5])
+        self.assertIn(versions[2], controller._pipelines)
+        # the cache is limited, version 0 is kept
+        controller.change_selected_version(versions[10])
+        self.assertEqual(self.cached_versions(controller),
+                         [versions[6], versions[12], versions[2], 0])
+        get_vistrails_configuration().pipelineCacheSize = 2
+        controller.cache_pipeline(versions[0], Pipeline())
+        self.assertEqual(self.cached_versions(controller),
+                         [versions[2], 0, versions[0]])
+
@@ -41,6 +41,7 @@ class ModuleControlParam(DBControlParameter):
 
     # Valid control parameters should be put here
     LOOP_KEY = 'loop_type' # How input lists are combined
+    LOOP_PROCESSES_KEY = 'loop_processes' # Processes to run iterations on
     WHILE_COND_KEY = 'while_cond' # Run module in a while loop
     WHILE_INPUT_KEY = 'while_input' # input port for forwarded value
     WHILE_OUTPUT_KEY = 'while_output' # output port for forwarded value
@@ -48,6 +49,7 @@ class ModuleControlParam(DBControlParameter):
     WHILE_DELAY_KEY = 'while_delay' # delay between iterations
     CACHE_KEY = 'cache' # Turn caching on/off for this module (not implemented)
     JOB_CACHE_KEY = 'job_cache' # Always persist output values to disk
+    PARALLEL_KEY = 'parallel' # Run module on a worker thread
 
     ##########################################################################
     # Constructors and copy
@@ -35,6 +35,7 @@
 ##TODO Tests
 """ This module defines the class Pipeline """
 from vistrails.core.cache.hasher import Hasher
+from vistrails.core.cache.utils import get_hash_backend
 from vistrails.core.configuration import get_vistrails_configuration
 from vistrails.core.data_structures.bijectivedict import Bidict
 from vistrails.core.data_structures.graph import Graph
@@ -137,12 +138,17 @@ class Pipeline(DBWorkflow):
         self.set_defaults()
 
     def set_defaults(self, other=None):
+        # function id -> module id, parameter id -> function id; these are
+        # only hints, checked on lookup and rebuilt when stale
+        self._function_modules = {}
+        self._parameter_functions = {}
         if other is None:
             self.is_valid = False
             self.aliases = Bidict()
             self._subpipeline_signatures = Bidict()
             self._module_signatures = Bidict()
             self._connection_signatures = Bidict()
+            self._signature_hash = get_hash_backend()
         else:
             self.is_valid = other.is_valid
             self.aliases = Bidict([(k,copy.copy(v))
@@ -156,6 +162,7 @@ class Pipeline(DBWorkflow):
             self._module_signatures = \
                 Bidict([(k,copy.copy(v))
                         for (k,v) in other._module_signatures.iteritems()])
+            self._signature_hash = other._signature_hash
 
         self.graph = Graph()
         for module in self.module_list:
@@ -268,9 +275,12 @@ class Pipeline(DBWorkflow):
                 self.db_delete_connection(connection)
         self.graph = Graph()
         self.aliases = Bidict()
+        self._function_modules = {}
+        self._parameter_functions = {}
         self._subpipeline_signatures = Bidict()
         self._module_signatures = Bidict()
         self._connection_signatures = Bidict()
+        self._signature_hash = get_hash_backend()
 
     def get_tmp_id(self, type):
         """get_tmp_id(type: str) -> long
@@ -346,10 +356,10 @@ class Pipeline(DBWorkflow):
         else:
             what = op.db_what
         funname = '%s_%s' % (op.vtType, what)
+        db_funname = 'db_%s_object' % op.vtType
         try:
             f = getattr(self, funname)
         except AttributeError:
-            db_funname = 'db_%s_object' % op.vtType
             try:
                 f = getattr(self, db_funname)
             except AttributeError:
@@ -364,6 +374,18 @@ class Pipeline(DBWorkflow):
         elif op.vtType == 'change':
             f(op.oldObjId, op.data, op.parentObjType, op.parentObjId)
 
+        if f.__name__ == db_funname:
+            # Generic operations on functions, control parameters, ... change
+            # the signature of the module they belong to
+            if op.parentObjType in (Module.vtType, Abstraction.vtType,
+                                    Group.vtType):
+                if (op.db_what == ModuleFunction.vtType and
+                        op.vtType != 'delete'):
+                    self._function_modules[op.data.real_id] = op.parentObjId
+                self.invalidate_signatures(op.parentObjId)
+            elif op.parentObjType == ModuleFunction.vtType:
+                self.invalidate_function_signatures(op.parentObjId)
+
     def add_module(self, m, *args):
         """add_module(m: Module) -> None 
         Add new module to pipeline
@@ -376,13 +398,18 @@ class Pipeline(DBWorkflow):
 #             m.abstraction = self.abstraction_map[m.abstraction_id]
         self.db_add_object(m)
         self.graph.add_vertex(m.id)
+        self.index_functions(m)
+        self.invalidate_signatures(m.id)
 
     def change_module(self, old_id, m, *args):
         if not self.has_module_with_id(old_id):
             raise VistrailsInternalError("module %s doesn't exist" % old_id)
+        self.invalidate_signatures(old_id)
         self.db_change_object(old_id, m)
         self.graph.delete_vertex(old_id)
         self.graph.add_vertex(m.id)
+        self.index_functions(m)
+        self.invalidate_signatures(m.id)
 
     def delete_module(self, id, *args):
         """delete_module(id:int) -> None 
@@ -399,12 +426,9 @@ class Pipeline(DBWorkflow):
             self.delete_connection(conn_id)
 
         # self.modules.pop(id)
+        self.invalidate_signatures(id)
         self.db_delete_object(id, Module.vtType)
         self.graph.delete_vertex(id)
-        if id in self._module_signatures:
-            del self._module_signatures[id]
-        if id in self._subpipeline_signatures:
-            del self._subpipeline_signatures[id]
 
     def add_connection(self, c, *args):
         """add_connection(c: Connection) -> None 
@@ -418,6 +442,7 @@ class Pipeline(DBWorkflow):
         if c.source is not None and c.destination is not None:
             assert(c.sourceId != c.destinationId)        
             self.graph.add_edge(c.sourceId, c.destinationId, c.id)
+            self.invalidate_signatures(c.destinationId, False)
             self.ensure_connection_specs([c.id])
 
             source_name = c.source.name
@@ -442,6 +467,7 @@ class Pipeline(DBWorkflow):
 
         old_conn = self.connections[old_id]
         if old_conn.source is not None and old_conn.destination is not None:
+            self.invalidate_signatures(old_conn.destinationId, False)
             self.graph.delete_edge(old_conn.sourceId, old_conn.destinationId,
                                    old_conn.id)
             if self.graph.out_degree(old_conn.sourceId) < 1:
@@ -458,6 +484,7 @@ class Pipeline(DBWorkflow):
         if c.source is not None and c.destination is not None:
             assert(c.sourceId != c.destinationId)
             self.graph.add_edge(c.sourceId, c.destinationId, c.id)
+            self.invalidate_signatures(c.destinationId, False)
             self.ensure_connection_specs([c.id])
             self.modules[c.sourceId].connected_output_ports.add(c.source.name)
             self.modules[c.destinationId].connected_input_ports.add(
@@ -477,6 +504,7 @@ class Pipeline(DBWorkflow):
         if conn.source is not None and conn.destination is not None and \
                 (conn.destinationId, conn.id) in \
                 self.graph.edges_from(conn.sourceId):
+            self.invalidate_signatures(conn.destinationId, False)
             self.graph.delete_edge(conn.sourceId, conn.destinationId, conn.id)
 
             c = conn
@@ -493,6 +521,8 @@ class Pipeline(DBWorkflow):
         
     def add_parameter(self, param, parent_type, parent_id):
         self.db_add_object(param, parent_type, parent_id)
+        self._parameter_functions[param.real_id] = parent_id
+        self.invalidate_function_signatures(parent_id)
         if not self.has_alias(param.alias):
             self.change_alias(param.alias, 
                               param.vtType, 
@@ -504,6 +534,7 @@ class Pipeline(DBWorkflow):
     def delete_parameter(self, param_id, param_type, parent_type, parent_id):
         self.db_delete_object(param_id, ModuleParam.vtType,
                               parent_type, parent_id)
+        self.invalidate_function_signatures(parent_id)
         self.remove_alias(ModuleParam.vtType, param_id, parent_type, 
                           parent_id, None)
 
@@ -512,6 +543,8 @@ class Pipeline(DBWorkflow):
                           parent_type, parent_id, None)
         self.db_change_object(old_param_id, param,
                               parent_type, parent_id)
+        self._parameter_functions[param.real_id] = parent_id
+        self.invalidate_function_signatures(parent_id)
         if not self.has_alias(param.alias):
             self.change_alias(param.alias, 
                               param.vtType, 
@@ -528,6 +561,7 @@ class Pipeline(DBWorkflow):
             self.graph.add_edge(connection.sourceId, 
                                 connection.destinationId, 
                                 connection.id)
+            self.invalidate_signatures(connection.destinationId, False)
             c = connection
             source_name = c.source.name
             output_ports = self.modules[c.sourceId].connected_output_ports
@@ -544,6 +578,7 @@ class Pipeline(DBWorkflow):
     def delete_port(self, port_id, port_type, parent_type, parent_id):
         conn = self.connections[parent_id]
         if len(conn.ports) >= 2:
+            self.invalidate_signatures(conn.destinationId, False)
             self.graph.delete_edge(conn.sourceId, 
                                    conn.destinationId, 
                                    conn.id)
@@ -688,6 +723,7 @@ class Pipeline(DBWorkflow):
                 #FIXME: check if a change parameter action needs to be generated
                 parameter = self.db_get_object(what, oId)
                 parameter.strValue = str(value)
+                self.invalidate_signatures(mId)
             else:
                 raise VistrailsInternalError("only parameters are supported")
         
@@ -834,15 +870,119 @@ class Pipeline(DBWorkflow):
     def has_connection_signature(self, signature):
         return signature in self._connection_signatures.inverse
 
+    def invalidate_signatures(self, module_id, module_changed=True):
+        """invalidate_signatures(module_id: int, module_changed: bool) -> None
+        Forgets the signatures that depend on the given module: the
+        subpipeline signatures of the module and of everything downstream,
+        and the signatures of the connections to these modules. If
+        module_changed, the signature of the module itself is dropped too.
+
+        This is called whenever the pipeline is edited, so that
+        compute_signatures() only has to hash what changed."""
+        if not (self._module_signatures or self._subpipeline_signatures):
+            # Nothing computed yet, e.g. while materializing
+            return
+        if module_changed and module_id in self._module_signatures:
+            del self._module_signatures[module_id]
+        # A subpipeline signature is only ever computed after the upstream
+        # ones, so we can stop at modules that don't have one
+        to_visit = [module_id]
+        while to_visit:
+            m_id = to_visit.pop()
+            if m_id not in self._subpipeline_signatures:
+                continue
+            del self._subpipeline_signatures[m_id]
+            for (_, conn_id) in self.graph.edges_to(m_id):
+                if conn_id in self._connection_signatures:
+                    del self._connection_signatures[conn_id]
+            for (next_id, conn_id) in self.graph.edges_from(m_id):
+                to_visit.append(next_id)
+
+    def invalidate_function_signatures(self, function_id):
+        """invalidate_function_signatures(function_id: int) -> None
+        Forgets the signatures that depend on the module the function
+        belongs to, see invalidate_signatures()."""
+        # Don't look the module up if there is nothing to invalidate
+        if self._module_signatures or self._subpipeline_signatures:
+            self.invalidate_signatures(self.function_module_id(function_id))
+
+    def index_functions(self, module=None):
+        """index_functions(module: Module) -> None
+        Records which module the functions of module belong to, and which
+        function their parameters belong to. If module is None, the indexes
+        are rebuilt for the whole pipeline."""
+        if module is None:
+            self._function_modules = {}
+            self._parameter_functions = {}
+            modules = self.modules.itervalues()
+        else:
+            modules = [module]
+        for module in modules:
+            for function in module.functions:
+                self._function_modules[function.real_id] = module.id
+                for param in function.params:
+                    self._parameter_functions[param.real_id] = \
+                        function.real_id
+
+    def _indexed_function_module(self, function_id):
+        module_id = self._function_modules.get(function_id)
+        if module_id is not None and module_id in self.modules:
+            if self.modules[module_id].has_function_with_real_id(function_id):
+                return module_id
+        return None
+
+    def function_module_id(self, function_id):
+        """function_module_id(function_id: int) -> int
+        Returns the id of the module the function belongs to."""
+        module_id = self._indexed_function_module(function_id)
+        if module_id is None:
+            # Not indexed, or the module was edited directly
+            self.index_functions()
+            module_id = self._indexed_function_module(function_id)
+        return module_id
+
+    def _indexed_parameter_module(self, param_id):
+        function_id = self._parameter_functions.get(param_id)
+        if function_id is not None:
+            module_id = self._indexed_function_module(function_id)
+            if module_id is not None:
+                function = self.modules[module_id].get_function_by_real_id(
+                        function_id)
+                if function.db_has_parameter_with_id(param_id):
+                    return module_id
+        return None
+
+    def parameter_module_id(self, param_id):
+        """parameter_module_id(param_id: int) -> int
+        Returns the id of the module the parameter belongs to."""
+        module_id = self._indexed_parameter_module(param_id)
+        if module_id is None:
+            # Not indexed, or the function was edited directly
+            self.index_functions()
+            module_id = self._indexed_parameter_module(param_id)
+        return module_id
+
     def refresh_signatures(self):
-        self._connection_signatures = {}
-        self._subpipeline_signatures = {}
-        self._module_signatures = {}
+        """refresh_signatures(): recompute all the signatures from scratch.
+
+        Edits made through the pipeline invalidate signatures, so this is only
+        needed if modules were changed behind its back; compute_signatures()
+        is usually enough."""
+        self._connection_signatures = Bidict()
+        self._subpipeline_signatures = Bidict()
+        self._module_signatures = Bidict()
+        self._signature_hash = get_hash_backend()
         self.compute_signatures()
 
     def compute_signatures(self):
         """compute_signatures(): compute all module and subpipeline signatures
-        for this pipeline."""
+        for this pipeline.
+
+        Signatures that are still valid are not computed again."""
+        if self._signature_hash is not get_hash_backend():
+            # The hash function was changed, start over
+            self.refresh_signatures()
+            return
         for i in self.modules.iterkeys():
             self.subpipeline_signature(i)
         for c in self.connections.iterkeys():
@@ -1461,6 +1601,88 @@ class TestPipeline(unittest.TestCase):
         self.assertNotEquals(c_sig_size_before, c_sig_size_after)
         self.assertNotEquals(p_sig_size_before, p_sig_size_after)
 
+    def test_incremental_signatures(self):
+        """Makes sure edits only invalidate the signatures downstream."""
+        # Copying indexes the functions and parameters
+        p = copy.copy(self.create_default_pipeline())
+        m1_sig = p.subpipeline_signature(1)
+        function = p.modules[0].functions[0]
+        old_param = function.params[0]
+        param = ModuleParam(id=old_param.real_id + 1, type='String', val='-')
+        p.change_parameter(old_param.real_id, param,
+                           ModuleFunction.vtType, function.real_id)
+        self.assertNotIn(0, p._module_signatures)
+        self.assertIn(1, p._module_signatures)
+        self.assertEqual(set(p._subpipeline_signatures), set([1]))
+        self.assertEqual(len(p._connection_signatures), 0)
+        p.compute_signatures()
+        self.assertEqual(p.subpipeline_signature(1), m1_sig)
+
+        fresh = copy.copy(p)
+        fresh.refresh_signatures()
+        self.assertEqual(p._subpipeline_signatures,
+                         fresh._subpipeline_signatures)
+        self.assertEqual(p._connection_signatures,
+                         fresh._connection_signatures)
+
+        p.delete_connection(1)
+        self.assertEqual(set(p._subpipeline_signatures), set([0, 1]))
+        self.assertEqual(p._connection_signatures.keys(), [])
+        p.compute_signatures()
+        self.assertNotEqual(p.subpipeline_signature(2),
+                            fresh.subpipeline_signature(2))
+
+    def test_function_index(self):
+        """Finds the module of functions and parameters."""
+        p = copy.copy(self.create_default_pipeline())
+        m0, m1 = min(p.modules), max(p.modules)
+        function = p.modules[m0].functions[0]
+        param = function.params[0]
+        self.assertEqual(p.function_module_id(function.real_id), m0)
+        # Functions added to the module directly are found too; the default
+        # pipeline's parameters all have the same id, so use a new one
+        new_param = ModuleParam(id=param.real_id + 100, type='String',
+                                val='x')
+        new_function = ModuleFunction(id=function.real_id + 100,
+                                      name='value',
+                                      parameters=[new_param])
+        p.modules[m1].add_function(new_function)
+        self.assertEqual(p.function_module_id(new_function.real_id), m1)
+        self.assertEqual(p.parameter_module_id(new_param.real_id), m1)
+        self.assertIsNone(p.function_module_id(function.real_id + 200))
+        self.assertIsNone(p.parameter_module_id(param.real_id + 200))
+
+    def test_materialize_no_lookup(self):
+        """Doesn't look modules up when there are no signatures to drop."""
+        p = copy.copy(self.create_default_pipeline())
+        p._module_signatures.clear()
+        p._subpipeline_signatures.clear()
+        def failing_lookup(function_id):
+            self.fail("Looked up the module of a function")
+        p.function_module_id = failing_lookup
+        function = p.modules[min(p.modules)].functions[0]
+        old_param = function.params[0]
+        param = ModuleParam(id=old_param.real_id + 1, type='String', val='-')
+        p.change_parameter(old_param.real_id, param,
+                           ModuleFunction.vtType, function.real_id)
+
+
+    def test_signature_hash(self):
+        """Changing the hash function recomputes the signatures."""
+        p = self.create_default_pipeline()
+        sha1_sig = p.subpipeline_signature(2)
+        self.assertEqual(len(sha1_sig), 20)
+        Hasher.set_hash_backend('md5')
+        try:
+            p.compute_signatures()
+            md5_sig = p.subpipeline_signature(2)
+            self.assertEqual(len(md5_sig), 16)
+        finally:
+            Hasher.set_hash_backend('sha1')
+        p.compute_signatures()
+        self.assertEqual(p.subpipeline_signature(2), sha1_sig)
+        self.assertRaises(ValueError, Hasher.set_hash_backend, 'nohash')
+
     def test_delete_connections(self):
         p = self.create_default_pipeline()
         p.delete_connection(0)
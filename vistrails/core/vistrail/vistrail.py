@@ -1033,8 +1033,8 @@ class Vistrail(DBVistrail):
             if self.db_log_filename is not None:
                 log = open_log_from_xml(self.db_log_filename, True)
         if isinstance(self.locator, vistrails.core.db.locator.DBLocator):
-            connection = self.locator.get_connection()
-            log = open_vt_log_from_db(connection, self.db_id)
+            with self.locator.connection() as connection:
+                log = open_vt_log_from_db(connection, self.db_id)
         Log.convert(log)
         return log
     
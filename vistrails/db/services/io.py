@@ -34,6 +34,7 @@
 ###############################################################################
 from __future__ import with_statement
 
+from contextlib import contextmanager
 from datetime import datetime
 from vistrails.core import debug
 from vistrails.core.bundles import py_import
@@ -49,6 +50,8 @@ import os.path
 import shutil
 import tempfile
 import copy
+import threading
+import time
 import zipfile
 
 from vistrails.db import VistrailsDBException
@@ -233,6 +236,158 @@ def ping_db_connection(db_connection):
         return False
     return True
     
+class DBConnectionPool(object):
+    """Keeps database connections open so that they can be reused.
+
+    Connections are shared between the configs with the same host, port,
+    database and user. A connection that is given back is reset and kept
+    idle for at most idle_timeout seconds, and is pinged before being handed
+    out again. At most max_size connections are open for each of these
+    keys; when they are all in use, get_connection() waits for one to be
+    given back, for at most CONNECT_TIMEOUT seconds.
+
+    """
+    def __init__(self, max_size=8, idle_timeout=300):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Condition()
+        self._idle = {} # key -> [(connection, time given back)]
+        self._open = {} # key -> number of connections, idle or not
+        self._in_use = {} # id(connection) -> key
+
+    @staticmethod
+    def get_key(config):
+        return (config.get('host'), config.get('port'), config.get('db'),
+                config.get('user'))
+
+    def get_connection(self, config):
+        """get_connection(config: dict) -> connection
+        Borrows a connection from the pool, opening it if needed. It should
+        be given back with release_connection().
+
+        """
+        key = self.get_key(config)
+        deadline = time.time() + CONNECT_TIMEOUT
+        while True:
+            with self._lock:
+                self._close_expired()
+                idle = self._idle.get(key)
+                if idle:
+                    connection = idle.pop()[0]
+                    self._in_use[id(connection)] = key
+                elif self._open.get(key, 0) < self.max_size:
+                    connection = None
+                    self._open[key] = self._open.get(key, 0) + 1
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise VistrailsDBException(
+                                "all %d connections to %s are in use" % (
+                                self.max_size, config.get('host')))
+                    self._lock.wait(remaining)
+                    continue
+
+            if connection is None:
+                try:
+                    connection = open_db_connection(config)
+                except Exception:
+                    self._forget(key)
+                    raise
+                with self._lock:
+                    self._in_use[id(connection)] = key
+                return connection
+
+            try:
+                alive = ping_db_connection(connection)
+            except Exception:
+                alive = False
+            if alive:
+                return connection
+            debug.log("Discarding dead database connection")
+            self._discard(connection)
+
+    def release_connection(self, connection):
+        """release_connection(connection) -> None
+        Gives back a connection obtained from get_connection(). Changes
+        that were not committed are rolled back.
+
+        """
+        with self._lock:
+            key = self._in_use.pop(id(connection), None)
+        if key is None:
+            close_db_connection(connection)
+            return
+        try:
+            connection.rollback()
+        except Exception:
+            with self._lock:
+                self._close(key, connection)
+            return
+        with self._lock:
+            self._idle.setdefault(key, []).append((connection, time.time()))
+            self._lock.notify()
+
+    @contextmanager
+    def connection(self, config):
+        """connection(config: dict) -> context manager
+        Borrows a connection for the duration of a with block.
+
+        """
+        connection = self.get_connection(config)
+        try:
+            yield connection
+        finally:
+            self.release_connection(connection)
+
+    def clear(self):
+        """clear() -> None
+        Closes all the idle connections.
+
+        """
+        with self._lock:
+            for key, idle in self._idle.iteritems():
+                for connection, t in idle:
+                    self._close(key, connection)
+            self._idle = {}
+
+    def _close_expired(self):
+        # Must be called with the lock held
+        limit = time.time() - self.idle_timeout
+        for key, idle in self._idle.iteritems():
+            while idle and idle[0][1] < limit:
+                self._close(key, idle.pop(0)[0])
+
+    def _close(self, key, connection):
+        # Must be called with the lock held
+        try:
+            close_db_connection(connection)
+        except Exception:
+            pass
+        self._open[key] -= 1
+        self._lock.notify()
+
+    def _discard(self, connection):
+        with self._lock:
+            key = self._in_use.pop(id(connection))
+            self._close(key, connection)
+
+    def _forget(self, key):
+        with self._lock:
+            self._open[key] -= 1
+            self._lock.notify()
+
+_db_connection_pool = None
+
+def get_db_connection_pool():
+    """get_db_connection_pool() -> DBConnectionPool
+    Returns the connection pool shared by the application.
+
+    """
+    global _db_connection_pool
+    if _db_connection_pool is None:
+        _db_connection_pool = DBConnectionPool()
+    return _db_connection_pool
+
 def translate_to_tbl_name(obj_type):
     map = {DBVistrail.vtType: 'vistrail',
            DBWorkflow.vtType: 'workflow',
@@ -250,7 +405,8 @@ def date_to_str(date):
 def get_db_object_list(config, obj_type):
     
     result = []    
-    db = open_db_connection(config)
+    pool = get_db_connection_pool()
+    db = pool.get_connection(config)
 
     #FIXME Create a DBGetVistrailListSQLDAOBase for this
     # and maybe there's another way to build this query
@@ -285,12 +441,13 @@ def get_db_object_list(config, obj_type):
         rows = c.fetchall()
         result = rows
         c.close()
-        close_db_connection(db)
         
     except get_db_lib().Error, e:
         msg = "Couldn't get list of vistrails objects from db (%d : %s)" % \
             (e.args[0], e.args[1])
         raise VistrailsDBException(msg)
+    finally:
+        pool.release_connection(db)
     return result
 
 def get_db_object_modification_time(db_connection, obj_id, obj_type):
@@ -669,12 +826,25 @@ def close_zip_xml(temp_dir):
     except OSError, e:
         raise VistrailsDBException("Can't remove %s: %s" % (temp_dir, str(e)))
 
+_current_dao_list = None
+
+def get_current_dao_list():
+    """get_current_dao_list() -> DAOList
+    Returns a DAOList for the current version, created once since creating
+    all the DAOs is much slower than serializing a small object.
+
+    """
+    global _current_dao_list
+    if _current_dao_list is None:
+        _current_dao_list = getVersionDAO(currentVersion)
+    return _current_dao_list
+
 def serialize(object):
-    daoList = getVersionDAO(currentVersion)
+    daoList = get_current_dao_list()
     return daoList.serialize(object)
 
 def unserialize(str, obj_type):
-    daoList = getVersionDAO(currentVersion)
+    daoList = get_current_dao_list()
     return daoList.unserialize(str, obj_type)
  
 ##############################################################################
@@ -1925,3 +2095,96 @@ class TestDBIO(unittest.TestCase):
                 self.fail(str(e))
         finally:
             os.rmdir(testdir)
+
+class TestDBConnectionPool(unittest.TestCase):
+    class FakeDBLib(object):
+        class Error(Exception):
+            pass
+        class OperationalError(Error):
+            pass
+
+        def __init__(self):
+            self.opened = []
+
+        def connect(self, **config):
+            connection = TestDBConnectionPool.FakeConnection(self)
+            self.opened.append(connection)
+            return connection
+
+    class FakeConnection(object):
+        def __init__(self, lib):
+            self.lib = lib
+            self.alive = True
+            self.closed = False
+            self.rollbacks = 0
+
+        def ping(self):
+            if not self.alive:
+                raise self.lib.OperationalError(2006, "gone away")
+
+        def rollback(self):
+            self.rollbacks += 1
+
+        def close(self):
+            self.closed = True
+
+    config = {'host': 'localhost', 'port': 3306, 'db': 'vistrails',
+              'user': 'vistrails', 'passwd': 'secret'}
+
+    def setUp(self):
+        global _db_lib
+        self._old_db_lib = _db_lib
+        self.lib = self.FakeDBLib()
+        _db_lib = self.lib
+
+    def tearDown(self):
+        global _db_lib
+        _db_lib = self._old_db_lib
+
+    def test_reuse(self):
+        pool = DBConnectionPool()
+        with pool.connection(dict(self.config)) as c1:
+            pass
+        self.assertEqual(c1.rollbacks, 1)
+        with pool.connection(dict(self.config)) as c2:
+            self.assertIs(c2, c1)
+            other = dict(self.config, db='other')
+            with pool.connection(other) as c3:
+                self.assertIsNot(c3, c1)
+        self.assertEqual(len(self.lib.opened), 2)
+        pool.clear()
+        self.assertTrue(c1.closed and c3.closed)
+
+    def test_dead_connection(self):
+        pool = DBConnectionPool()
+        with pool.connection(dict(self.config)) as c1:
+            pass
+        c1.alive = False
+        with pool.connection(dict(self.config)) as c2:
+            self.assertIsNot(c2, c1)
+        self.assertTrue(c1.closed)
+        self.assertFalse(c2.closed)
+
+    def test_max_size(self):
+        global CONNECT_TIMEOUT
+        old_timeout = CONNECT_TIMEOUT
+        CONNECT_TIMEOUT = 0
+        try:
+            pool = DBConnectionPool(max_size=2)
+            c1 = pool.get_connection(dict(self.config))
+            c2 = pool.get_connection(dict(self.config))
+            self.assertRaises(VistrailsDBException,
+                              pool.get_connection, dict(self.config))
+            pool.release_connection(c2)
+            self.assertIs(pool.get_connection(dict(self.config)), c2)
+        finally:
+            CONNECT_TIMEOUT = old_timeout
+
+    def test_idle_timeout(self):
+        pool = DBConnectionPool(idle_timeout=0)
+        with pool.connection(dict(self.config)) as c1:
+            pass
+        time.sleep(0.01)
+        with pool.connection(dict(self.config)) as c2:
+            self.assertIsNot(c2, c1)
+        self.assertTrue(c1.closed)
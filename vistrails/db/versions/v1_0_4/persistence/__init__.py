@@ -32,6 +32,8 @@
 ## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
 ##
 ###############################################################################
+from itertools import izip
+
 from xml.auto_gen import XMLDAOListBase
 from sql.auto_gen import SQLDAOListBase
 from vistrails.core.system import get_elementtree_library
@@ -263,6 +265,33 @@ class DAOList(dict):
     
         return objects
 
+    def execute_sql_commands(self, db_connection, dao, dbCommandList,
+                             writtenChildren):
+        """Executes the insert/update statements of objects being saved.
+
+        The INSERT statements of objects that already have an id are sent in
+        bulk; the others go through executeSQLGroup() since their lastrowid
+        may be needed. Returns a dictionary mapping each object to its lastrowid (or
+        None, for bulk inserts).
+        """
+        resultDict = {}
+        bulkCommands = []
+        commands = []
+        commandChildren = []
+        for child, dbCommand in izip(writtenChildren, dbCommandList):
+            if child.db_id is not None and dbCommand[0].startswith('INSERT'):
+                bulkCommands.append(dbCommand)
+                resultDict[child] = None
+            else:
+                commands.append(dbCommand)
+                commandChildren.append(child)
+        if bulkCommands:
+            dao.executeSQLInsertGroup(db_connection, bulkCommands)
+        if commands:
+            results = dao.executeSQLGroup(db_connection, commands, False)
+            resultDict.update(izip(commandChildren, results))
+        return resultDict
+
     def save_to_db(self, db_connection, obj, do_copy=False, global_props=None):
         if do_copy == 'with_ids':
             do_copy = True
@@ -315,10 +344,9 @@ class DAOList(dict):
         #                      db_connection, c, False) for c in dbCommandList]
 
         # Execute all insert/update statements
-        results = self['sql'][children[0][0].vtType].executeSQLGroup(
-                                                    db_connection,
-                                                    dbCommandList, False)
-        resultDict = dict(zip(writtenChildren, results))
+        resultDict = self.execute_sql_commands(
+                db_connection, self['sql'][children[0][0].vtType],
+                dbCommandList, writtenChildren)
         # process remaining children
         for (child, _, _) in children:
             if child in resultDict:
@@ -366,10 +394,9 @@ class DAOList(dict):
             global_propsDict[child] = global_props
 
         # Execute all insert/update statements for the main objects
-        results = self['sql'][children[0][0].vtType].executeSQLGroup(
-                                                    db_connection,
-                                                    dbCommandList, False)
-        resultDict = dict(zip(writtenChildren, results))
+        resultDict = self.execute_sql_commands(
+                db_connection, self['sql'][children[0][0].vtType],
+                dbCommandList, writtenChildren)
         dbCommandList = []
         writtenChildren = []
         for child, children in childrenDict.iteritems():
@@ -406,10 +433,9 @@ class DAOList(dict):
                 self['sql'][child.vtType].to_sql_fast(child, do_copy)
     
         # Execute all child insert/update statements
-        results = self['sql'][children[0][0].vtType].executeSQLGroup(
-                                                        db_connection,
-                                                        dbCommandList, False)
-        resultDict = dict(zip(writtenChildren, results))
+        resultDict = self.execute_sql_commands(
+                db_connection, self['sql'][children[0][0].vtType],
+                dbCommandList, writtenChildren)
 
         for child, children in childrenDict.iteritems():
             global_props = global_propsDict[child]
@@ -156,10 +156,7 @@ class SQLDAO:
             columns.append(column)
             values.append(value)
         columnStr = ', '.join(columns)
-        # valueStr = '%s, '.join(values)
-        valueStr = ''
-        if len(values) > 1:
-            valueStr = '%s,' * (len(values) - 1) + '%s'
+        valueStr = ','.join(['%s'] * len(values))
         dbCommand = """INSERT INTO %s(%s) VALUES (%s);""" % \
                     (table, columnStr, valueStr)
         return (dbCommand, tuple(values))
@@ -249,6 +246,45 @@ class SQLDAO:
             n += BUNDLE_SIZE
         return data
 
+    BULK_INSERT_ROWS = 1000
+
+    def executeSQLInsertGroup(self, db, dbCommandList):
+        """ Executes INSERT statements created by createSQLInsert
+
+            The statements that insert the same columns into the same table
+            are combined into multi-row INSERT statements of at most
+            BULK_INSERT_ROWS rows, and the values are passed to the driver
+            as parameters. lastrowid is not available for these, so this is
+            only suitable when the ids are known.
+        """
+        groups = {}
+        order = []
+        for prepared, values in dbCommandList:
+            try:
+                groups[prepared].append(values)
+            except KeyError:
+                groups[prepared] = [values]
+                order.append(prepared)
+
+        cur = db.cursor()
+        try:
+            for prepared in order:
+                head, row = prepared.rstrip(';').split(' VALUES ', 1)
+                rows = groups[prepared]
+                for n in xrange(0, len(rows), self.BULK_INSERT_ROWS):
+                    bundle = rows[n:(n+self.BULK_INSERT_ROWS)]
+                    dbCommand = '%s VALUES %s;' % (
+                            head, ','.join([row] * len(bundle)))
+                    values = tuple(v for values in bundle for v in values)
+                    try:
+                        cur.execute(dbCommand, values)
+                    except Exception, e:
+                        raise VistrailsDBException(
+                                'Command "%s" with %d rows failed: %s' % (
+                                prepared, len(bundle), e))
+        finally:
+            cur.close()
+
     def start_transaction(self, db):
         db.begin()
 
@@ -257,3 +293,87 @@ class SQLDAO:
 
     def rollback_transaction(self, db):
         db.rollback()
+
+
+import unittest
+
+
+class SQLiteCursor(object):
+    """Makes a sqlite3 cursor accept the format paramstyle of MySQLdb.
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.executed = []
+
+    def execute(self, command, values=()):
+        self.executed.append(command)
+        return self.cursor.execute(command.replace('%s', '?'), values)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    def close(self):
+        self.cursor.close()
+
+
+class SQLiteConnection(object):
+    def __init__(self):
+        import sqlite3
+        self.connection = sqlite3.connect(':memory:')
+        self.cursors = []
+
+    def cursor(self):
+        cursor = SQLiteCursor(self.connection.cursor())
+        self.cursors.append(cursor)
+        return cursor
+
+
+class TestSQLDAO(unittest.TestCase):
+    def setUp(self):
+        self.db = SQLiteConnection()
+        self.db.connection.execute(
+                'CREATE TABLE parameter(id INT, name TEXT, val TEXT)')
+        self.db.connection.execute('CREATE TABLE port(id INT, name TEXT)')
+
+    def test_insert_group(self):
+        dao = SQLDAO()
+        dao.BULK_INSERT_ROWS = 3
+        commands = []
+        for i in xrange(7):
+            commands.append(dao.createSQLInsert(
+                    'parameter', {'id': str(i), 'name': 'p%d' % i,
+                                  'val': "it's \"%d\"" % i}))
+            if i % 2:
+                commands.append(dao.createSQLInsert(
+                        'port', {'id': str(i), 'name': 'port%d' % i}))
+        dao.executeSQLInsertGroup(self.db, commands)
+
+        cursor = self.db.connection.cursor()
+        cursor.execute('SELECT id, name, val FROM parameter ORDER BY id')
+        self.assertEqual(cursor.fetchall(),
+                         [(i, u'p%d' % i, u"it's \"%d\"" % i)
+                          for i in xrange(7)])
+        cursor.execute('SELECT id, name FROM port ORDER BY id')
+        self.assertEqual(cursor.fetchall(),
+                         [(i, u'port%d' % i) for i in (1, 3, 5)])
+        # 7 parameters in bundles of 3, 3 ports in one bundle (one more
+        # parenthesis for the column list)
+        executed, = [c.executed for c in self.db.cursors]
+        self.assertEqual([c.count('(') for c in executed], [4, 4, 2, 4])
+        self.assertTrue(all("'" not in c for c in executed))
+
+    def test_insert_one_column(self):
+        dao = SQLDAO()
+        self.assertEqual(dao.createSQLInsert('port', {'id': '1'}),
+                         ('INSERT INTO port(id) VALUES (%s);', ('1',)))
+
+    def test_insert_group_error(self):
+        dao = SQLDAO()
+        commands = [dao.createSQLInsert('nosuchtable', {'id': '1'})]
+        with self.assertRaises(VistrailsDBException):
+            dao.executeSQLInsertGroup(self.db, commands)
+
@@ -539,16 +539,13 @@ class RequestHandler(object):
         config['db'] = db_name
         config['user'] = db_write_user
         config['passwd'] = db_write_pass
-        conn = None
+        pool = vistrails.db.services.io.get_db_connection_pool()
         try:
-            conn = vistrails.db.services.io.open_db_connection(config)
-            vistrails.db.services.io.delete_entity_from_db(conn,'vistrail', vt_id)
-            vistrails.db.services.io.close_db_connection(conn)
+            with pool.connection(config) as conn:
+                vistrails.db.services.io.delete_entity_from_db(conn,'vistrail', vt_id)
             return (1, 1)
         except Exception, e:
             self.server_logger.error(str(e))
-            if conn is not None:
-                vistrails.db.services.io.close_db_connection(conn)
             return (str(e), 0)
 
     def get_runnable_workflows(self, host, port, db_name, vt_id):
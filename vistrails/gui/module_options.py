@@ -102,6 +102,18 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
         self.portCombiner = QPortCombineTreeWidget()
         self.layout().addWidget(self.portCombiner)
         self.portCombiner.setVisible(False)
+
+        layout = QtGui.QHBoxLayout()
+        layout.addWidget(QtGui.QLabel("Loop processes:"))
+        layout.setStretch(0, 0)
+        self.processesEdit = QtGui.QLineEdit()
+        self.processesEdit.setValidator(QtGui.QIntValidator())
+        self.processesEdit.setToolTip('Run iterations on this many processes '
+                                      '(0 for one per CPU, empty to run '
+                                      'them in VisTrails)')
+        layout.addWidget(self.processesEdit)
+        layout.setStretch(1, 1)
+        self.layout().addLayout(layout)
         
         whileLayout = QtGui.QVBoxLayout()
 
@@ -175,6 +187,10 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
         self.layout().addWidget(self.jobCacheButton)
         self.layout().setStretch(2, 0)
 
+        self.parallelButton = QtGui.QCheckBox("Run in Parallel")
+        self.parallelButton.setToolTip('Run the module on a worker thread as soon as its inputs are ready')
+        self.layout().addWidget(self.parallelButton)
+
         self.layout().addStretch(1)
         self.buttonLayout = QtGui.QHBoxLayout()
         self.buttonLayout.setMargin(5)
@@ -198,6 +214,7 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
         self.customButton.toggled.connect(self.stateChanged)
         self.customButton.toggled.connect(self.customToggled)
         self.portCombiner.itemChanged.connect(self.stateChanged)
+        self.processesEdit.textChanged.connect(self.stateChanged)
         self.whileButton.toggled.connect(self.stateChanged)
         self.whileButton.toggled.connect(self.whileToggled)
         self.condEdit.textChanged.connect(self.stateChanged)
@@ -206,6 +223,7 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
         self.feedInputEdit.textChanged.connect(self.stateChanged)
         self.feedOutputEdit.textChanged.connect(self.stateChanged)
         self.jobCacheButton.toggled.connect(self.stateChanged)
+        self.parallelButton.toggled.connect(self.stateChanged)
 
     def sizeHint(self):
         """ sizeHint() -> QSize
@@ -289,6 +307,7 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
             self.pairwiseButton.setEnabled(False)
             self.cartesianButton.setEnabled(False)
             self.customButton.setEnabled(False)
+            self.processesEdit.setEnabled(False)
             self.whileButton.setEnabled(False)
             self.condEdit.setVisible(False)
             self.maxEdit.setVisible(False)
@@ -302,6 +321,7 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
             self.feedOutputLabel.setVisible(False)
             self.portCombiner.setVisible(False)
             self.jobCacheButton.setEnabled(False)
+            self.parallelButton.setEnabled(False)
             self.state_changed = False
             self.saveButton.setEnabled(False)
             self.resetButton.setEnabled(False)
@@ -311,6 +331,8 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
         self.cartesianButton.setEnabled(True)
         self.cartesianButton.setChecked(True)
         self.customButton.setEnabled(True)
+        self.processesEdit.setEnabled(True)
+        self.processesEdit.setText('')
 
         self.whileButton.setEnabled(True)
         self.whileButton.setChecked(False)
@@ -328,6 +350,8 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
         self.portCombiner.setDefault(module)
         self.jobCacheButton.setEnabled(True)
         self.jobCacheButton.setChecked(False)
+        self.parallelButton.setEnabled(True)
+        self.parallelButton.setChecked(False)
         if module.has_control_parameter_with_name(ModuleControlParam.LOOP_KEY):
             type = module.get_control_parameter_by_name(ModuleControlParam.LOOP_KEY).value
             self.pairwiseButton.setChecked(type=='pairwise')
@@ -336,6 +360,9 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
             self.portCombiner.setVisible(type not in ['pairwise', 'cartesian'])
             if type not in ['pairwise', 'cartesian']:
                 self.portCombiner.setValue(type)
+        if module.has_control_parameter_with_name(ModuleControlParam.LOOP_PROCESSES_KEY):
+            processes = module.get_control_parameter_by_name(ModuleControlParam.LOOP_PROCESSES_KEY).value
+            self.processesEdit.setText(processes)
         if module.has_control_parameter_with_name(ModuleControlParam.WHILE_COND_KEY) or \
            module.has_control_parameter_with_name(ModuleControlParam.WHILE_MAX_KEY):
             self.whileButton.setChecked(True)
@@ -357,6 +384,9 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
         if module.has_control_parameter_with_name(ModuleControlParam.JOB_CACHE_KEY):
             jobCache = module.get_control_parameter_by_name(ModuleControlParam.JOB_CACHE_KEY).value
             self.jobCacheButton.setChecked(jobCache.lower()=='true')
+        if module.has_control_parameter_with_name(ModuleControlParam.PARALLEL_KEY):
+            parallel = module.get_control_parameter_by_name(ModuleControlParam.PARALLEL_KEY).value
+            self.parallelButton.setChecked(parallel.lower()=='true')
         self.state_changed = False
         self.saveButton.setEnabled(False)
         self.resetButton.setEnabled(False)
@@ -370,6 +400,8 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
         else:
             value = self.portCombiner.getValue()
         values.append((ModuleControlParam.LOOP_KEY, value))
+        values.append((ModuleControlParam.LOOP_PROCESSES_KEY,
+                       self.processesEdit.text()))
         _while = self.whileButton.isChecked()
         values.append((ModuleControlParam.WHILE_COND_KEY,
                        _while and self.condEdit.text()))
@@ -384,6 +416,9 @@ class QModuleOptions(QtGui.QDialog, QVistrailsPaletteInterface):
         jobCache = self.jobCacheButton.isChecked()
         values.append((ModuleControlParam.JOB_CACHE_KEY,
                        [False, 'true'][jobCache]))
+        parallel = self.parallelButton.isChecked()
+        values.append((ModuleControlParam.PARALLEL_KEY,
+                       [False, 'true'][parallel]))
         for name, value in values:
             if value:
                 if (not self.module.has_control_parameter_with_name(name) or
@@ -122,7 +122,14 @@ class QueryController(object):
                           only_current_workflow=False):
                 entities_to_check = {}
                 open_col = Collection.getInstance()
-                
+                # Text searches are answered by the version index, only the
+                # candidates it returns are checked
+                indexed = None
+                if (search_pipeline is None or
+                        not search_pipeline.modules):
+                    indexed = open_col.search_versions(search_str,
+                                                       self.use_regex)
+
                 for entity in open_col.get_current_entities():
                     if entity.type_id == VistrailEntity.type_id and \
                             entity.is_open:
@@ -135,6 +142,11 @@ class QueryController(object):
                         else:
                             graph = controller._current_terse_graph
                             versions_to_check = set(graph.vertices.iterkeys())
+                            if (indexed is not None and
+                                    not controller.changed and
+                                    open_col.is_version_indexed(entity.url)):
+                                versions_to_check &= indexed.get(entity.url,
+                                                                 set())
                         entities_to_check[entity] = versions_to_check
                 self.set_search(MultipleSearch(search_str, search_pipeline,
                                                entities_to_check,
@@ -40,7 +40,15 @@ without its associated data.
 
 This package uses a local cache, inside the per-user VisTrails directory. This
 way, files that haven't been changed do not need to be downloaded again. The
-check is performed efficiently using HTTP headers.
+check is performed efficiently using HTTP headers. Files are stored by content
+so that URLs serving the same data share them, and interrupted downloads are
+resumed.
 """
 
+from vistrails.core.configuration import ConfigurationObject
+
 from identifiers import *
+
+# cacheSize is in megabytes, 0 means no limit
+configuration = ConfigurationObject(cacheSize=1024,
+                                    downloadThreads=4)
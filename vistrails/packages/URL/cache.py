@@ -0,0 +1,563 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+"""Content-addressed cache for the downloaded files.
+
+Files are stored under the SHA-1 of their content, followed by the extension
+from the URL, so that different URLs serving the same data share a single copy
+while consumers can still tell the file type from its name. Each URL maps to
+the object of its last download, along with the validators (ETag, date) used
+to check with the server whether it changed. When the total size goes over the
+limit, the least recently used files are removed.
+
+The index is only written by flush(), so that downloading many files (for
+instance a whole directory) doesn't rewrite it for every one of them.
+
+Interrupted downloads are kept and resumed with a Range request the next time
+the URL is requested, if the server supports it.
+"""
+
+import email.utils
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shutil
+import threading
+import time
+import urllib2
+import urlparse
+
+from vistrails.core import debug
+
+
+CHUNK_SIZE = 65536
+
+_content_range = re.compile(r'^bytes ([0-9]+)-[0-9]+/([0-9]+|\*)$')
+
+_extension = re.compile(r'^\.[A-Za-z0-9_+-]{1,16}$')
+
+
+def url_extension(url):
+    """url_extension(url: str) -> str
+
+    Returns the extension of the file a URL points to, including the dot, or
+    an empty string.
+    """
+    ext = posixpath.splitext(urlparse.urlparse(url).path)[1]
+    if _extension.match(ext) is None:
+        return ''
+    return ext
+
+
+class ContentCache(object):
+    def __init__(self, directory, max_size=None):
+        """ContentCache(directory: str, max_size: int)
+
+        max_size is in bytes; the cache is unbounded if it is None.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.RLock()
+        self._index_filename = os.path.join(directory, 'index.json')
+        for dirname in (directory,
+                        os.path.join(directory, 'objects'),
+                        os.path.join(directory, 'partial')):
+            if not os.path.isdir(dirname):
+                os.mkdir(dirname)
+        self._load_index()
+
+    def _load_index(self):
+        index = {}
+        try:
+            with open(self._index_filename, 'rb') as fp:
+                index = json.load(fp)
+        except IOError:
+            pass
+        except ValueError:
+            debug.warning("Download cache index %s is corrupted, ignoring" %
+                          self._index_filename)
+        # url -> {'object', 'etag', 'date'}
+        self._urls = index.get('urls', {})
+        # object name (digest + extension) -> {'size', 'used'}
+        self._objects = index.get('objects', {})
+        # url -> validator of the partial file, for If-Range
+        self._partials = index.get('partials', {})
+        for url, entry in self._urls.items():
+            if entry.get('object') not in self._objects:
+                del self._urls[url]
+        # object name -> set of urls, the reverse of _urls
+        self._object_urls = {}
+        for url, entry in self._urls.iteritems():
+            self._object_urls.setdefault(entry['object'], set()).add(url)
+        self._total_size = sum(obj['size']
+                               for obj in self._objects.itervalues())
+        self._dirty = False
+
+    def flush(self):
+        """Writes the index to disk, if it changed since the last time.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            temp_filename = self._index_filename + '.tmp'
+            with open(temp_filename, 'wb') as fp:
+                json.dump({'urls': self._urls,
+                           'objects': self._objects,
+                           'partials': self._partials}, fp)
+            if os.path.exists(self._index_filename):
+                os.remove(self._index_filename)
+            os.rename(temp_filename, self._index_filename)
+            self._dirty = False
+
+    def _object_filename(self, name):
+        return os.path.join(self.directory, 'objects', name)
+
+    def _partial_filename(self, url):
+        return os.path.join(self.directory, 'partial',
+                            hashlib.sha1(url).hexdigest())
+
+    def lookup(self, url):
+        """lookup(url: str) -> dict
+
+        Returns the entry for this URL, with keys 'object', 'etag' and 'date'
+        (when it was downloaded), or None if it is not in the cache.
+        """
+        with self._lock:
+            entry = self._urls.get(url)
+            if (entry is None or
+                    not os.path.isfile(self._object_filename(entry['object']))):
+                return None
+            return dict(entry)
+
+    def get(self, url):
+        """get(url: str) -> str
+
+        Returns the cached file for this URL and marks it as recently used,
+        or None if it is not in the cache.
+        """
+        with self._lock:
+            entry = self.lookup(url)
+            if entry is None:
+                return None
+            self._objects[entry['object']]['used'] = time.time()
+            self._dirty = True
+            return self._object_filename(entry['object'])
+
+    def open(self, opener, url):
+        """open(opener: OpenerDirector, url: str) -> response
+
+        Sends the request for a URL, conditional on the cached version if
+        any, and asking for the rest of the partial download if any.
+
+        Returns None if the cached version is still current; the response
+        should otherwise be read with download().
+        """
+        request = urllib2.Request(url)
+        entry = self.lookup(url)
+        if entry is not None:
+            if entry['etag']:
+                request.add_header('If-None-Match', entry['etag'])
+            request.add_header('If-Modified-Since',
+                               email.utils.formatdate(entry['date'],
+                                                      usegmt=True))
+        with self._lock:
+            validator = self._partials.get(url)
+        partial = self._partial_filename(url)
+        if validator is not None and os.path.isfile(partial):
+            request.add_header('Range',
+                               'bytes=%d-' % os.path.getsize(partial))
+            request.add_header('If-Range', validator)
+        try:
+            return opener.open(request)
+        except urllib2.HTTPError, e:
+            if e.code == 304:
+                # Not modified
+                return None
+            elif e.code == 416 and request.has_header('Range'):
+                # Requested range not satisfiable, start over
+                self.discard_partial(url)
+                return self.open(opener, url)
+            raise
+
+    def download(self, url, response, progress=None):
+        """download(url: str, response: file, progress: callable) -> str
+
+        Reads the content of a URL into the cache, appending to the partial
+        download if this is a partial response. progress is called with the
+        completed fraction, if the size is known.
+
+        Returns the path of the cached file. If the transfer is interrupted,
+        what was read is kept and the exception is propagated.
+        """
+        partial = self._partial_filename(url)
+        headers = response.info()
+        offset, total = 0, None
+        if getattr(response, 'code', None) == 206:
+            m = _content_range.match(headers.get('Content-Range', ''))
+            if (m is None or not os.path.isfile(partial) or
+                    int(m.group(1)) != os.path.getsize(partial)):
+                self.discard_partial(url)
+                raise IOError("Invalid partial response for %s" % url)
+            offset = int(m.group(1))
+            if m.group(2) != '*':
+                total = int(m.group(2))
+        if total is None:
+            try:
+                total = offset + int(headers['Content-Length'])
+            except (KeyError, ValueError):
+                pass
+
+        etag = headers.get('ETag')
+        validator = etag or headers.get('Last-Modified')
+        with self._lock:
+            if validator:
+                self._partials[url] = validator
+            else:
+                self._partials.pop(url, None)
+            self._dirty = True
+
+        size = offset
+        with open(partial, 'ab' if offset else 'wb') as fp:
+            while True:
+                if progress is not None and total:
+                    progress(size * 1.0 / total)
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                fp.write(chunk)
+        response.close()
+        if total is not None and size < total:
+            raise IOError("Connection closed after %d of %d bytes" % (
+                          size, total))
+        return self.add(url, partial, etag)
+
+    def add(self, url, filename, etag=None):
+        """add(url: str, filename: str, etag: str) -> str
+
+        Moves a file into the cache, as the content of the given URL. It is
+        stored under its digest and the extension of the URL.
+
+        Returns the path of the cached file.
+        """
+        h = hashlib.sha1()
+        with open(filename, 'rb') as fp:
+            chunk = fp.read(CHUNK_SIZE)
+            while chunk:
+                h.update(chunk)
+                chunk = fp.read(CHUNK_SIZE)
+        name = h.hexdigest() + url_extension(url)
+        target = self._object_filename(name)
+        now = time.time()
+        with self._lock:
+            if os.path.exists(target):
+                os.remove(filename)
+            else:
+                shutil.move(filename, target)
+            old = self._objects.get(name)
+            if old is not None:
+                self._total_size -= old['size']
+            size = os.path.getsize(target)
+            self._objects[name] = {'size': size, 'used': now}
+            self._total_size += size
+            old = self._urls.get(url)
+            if old is not None:
+                self._object_urls[old['object']].discard(url)
+            self._urls[url] = {'object': name, 'etag': etag, 'date': now}
+            self._object_urls.setdefault(name, set()).add(url)
+            self._partials.pop(url, None)
+            self._dirty = True
+            self.evict(keep=name)
+        return target
+
+    def discard_partial(self, url):
+        with self._lock:
+            self._partials.pop(url, None)
+            try:
+                os.remove(self._partial_filename(url))
+            except OSError:
+                pass
+            self._dirty = True
+
+    def evict(self, keep=None):
+        """Removes the least recently used files until the cache fits in
+        max_size.
+        """
+        with self._lock:
+            if self.max_size is None or self._total_size <= self.max_size:
+                return
+            by_use = sorted(self._objects,
+                            key=lambda name: self._objects[name]['used'])
+            for name in by_use:
+                if self._total_size <= self.max_size:
+                    break
+                if name == keep:
+                    continue
+                self._total_size -= self._objects.pop(name)['size']
+                try:
+                    os.remove(self._object_filename(name))
+                except OSError:
+                    pass
+                for url in self._object_urls.pop(name, ()):
+                    del self._urls[url]
+            self._dirty = True
+
+
+###############################################################################
+
+import unittest
+
+
+class HTTPServerStandIn(object):
+    """Local HTTP server for the tests.
+
+    Serves the strings in the 'files' dict, with an ETag and support for
+    conditional and Range requests. Directories are served as HTML listings
+    (with a redirect if the URL doesn't end with a slash).
+    A file whose path is in 'truncate' is cut after that many bytes, to
+    simulate an interrupted transfer. The requests are recorded in
+    'requests' as (path, status).
+    """
+    def __init__(self, files):
+        import BaseHTTPServer
+        import SocketServer
+
+        self.files = files
+        self.truncate = {}
+        self.requests = []
+        stand_in = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.0'
+
+            def do_GET(self):
+                path = self.path
+                if path.endswith('/'):
+                    names = set()
+                    for filename in stand_in.files:
+                        if filename.startswith(path):
+                            rest = filename[len(path):]
+                            if '/' in rest:
+                                rest = rest.split('/', 1)[0] + '/'
+                            names.add(rest)
+                    if not names:
+                        return self.respond(404)
+                    body = ''.join('<a href="%s">%s</a>\n' % (name, name)
+                                   for name in sorted(names))
+                    return self.respond(200, body, 'text/html')
+                if path not in stand_in.files:
+                    if any(f.startswith(path + '/') for f in stand_in.files):
+                        return self.respond(301, location=path + '/')
+                    return self.respond(404)
+                data = stand_in.files[path]
+                etag = '"%s"' % hashlib.sha1(data).hexdigest()
+                if self.headers.get('If-None-Match') == etag:
+                    return self.respond(304)
+                r = re.match(r'^bytes=([0-9]+)-$',
+                             self.headers.get('Range', ''))
+                if r is not None and self.headers.get('If-Range') == etag:
+                    start = int(r.group(1))
+                    if start >= len(data):
+                        return self.respond(416)
+                    return self.respond(
+                            206, data[start:], etag=etag,
+                            content_range='bytes %d-%d/%d' % (
+                                start, len(data) - 1, len(data)))
+                self.respond(200, data, etag=etag)
+
+            def respond(self, status, body='',
+                        content_type='application/octet-stream', etag=None,
+                        content_range=None, location=None):
+                stand_in.requests.append((self.path, status))
+                self.send_response(status)
+                if location is not None:
+                    self.send_header('Location', location)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                if etag is not None:
+                    self.send_header('ETag', etag)
+                if content_range is not None:
+                    self.send_header('Content-Range', content_range)
+                self.end_headers()
+                if self.path in stand_in.truncate:
+                    body = body[:stand_in.truncate[self.path]]
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestContentCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServerStandIn({
+                '/a': 'some data\n',
+                '/b': 'some data\n',
+                '/c': 'other data\n',
+                '/d.csv': 'some data\n',
+                '/big': ''.join(chr(i % 256) for i in xrange(200000))})
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp(prefix='vt_test_cache_')
+        self.opener = urllib2.build_opener()
+        del self.server.requests[:]
+        self.server.truncate.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fetch(self, cache, path):
+        url = self.server.url + path
+        response = cache.open(self.opener, url)
+        if response is None:
+            return cache.get(url)
+        return cache.download(url, response)
+
+    def read(self, filename):
+        with open(filename, 'rb') as fp:
+            return fp.read()
+
+    def test_revalidate(self):
+        cache = ContentCache(self.directory)
+        filename = self.fetch(cache, '/a')
+        self.assertEqual(self.read(filename), 'some data\n')
+        self.assertEqual(self.fetch(cache, '/a'), filename)
+        self.assertEqual(self.server.requests, [('/a', 200), ('/a', 304)])
+
+        # The index persists once flushed
+        cache.flush()
+        cache = ContentCache(self.directory)
+        self.assertEqual(self.fetch(cache, '/a'), filename)
+        self.assertEqual(self.server.requests[-1], ('/a', 304))
+
+    def test_shared_content(self):
+        cache = ContentCache(self.directory)
+        file_a = self.fetch(cache, '/a')
+        file_b = self.fetch(cache, '/b')
+        file_c = self.fetch(cache, '/c')
+        self.assertEqual(file_a, file_b)
+        self.assertNotEqual(file_a, file_c)
+        self.assertEqual(len(os.listdir(os.path.join(self.directory,
+                                                     'objects'))),
+                         2)
+
+    def test_extension(self):
+        cache = ContentCache(self.directory)
+        file_a = self.fetch(cache, '/a')
+        file_d = self.fetch(cache, '/d.csv')
+        self.assertTrue(file_d.endswith('.csv'))
+        self.assertEqual(file_d[:-4], file_a)
+        self.assertEqual(url_extension('http://host/dir.v2/file.tar.gz?x=1'),
+                         '.gz')
+        self.assertEqual(url_extension('http://host/dir.v2/file'), '')
+        self.assertEqual(url_extension('http://host/file.a b'), '')
+
+    def test_flush(self):
+        cache = ContentCache(self.directory)
+        self.fetch(cache, '/a')
+        self.fetch(cache, '/c')
+        index = os.path.join(self.directory, 'index.json')
+        self.assertFalse(os.path.exists(index))
+        cache.flush()
+        os.utime(index, (1000, 1000))
+        cache.flush()
+        # Nothing changed, the index was not written again
+        self.assertEqual(os.path.getmtime(index), 1000)
+        cache = ContentCache(self.directory)
+        self.assertIsNotNone(cache.lookup(self.server.url + '/c'))
+
+    def test_resume(self):
+        data = self.server.files['/big']
+        cache = ContentCache(self.directory)
+        self.server.truncate['/big'] = 70000
+        self.assertRaises(IOError, self.fetch, cache, '/big')
+        self.assertIsNone(cache.lookup(self.server.url + '/big'))
+
+        del self.server.truncate['/big']
+        progress = []
+        url = self.server.url + '/big'
+        response = cache.open(self.opener, url)
+        filename = cache.download(url, response, progress.append)
+        self.assertEqual(self.read(filename), data)
+        self.assertEqual(self.server.requests, [('/big', 200),
+                                                ('/big', 206)])
+        self.assertAlmostEqual(progress[0], 0.35)
+        self.assertEqual(progress[-1], 1.0)
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'partial')),
+                         [])
+
+    def test_evict(self):
+        cache = ContentCache(self.directory, max_size=25)
+        file_a = self.fetch(cache, '/a')
+        file_c = self.fetch(cache, '/c')
+        self.fetch(cache, '/a') # uses a, c is now the oldest
+        self.assertTrue(os.path.isfile(file_a))
+        self.assertTrue(os.path.isfile(file_c))
+
+        file_big = self.fetch(cache, '/big')
+        # Everything else was evicted, but not the file we just added
+        self.assertTrue(os.path.isfile(file_big))
+        self.assertFalse(os.path.isfile(file_a))
+        self.assertFalse(os.path.isfile(file_c))
+        self.assertIsNone(cache.lookup(self.server.url + '/a'))
+        self.assertIsNone(cache.lookup(self.server.url + '/b'))
+
+        cache.max_size = 200015
+        file_c = self.fetch(cache, '/c')
+        self.fetch(cache, '/big')
+        self.fetch(cache, '/a')
+        # c was the least recently used
+        self.assertFalse(os.path.isfile(file_c))
+        self.assertTrue(os.path.isfile(file_big))
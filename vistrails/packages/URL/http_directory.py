@@ -2,7 +2,11 @@
 
 from HTMLParser import HTMLParser
 import os
+import Queue
 import re
+import shutil
+import sys
+import threading
 
 from .https_if_available import build_opener
 
@@ -54,24 +58,70 @@ class ListingParser(HTMLParser):
                     break
 
 
-def download_directory(url, target, insecure=False):
-    def mkdir():
-        if not mkdir.done:
+def download_directory(url, target, insecure=False, cache=None, threads=4):
+    """Downloads a directory listing recursively.
+
+    The files are fetched concurrently by several threads. If a ContentCache
+    is given, the files are downloaded through it, so they are only
+    transferred again if they changed and interrupted transfers are resumed;
+    its index is written once at the end.
+    """
+    threads = max(1, threads)
+    queue = Queue.Queue()
+    errors = []
+
+    def worker():
+        opener = build_opener(insecure=insecure)
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            link, link_target = item
             try:
-                os.mkdir(target)
-            except OSError:
-                pass
-            mkdir.done = True
-    mkdir.done = False
+                if not errors:
+                    _download_entry(opener, cache, queue, link, link_target)
+            except Exception:
+                errors.append(sys.exc_info())
+            finally:
+                queue.task_done()
 
-    opener = build_opener(insecure=insecure)
-    response = opener.open(url)
+    queue.put((url, target))
+    for i in xrange(threads):
+        thread = threading.Thread(target=worker)
+        thread.setDaemon(True)
+        thread.start()
+    queue.join()
+    for i in xrange(threads):
+        queue.put(None)
+    if cache is not None:
+        cache.flush()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
 
-    if response.info().type == 'text/html':
+
+def _download_entry(opener, cache, queue, url, target):
+    """Downloads a single URL, queuing the links if it is a listing.
+    """
+    if cache is not None:
+        response = cache.open(opener, url)
+        while response is None:
+            # Not modified
+            filename = cache.get(url)
+            if filename is not None:
+                shutil.copyfile(filename, target)
+                return
+            # Evicted by another thread in the meantime, download it again
+            response = cache.open(opener, url)
+    else:
+        response = opener.open(url)
+
+    if (response.info().type == 'text/html' and
+            getattr(response, 'code', None) != 206):
         contents = response.read()
 
         parser = ListingParser(url)
         parser.feed(contents)
+        entries = []
         for link in parser.links:
             link = resolve_link(link, url)
             if link[-1] == '/':
@@ -81,9 +131,15 @@ def download_directory(url, target, insecure=False):
             name = link.rsplit('/', 1)[1]
             if '?' in name:
                 continue
-            mkdir()
-            download_directory(link, os.path.join(target, name), insecure)
-        if not mkdir.done:
+            entries.append((link, os.path.join(target, name)))
+        if entries:
+            try:
+                os.mkdir(target)
+            except OSError:
+                pass
+            for entry in entries:
+                queue.put(entry)
+        else:
             # We didn't find anything to write inside this directory
             # Maybe it's a HTML file?
             if url[-1] != '/':
@@ -92,8 +148,10 @@ def download_directory(url, target, insecure=False):
                     target = target + '.html'
                 with open(target, 'wb') as fp:
                     fp.write(contents)
+    elif cache is not None:
+        shutil.copyfile(cache.download(url, response), target)
     else:
-        buffer_size = 4096
+        buffer_size = 65536
         with open(target, 'wb') as fp:
             chunk = response.read(buffer_size)
             while chunk:
@@ -175,3 +233,115 @@ Index of /test</title></head><body><h1>Index of /test</h1><table><tr><th>
                 'http://a.remram.fr/cc/',
                 'http://a.remram.fr/dd',
         ]))
+
+
+class TestDownloadDirectory(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from .cache import HTTPServerStandIn
+
+        cls.server = HTTPServerStandIn({
+                '/test/a': 'aa\n',
+                '/test/bb': 'bb\n',
+                '/test/cc/d': 'dd\n',
+                '/test/cc/e/f': 'ff\n',
+                '/other': 'not in the directory\n'})
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp(prefix='vt_test_http_')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def list_files(self, target):
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(target):
+            for name in filenames:
+                filename = os.path.join(dirpath, name)
+                with open(filename, 'rb') as fp:
+                    relpath = os.path.relpath(filename, target)
+                    files[relpath.replace(os.sep, '/')] = fp.read()
+        return files
+
+    def test_download(self):
+        target = os.path.join(self.directory, 'target')
+        download_directory(self.server.url + '/test/', target, threads=3)
+        self.assertEqual(self.list_files(target), {
+                'a': 'aa\n',
+                'bb': 'bb\n',
+                'cc/d': 'dd\n',
+                'cc/e/f': 'ff\n'})
+
+    def test_cached(self):
+        from .cache import ContentCache
+
+        cache = ContentCache(os.path.join(self.directory, 'cache'))
+        for i in xrange(2):
+            del self.server.requests[:]
+            target = os.path.join(self.directory, 'target%d' % i)
+            download_directory(self.server.url + '/test/', target,
+                               cache=cache)
+            self.assertEqual(self.list_files(target), {
+                    'a': 'aa\n',
+                    'bb': 'bb\n',
+                    'cc/d': 'dd\n',
+                    'cc/e/f': 'ff\n'})
+        # The second time, the files were not transferred again
+        self.assertEqual(sorted(status
+                                for path, status in self.server.requests
+                                if path in self.server.files),
+                         [304] * 4)
+
+    def test_no_threads(self):
+        target = os.path.join(self.directory, 'target')
+        download_directory(self.server.url + '/test/cc', target, threads=0)
+        self.assertEqual(self.list_files(target), {
+                'd': 'dd\n',
+                'e/f': 'ff\n'})
+
+    def test_evicted(self):
+        from .cache import ContentCache
+
+        cache = ContentCache(os.path.join(self.directory, 'cache'))
+        download_directory(self.server.url + '/test/', os.path.join(
+                               self.directory, 'target0'),
+                           cache=cache)
+        # Simulates another thread evicting the files between the
+        # conditional request and get()
+        get = cache.get
+        evicted = set()
+        def racing_get(url):
+            if url not in evicted:
+                evicted.add(url)
+                os.remove(get(url))
+                return None
+            return get(url)
+        cache.get = racing_get
+        target = os.path.join(self.directory, 'target1')
+        download_directory(self.server.url + '/test/', target, cache=cache)
+        self.assertEqual(len(evicted), 4)
+        self.assertEqual(self.list_files(target), {
+                'a': 'aa\n',
+                'bb': 'bb\n',
+                'cc/d': 'dd\n',
+                'cc/e/f': 'ff\n'})
+
+    def test_error(self):
+        self.server.files['/test/g'] = 'gg\n'
+        self.server.truncate['/test/g'] = 1
+        try:
+            from .cache import ContentCache
+
+            cache = ContentCache(os.path.join(self.directory, 'cache'))
+            self.assertRaises(IOError, download_directory,
+                              self.server.url + '/test/',
+                              os.path.join(self.directory, 'target'),
+                              cache=cache)
+        finally:
+            del self.server.files['/test/g']
+            del self.server.truncate['/test/g']
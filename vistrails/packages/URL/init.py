@@ -40,11 +40,12 @@ without its associated data.
 
 This package uses a local cache, inside the per-user VisTrails directory. This
 way, files that haven't been changed do not need to be downloaded again. The
-check is performed efficiently using HTTP headers.
+check is performed efficiently using HTTP headers. Files are stored by content
+so that URLs serving the same data share them, and interrupted downloads are
+resumed.
 """
 
 from datetime import datetime
-import email.utils
 import hashlib
 import os
 import re
@@ -67,11 +68,13 @@ from vistrails.core.repository.poster.encode import multipart_encode
 from vistrails.core.repository.poster.streaminghttp import register_openers
 
 from .identifiers import identifier
+from .cache import ContentCache
 from .http_directory import download_directory
 from .https_if_available import build_opener
 
 
 package_directory = None
+content_cache = None
 
 
 ###############################################################################
@@ -87,8 +90,7 @@ class Downloader(object):
 
         Returns the path to the local file.
         """
-        self.local_filename = os.path.join(package_directory,
-                                           urllib.quote_plus(self.url))
+        self.local_filename = content_cache.get(self.url)
 
         # Before download
         self.pre_download()
@@ -109,7 +111,6 @@ class Downloader(object):
             return self.local_filename
 
         # Read response headers
-        self.size_header = None
         if not self.read_headers(response):
             return self.local_filename
 
@@ -131,28 +132,13 @@ class Downloader(object):
         return True
 
     def download(self, response):
+        def progress(fraction):
+            self.module.logging.update_progress(self.module, fraction)
         try:
-            dl_size = 0
-            CHUNKSIZE = 4096
-            f2 = open(self.local_filename, 'wb')
-            while True:
-                if self.size_header is not None:
-                    self.module.logging.update_progress(
-                            self.module,
-                            dl_size*1.0/self.size_header)
-                chunk = response.read(CHUNKSIZE)
-                if not chunk:
-                    break
-                dl_size += len(chunk)
-                f2.write(chunk)
-            f2.close()
-            response.close()
-
+            # Interrupted downloads are kept by the cache and resumed
+            self.local_filename = content_cache.download(self.url, response,
+                                                         progress)
         except Exception, e:
-            try:
-                os.unlink(self.local_filename)
-            except OSError:
-                pass
             raise ModuleError(
                     self.module,
                     "Error retrieving URL: %s" % debug.format_exception(e))
@@ -162,58 +148,24 @@ class Downloader(object):
 
     @property
     def is_in_local_cache(self):
-        return os.path.isfile(self.local_filename)
+        return self.local_filename is not None
 
 
 class HTTPDownloader(Downloader):
-    def pre_download(self):
-        # Get ETag from disk
-        try:
-            with open(self.local_filename + '.etag') as etag_file:
-                self.etag = etag_file.read()
-        except IOError:
-            self.etag = None
-
     def send_request(self):
-        try:
-            request = urllib2.Request(self.url)
-            if self.etag is not None:
-                request.add_header(
-                    'If-None-Match',
-                    self.etag)
-            try:
-                mtime = email.utils.formatdate(
-                        os.path.getmtime(self.local_filename),
-                        usegmt=True)
-                request.add_header(
-                    'If-Modified-Since',
-                    mtime)
-            except OSError:
-                pass
-            return self.opener.open(request)
-        except urllib2.HTTPError, e:
-            if e.code == 304:
-                # Not modified
-                return None
-            raise
+        # Conditional on the cached version, returns None if not modified
+        return content_cache.open(self.opener, self.url)
 
     def read_headers(self, response):
         try:
             self.mod_header = response.headers['last-modified']
         except KeyError:
             self.mod_header = None
-        try:
-            size_header = response.headers['content-length']
-            if not size_header:
-                raise ValueError
-            self.size_header = int(size_header)
-        except (KeyError, ValueError):
-            self.size_header = None
         return True
 
     def _is_outdated(self):
         local_time = datetime.utcfromtimestamp(
-                os.path.getmtime(self.local_filename))
+                content_cache.lookup(self.url)['date'])
         try:
             remote_time = strptime(self.mod_header,
                                    "%a, %d %b %Y %H:%M:%S %Z")
@@ -229,19 +181,10 @@ class HTTPDownloader(Downloader):
         return remote_time > local_time
 
     def download(self, response):
-        if (not self.is_in_local_cache or
+        if (not self.is_in_local_cache or response.code == 206 or
                 not self.mod_header or self._is_outdated()):
             Downloader.download(self, response)
 
-    def post_download(self, response):
-        try:
-            etag = response.headers['ETag']
-        except KeyError:
-            pass
-        else:
-            with open(self.local_filename + '.etag', 'w') as etag_file:
-                etag = etag_file.write(etag)
-
 
 class SSHDownloader(object):
     """ SSH downloader: downloads files via SCP, using paramiko and scp.
@@ -385,7 +328,10 @@ class DownloadFile(Module):
         """
         scheme = urllib2.splittype(url)[0]
         DL = downloaders.get(scheme, Downloader)
-        return DL(url, self, insecure).execute()
+        try:
+            return DL(url, self, insecure).execute()
+        finally:
+            content_cache.flush()
 
 
 class HTTPDirectory(Module):
@@ -404,7 +350,8 @@ class HTTPDirectory(Module):
     def download(self, url, insecure):
         local_path = self.interpreter.filePool.create_directory(
                 prefix='vt_http').name
-        download_directory(url, local_path, insecure)
+        download_directory(url, local_path, insecure, content_cache,
+                           configuration.downloadThreads)
         return local_path
 
 
@@ -648,6 +595,14 @@ def initialize(*args, **keywords):
             raise RuntimeError("Failed to create cache directory: %s" %
                                package_directory, e)
 
+    global content_cache
+    if configuration.cacheSize > 0:
+        max_size = configuration.cacheSize * 1024 * 1024
+    else:
+        max_size = None
+    content_cache = ContentCache(os.path.join(package_directory, 'content'),
+                                 max_size)
+
 
 def handle_module_upgrade_request(controller, module_id, pipeline):
     module_remap = {
@@ -32,9 +32,12 @@
 ## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
 ##
 ###############################################################################
+import datetime
+
 from vistrails.core.modules.vistrails_module import Module, ModuleError
 import vistrails.core.vistrail.vistrail
 import vistrails.core.log.log 
+import vistrails.core.log.store
 import vistrails.db.services.io
 
 
@@ -172,8 +175,87 @@ class TotalDays(Module):
         totals = self.calc_time(vistrail)
         self.set_output('completed', totals)
 
+class ProvenanceStore(Module):
+    pass
+
+class OpenProvenanceStore(Module):
+    """Opens a provenance store, adding a log to it if one is given.
+
+    Without a file, the store is kept in memory.
+    """
+    _input_ports = [('file', '(basic:File)', {'optional': True}),
+                    ('log', '(Log)', {'optional': True})]
+    _output_ports = [('store', '(ProvenanceStore)')]
+
+    def compute(self):
+        if self.has_input('file'):
+            store = vistrails.core.log.store.ProvenanceStore(
+                    self.get_input('file').name)
+        else:
+            store = vistrails.core.log.store.ProvenanceStore()
+        if self.has_input('log'):
+            store.import_log(self.get_input('log'))
+        self.set_output('store', store)
+
+def get_since(module):
+    # Start of the period to consider, from the optional 'days' port
+    if module.has_input('days'):
+        return (datetime.datetime.now() -
+                datetime.timedelta(days=module.get_input('days')))
+    return None
+
+class ModuleCosts(Module):
+    """Lists the modules by total execution time, most costly first.
+
+    Each item is (module name, executions, total, mean, max), in seconds.
+    """
+    _input_ports = [('store', '(ProvenanceStore)'),
+                    ('days', '(basic:Integer)', {'optional': True}),
+                    ('limit', '(basic:Integer)', {'optional': True})]
+    _output_ports = [('costs', '(basic:List)')]
+
+    def compute(self):
+        store = self.get_input('store')
+        costs = store.module_costs(since=get_since(self),
+                                   limit=self.force_get_input('limit'))
+        self.set_output('costs', costs)
+
+class CacheHitRates(Module):
+    """Computes the fraction of each module's executions that were cached.
+    """
+    _input_ports = [('store', '(ProvenanceStore)'),
+                    ('days', '(basic:Integer)', {'optional': True})]
+    _output_ports = [('rates', '(basic:Dictionary)')]
+
+    def compute(self):
+        store = self.get_input('store')
+        rates = dict((name, rate) for name, _, _, rate in
+                     store.cache_hit_rates(since=get_since(self)))
+        self.set_output('rates', rates)
+
+class TimingHistogram(Module):
+    """Computes a histogram of the execution times of a module.
+    """
+    _input_ports = [('store', '(ProvenanceStore)'),
+                    ('moduleName', '(basic:String)'),
+                    ('bins', '(basic:Integer)', {'optional': True,
+                                                 'defaults': "['10']"}),
+                    ('days', '(basic:Integer)', {'optional': True})]
+    _output_ports = [('edges', '(basic:List)'),
+                     ('counts', '(basic:List)')]
+
+    def compute(self):
+        store = self.get_input('store')
+        edges, counts = store.timing_histogram(self.get_input('moduleName'),
+                                               self.get_input('bins'),
+                                               since=get_since(self))
+        self.set_output('edges', edges)
+        self.set_output('counts', counts)
+
 #class TimevsTags(Module):
     #Compare a few workflows to see how long the project took vs. how many tags were made
  #   pass
 
-_modules = [Vistrail, Log, ReadVistrail, CountActions, CountExecutedWorkflows, TotalDays]
+_modules = [Vistrail, Log, ReadVistrail, CountActions, CountExecutedWorkflows, TotalDays,
+            ProvenanceStore, OpenProvenanceStore, ModuleCosts, CacheHitRates,
+            TimingHistogram]
@@ -135,11 +135,31 @@ class FoldWithModule(Fold):
                             InvalidOutput: # pragma: no cover
                         self.remove_input_connector(port_name, connector)
 
+    def make_function_iteration(self, function, nameInput, inputList, i):
+        """Creates the copy of the function module that runs on element i.
+        """
+        module = copy.copy(function)
+
+        if not self.upToDate: # pragma: no branch
+            ## Type checking
+            if i == 0:
+                self.typeChecking(module, nameInput, inputList)
+
+            module.upToDate = False
+            module.computed = False
+
+            self.setInputValues(module, nameInput, inputList[i], i)
+        return module
+
     def updateFunctionPort(self):
         """
         Function to be used inside the updateUsptream method of the
         FoldWithModule module. It updates the modules connected to the
         FunctionPort port.
+
+        If the 'loop_processes' control parameter is set, the function module
+        runs on a pool of processes, and the results are given to operation()
+        in order as they come back.
         """
         nameInput = self.get_input('InputPort')
         nameOutput = self.get_input('OutputPort')
@@ -154,49 +174,59 @@ class FoldWithModule(Fold):
             element_is_iter = True
             inputList = rawInputList
         suspended = []
+        functions = [connector.obj
+                     for connector in self.inputPorts.get('FunctionPort')]
+        processes = self.get_loop_processes()
+        if processes and len(functions) == 1 and len(inputList) > 1:
+            def make_iteration(nameInput, inputList, i):
+                return self.make_function_iteration(functions[0], nameInput,
+                                                    inputList, i)
+            results = self.run_loop_processes(processes, nameInput, inputList,
+                                              make_iteration)
+        else:
+            results = None
         loop = self.logging.begin_loop_execution(self, len(inputList))
         ## Update everything for each value inside the list
-        for i, element in enumerate(inputList):
-            self.logging.update_progress(self, float(i)/len(inputList))
-            if element_is_iter:
-                self.element = element
-            else:
-                self.element = element[0]
-            do_operation = True
-            for connector in self.inputPorts.get('FunctionPort'):
-                module = copy.copy(connector.obj)
+        try:
+            for i, element in enumerate(inputList):
+                self.logging.update_progress(self, float(i)/len(inputList))
+                if element_is_iter:
+                    self.element = element
+                else:
+                    self.element = element[0]
+                do_operation = True
+                for function in functions:
+                    module = self.make_function_iteration(function, nameInput,
+                                                          inputList, i)
+
+                    loop.begin_iteration(module, i)
 
-                if not self.upToDate: # pragma: no branch
-                    ## Type checking
-                    if i == 0:
-                        self.typeChecking(module, nameInput, inputList)
-
-                    module.upToDate = False
-                    module.computed = False
-
-                    self.setInputValues(module, nameInput, element, i)
-
-                loop.begin_iteration(module, i)
+                    try:
+                        if results is None:
+                            module.update()
+                        else:
+                            module.set_loop_result(results.next())
+                    except ModuleSuspended, e:
+                        suspended.append(e)
+                        do_operation = False
+                        loop.end_iteration(module)
+                        continue
 
-                try:
-                    module.update()
-                except ModuleSuspended, e:
-                    suspended.append(e)
-                    do_operation = False
                     loop.end_iteration(module)
-                    continue
-
-                loop.end_iteration(module)
-
-                ## Getting the result from the output port
-                if nameOutput not in module.outputPorts:
-                    raise ModuleError(module,
-                                      'Invalid output port: %s' % nameOutput)
-                self.elementResult = module.get_output(nameOutput)
-            if do_operation:
-                self.operation()
 
-            self.logging.update_progress(self, i * 1.0 / len(inputList))
+                    ## Getting the result from the output port
+                    if nameOutput not in module.outputPorts:
+                        raise ModuleError(module,
+                                          'Invalid output port: %s' %
+                                          nameOutput)
+                    self.elementResult = module.get_output(nameOutput)
+                if do_operation:
+                    self.operation()
+
+                self.logging.update_progress(self, i * 1.0 / len(inputList))
+        finally:
+            if results is not None:
+                results.close()
 
         if suspended:
             raise ModuleSuspended(
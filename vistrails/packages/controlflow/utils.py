@@ -118,6 +118,7 @@ class Or(Fold):
 
 ###############################################################################
 
+import os
 import unittest
 import urllib2
 
@@ -201,6 +202,55 @@ class TestMap(unittest.TestCase):
                 ]))
         self.assertEqual(results, [[3, 11, 1]])
 
+    def run_map(self, control_params=[], view=None):
+        from vistrails.core.modules.basic_modules import PythonSource
+        src = urllib2.quote('o = i * 2')
+        with intercept_result(Map, 'Result') as map_results:
+            with intercept_result(PythonSource, 'o') as iteration_results:
+                self.assertFalse(execute([
+                        ('PythonSource', 'org.vistrails.vistrails.basic', [
+                            ('source', [('String', src)]),
+                        ]),
+                        ('Map', 'org.vistrails.vistrails.control_flow', [
+                            ('InputPort', [('List', "['i']")]),
+                            ('OutputPort', [('String', 'o')]),
+                            ('InputList', [('List', repr(range(10)))]),
+                        ]),
+                    ],
+                    [
+                        (0, 'self', 1, 'FunctionPort'),
+                    ],
+                    add_port_specs=[
+                        (0, 'input', 'i',
+                         'org.vistrails.vistrails.basic:Integer'),
+                        (0, 'output', 'o',
+                         'org.vistrails.vistrails.basic:Integer'),
+                    ],
+                    control_params=control_params,
+                    view=view))
+        return map_results, iteration_results
+
+    def test_processes(self):
+        """Runs the function module on a process pool, keeping the order.
+        """
+        from vistrails.core.vistrail.module_control_param import \
+            ModuleControlParam
+        from vistrails.tests.utils import record_view_calls
+
+        expected = [i * 2 for i in xrange(10)]
+        map_results, iteration_results = self.run_map()
+        self.assertEqual(map_results, [expected])
+        self.assertEqual(iteration_results, expected)
+        with record_view_calls() as (view, calls):
+            map_results, iteration_results = self.run_map(
+                    [(1, ModuleControlParam.LOOP_PROCESSES_KEY, '3')], view)
+        self.assertEqual(map_results, [expected])
+        # The function module was computed in the workers
+        self.assertEqual(iteration_results, [])
+        # The workers didn't report to the view, only this process did
+        self.assertIn((os.getpid(), 'set_module_computing'), calls)
+        self.assertEqual(set(pid for pid, name in calls), set([os.getpid()]))
+
 
 class TestUtils(unittest.TestCase):
     def test_filter(self):
@@ -1,10 +1,16 @@
 from vistrails.core.modules.vistrails_module import Module
 from vistrails.core.modules.module_registry import get_module_registry
-from vistrails.core.modules.basic_modules import List, String
+from vistrails.core.modules.basic_modules import Integer, List, String
 
-from engine_manager import EngineManager
+from local_engine import LocalEngine
 from map import Map
 
+try:
+    from engine_manager import EngineManager
+except ImportError:
+    # IPython is not available, only the local engine can be used
+    EngineManager = None
+
 
 def initialize(*args,**keywords):
     reg = get_module_registry()
@@ -14,14 +20,24 @@ def initialize(*args,**keywords):
     reg.add_input_port(Map, 'InputList', (List, ''))
     reg.add_input_port(Map, 'InputPort', (List, ''))
     reg.add_input_port(Map, 'OutputPort', (String, ''))
+    reg.add_input_port(Map, 'Engine', (String, ''), optional=True,
+                       entry_types=['enum'], values=["['ipython', 'local']"])
+    reg.add_input_port(Map, 'Processes', (Integer, ''), optional=True)
+    reg.add_input_port(Map, 'BatchSize', (Integer, ''), optional=True)
+    reg.add_input_port(Map, 'Retries', (Integer, ''), optional=True,
+                       defaults="['1']")
     reg.add_output_port(Map, 'Result', (List, ''))
 
 
 def finalize():
-    EngineManager.cleanup()
+    LocalEngine.cleanup()
+    if EngineManager is not None:
+        EngineManager.cleanup()
 
 
 def menu_items():
+    if EngineManager is None:
+        return ()
     return (
             ("Start new engine processes",
              lambda: EngineManager.start_engines()),
@@ -0,0 +1,196 @@
+"""Runs Map elements on a pool of local processes, without IPython.
+
+The pool is created on first use and kept until the package is unloaded, or
+until the set of enabled packages changes. Its workers are forked from
+VisTrails, so they start with the module registry already loaded, and each
+keeps its own CachedInterpreter between elements: an element that was
+already computed by a worker is not executed again. That cache is dropped
+once it holds more than CACHE_MAX_MODULES modules, since every execution walks
+the whole persistent pipeline. The unserialized modules are kept as well, at
+most CACHE_MAX_PIPELINES of them, and are dropped along with that cache.
+
+The module to run is sent to the workers serialized, once per chunk of
+elements (see map.iter_chunk_results()), and each element only carries the values of its functions; no
+temporary file, Vistrail or VistrailController is created.
+"""
+
+import copy
+import inspect
+import multiprocessing
+
+from vistrails.core.db.io import serialize, unserialize
+from vistrails.core.interpreter.cached import CachedInterpreter
+from vistrails.core.log.controller import LogController
+from vistrails.core.log.log import Log
+import vistrails.core.modules.module_registry
+from vistrails.core.modules.vistrails_module import Module, ModuleError
+from vistrails.core.packagemanager import get_package_manager
+from vistrails.core.utils import DummyView
+from vistrails.core.vistrail.module_function import ModuleFunction
+from vistrails.core.vistrail.module_param import ModuleParam
+from vistrails.core.vistrail.pipeline import Pipeline
+
+
+###############################################################################
+# This is executed in the worker processes
+#
+
+CACHE_MAX_MODULES = 1000
+CACHE_MAX_PIPELINES = 16
+
+_worker_interpreter = None
+_worker_pipelines = {} # module XML -> Pipeline
+
+def _init_worker():
+    global _worker_interpreter
+    _worker_interpreter = CachedInterpreter()
+    _worker_pipelines.clear()
+
+def execute_element(pipeline, module_id, functions, output_port):
+    """Executes the module with the given functions added.
+
+    functions is a list of (port_name, type, value) tuples.
+
+    Returns a dictionary in the same format as map.execute_wf().
+    """
+    pipeline = copy.copy(pipeline)
+    module = pipeline.modules[module_id]
+    if module.functions:
+        next_id = max(function.db_id for function in module.functions) + 1
+    else:
+        next_id = 1
+    for i, (port_name, param_type, value) in enumerate(functions):
+        # TODO: 'pos' should not be always 0 here
+        function = ModuleFunction(id=next_id + i, pos=0, name=port_name)
+        function.add_parameter(ModuleParam(id=0L, pos=0, type=param_type,
+                                           val=value))
+        module.add_function(function)
+    pipeline.invalidate_signatures(module_id)
+
+    log = Log()
+    logger = LogController(log)
+    execution = _worker_interpreter.execute(
+            pipeline,
+            view=DummyView(),
+            logger=logger,
+            reason='Parallel Flow Map')
+
+    # Build a list of errors
+    errors = []
+    if execution.errors:
+        for key, error in execution.errors.iteritems():
+            errors.append('%s: %s' % (pipeline.modules[key].name, error))
+
+    # Get the execution log
+    try:
+        module_log = log.workflow_execs[0].item_execs[0]
+    except IndexError:
+        errors.append("Module log not found")
+        return dict(errors=errors)
+
+    # Get the output value; the module might have been cached by this worker,
+    # so we get it from the objects rather than the executed modules
+    output = None
+    serializable = None
+    if not execution.errors:
+        executed_module = execution.objects[module_id]
+        try:
+            output = executed_module.get_output(output_port)
+        except ModuleError:
+            errors.append("Output port not found: %s" % output_port)
+            return dict(errors=errors)
+        reg = vistrails.core.modules.module_registry.get_module_registry()
+        if Module in inspect.getmro(type(output)):
+            serializable = reg.get_descriptor(type(output)).sigstring
+            output = output.serialize()
+
+    return dict(errors=errors,
+                output=output,
+                serializable=serializable,
+                xml_log=serialize(module_log),
+                machine_log=serialize(logger.machine))
+
+def _execute_chunk(args):
+    module_xml, module_id, output_port, elements = args
+    try:
+        pipeline = _worker_pipelines[module_xml]
+    except KeyError:
+        # The XML changes with every edit of the module, don't keep them all
+        if len(_worker_pipelines) >= CACHE_MAX_PIPELINES:
+            _worker_pipelines.clear()
+        pipeline = unserialize(module_xml, Pipeline)
+        _worker_pipelines[module_xml] = pipeline
+    global _worker_interpreter
+    results = []
+    for functions in elements:
+        if (len(_worker_interpreter._persistent_pipeline.modules) >
+                CACHE_MAX_MODULES):
+            _worker_interpreter = CachedInterpreter()
+            _worker_pipelines.clear()
+            _worker_pipelines[module_xml] = pipeline
+        results.append(execute_element(pipeline, module_id, functions,
+                                       output_port))
+    return results
+
+
+###############################################################################
+# Pool management
+#
+
+class LocalEngine(object):
+    """Keeps a pool of pre-initialized worker processes.
+    """
+    def __init__(self):
+        self._pool = None
+        self._processes = None
+        self._packages = None
+
+    def get_pool(self, processes=None):
+        """Returns the pool, creating it if needed.
+
+        processes defaults to the number of CPUs. The pool is recreated if
+        that number changed, or if packages were enabled or disabled since it
+        was created, since the workers would not see them.
+        """
+        if not processes:
+            processes = multiprocessing.cpu_count()
+        packages = set(pkg.identifier for pkg in
+                       get_package_manager().enabled_package_list())
+        if (self._pool is not None and
+                (processes != self._processes or packages != self._packages)):
+            self.cleanup()
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(processes, _init_worker)
+            self._processes = processes
+            self._packages = packages
+        return self._pool
+
+    @property
+    def processes(self):
+        """The number of worker processes of the current pool.
+        """
+        return self._processes
+
+    def submit(self, module_xml, module_id, output_port, elements,
+               processes=None):
+        """Starts running a module once per element on the pool.
+
+        module_xml is a Pipeline containing the module, serialized; each
+        element is a list of (port_name, type, value) tuples to add as
+        functions on the module. Returns an AsyncResult, whose get() method
+        returns a list of dictionaries in the same format as map.execute_wf().
+        """
+        pool = self.get_pool(processes)
+        return pool.apply_async(
+                _execute_chunk,
+                ((module_xml, module_id, output_port, elements),))
+
+    def cleanup(self):
+        """Terminates the worker processes.
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+LocalEngine = LocalEngine()
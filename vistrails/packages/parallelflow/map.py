@@ -21,16 +21,15 @@ from vistrails.core.vistrail.vistrail import Vistrail
 from vistrails.db.domain import IdScope
 import vistrails.db.versions
 
+from collections import deque
 import copy
 import inspect
-from itertools import izip
+from itertools import islice, izip
 import os
 import re
 import sys
 import tempfile
 
-from IPython.parallel.error import CompositeError
-
 from .api import get_client
 
 try:
@@ -140,11 +139,76 @@ def execute_wf(wf, output_port):
 
 ###############################################################################
 
+def ipython_available():
+    try:
+        import IPython.parallel
+    except ImportError:
+        return False
+    else:
+        return True
+
 _ansi_code = re.compile(r'%s(?:(?:\[[^A-Za-z]*[A-Za-z])|[^\[])' % '\x1B')
 
 def strip_ansi_codes(s):
     return _ansi_code.sub('', s)
 
+MAX_BATCH_SIZE = 100
+DEFAULT_RETRIES = 1
+
+def iter_chunk_results(elements, submit, batch_size, window, retries):
+    """Runs elements by chunks, yielding their results in order.
+
+    submit(chunk) starts the execution of a list of elements and returns an
+    object whose get() method waits for the list of result dictionaries. At
+    most window chunks are submitted at once, so elements are only consumed
+    as the engines catch up.
+
+    If get() raises, the chunk is submitted again; the elements whose results
+    have errors are also submitted again. Either is done at most retries times
+    per chunk, after which the exception is raised or the results with errors
+    are returned.
+    """
+    elements = iter(elements)
+    pending = deque()
+
+    def fill():
+        while len(pending) < window:
+            chunk = list(islice(elements, batch_size))
+            if not chunk:
+                return
+            pending.append((chunk, submit(chunk)))
+
+    fill()
+    while pending:
+        chunk, async_result = pending.popleft()
+        fill()
+        results = None
+        failed = None
+        tries = 0
+        while True:
+            try:
+                new_results = async_result.get()
+            except Exception:
+                if tries >= retries:
+                    raise
+            else:
+                if results is None:
+                    results = new_results
+                else:
+                    for i, result in izip(failed, new_results):
+                        results[i] = result
+                failed = [i for i, result in enumerate(results)
+                          if result['errors']]
+                if not failed or tries >= retries:
+                    break
+            tries += 1
+            if results is None:
+                async_result = submit(chunk)
+            else:
+                async_result = submit([chunk[i] for i in failed])
+        for result in results:
+            yield result
+
 ###############################################################################
 # Map Operator
 #
@@ -154,6 +218,10 @@ class Map(Module):
     The FunctionPort should be connected to the 'self' output of the module you
     want to execute.
     The InputList is the list of values to be scattered on the engines.
+
+    Elements are sent to the engines by chunks of BatchSize, and the chunks
+    that fail are retried Retries times. Results are collected in order as
+    the chunks complete.
     """
     def __init__(self):
         Module.__init__(self)
@@ -204,6 +272,12 @@ class Map(Module):
         nameOutput = self.get_input('OutputPort')
         rawInputList = self.get_input('InputList')
 
+        engine = self.force_get_input('Engine', None)
+        if engine is None:
+            engine = 'ipython' if ipython_available() else 'local'
+        elif engine not in ('ipython', 'local'):
+            raise ModuleError(self, "Unknown engine %r" % engine)
+
         # Create inputList to always have iterable elements
         # to simplify code
         if len(nameInput) == 1:
@@ -213,95 +287,248 @@ class Map(Module):
             element_is_iter = True
             inputList = rawInputList
 
-        workflows = []
-        module = None
-        vtType = None
+        # getting first connector, ignoring the rest
+        connector = self.inputPorts.get('FunctionPort')[0]
+        module = connector.obj
+
+        # pipeline
+        original_pipeline = connector.obj.moduleInfo['pipeline']
+
+        # module
+        module_id = connector.obj.moduleInfo['moduleId']
+        vtType = original_pipeline.modules[module_id].vtType
 
-        # iterating through the connectors
-        for connector in self.inputPorts.get('FunctionPort'):
-            module = connector.obj
+        pipeline_db_module = original_pipeline.modules[module_id].do_copy()
 
-            # pipeline
-            original_pipeline = connector.obj.moduleInfo['pipeline']
+        # transforming a subworkflow in a group
+        # TODO: should we also transform inner subworkflows?
+        if pipeline_db_module.is_abstraction():
+            group = Group(id=pipeline_db_module.id,
+                          cache=pipeline_db_module.cache,
+                          location=pipeline_db_module.location,
+                          functions=pipeline_db_module.functions,
+                          annotations=pipeline_db_module.annotations)
 
-            # module
-            module_id = connector.obj.moduleInfo['moduleId']
-            vtType = original_pipeline.modules[module_id].vtType
+            source_port_specs = pipeline_db_module.sourcePorts()
+            dest_port_specs = pipeline_db_module.destinationPorts()
+            for source_port_spec in source_port_specs:
+                group.add_port_spec(source_port_spec)
+            for dest_port_spec in dest_port_specs:
+                group.add_port_spec(dest_port_spec)
 
-            # serialize the module for each value in the list
+            group.pipeline = pipeline_db_module.pipeline
+            pipeline_db_module = group
+
+        port_types = self.get_port_types(pipeline_db_module, nameInput)
+
+        # checking types once for the whole list
+        self.typeChecking(connector.obj, nameInput, inputList)
+
+        def elements():
+            # build the functions to set for each value in the list, as the
+            # engine asks for them
             for i, element in enumerate(inputList):
                 if element_is_iter:
                     self.element = element
                 else:
                     self.element = element[0]
 
-                # checking type and setting input in the module
-                self.typeChecking(connector.obj, nameInput, inputList)
+                # setting input in the module
                 self.setInputValues(connector.obj, nameInput, element, i)
 
-                pipeline_db_module = original_pipeline.modules[module_id].do_copy()
-
-                # transforming a subworkflow in a group
-                # TODO: should we also transform inner subworkflows?
-                if pipeline_db_module.is_abstraction():
-                    group = Group(id=pipeline_db_module.id,
-                                  cache=pipeline_db_module.cache,
-                                  location=pipeline_db_module.location,
-                                  functions=pipeline_db_module.functions,
-                                  annotations=pipeline_db_module.annotations)
-
-                    source_port_specs = pipeline_db_module.sourcePorts()
-                    dest_port_specs = pipeline_db_module.destinationPorts()
-                    for source_port_spec in source_port_specs:
-                        group.add_port_spec(source_port_spec)
-                    for dest_port_spec in dest_port_specs:
-                        group.add_port_spec(dest_port_spec)
-
-                    group.pipeline = pipeline_db_module.pipeline
-                    pipeline_db_module = group
-
-                # getting highest id between functions to guarantee unique ids
-                # TODO: can get current IdScope here?
-                if pipeline_db_module.functions:
-                    high_id = max(function.db_id
-                                  for function in pipeline_db_module.functions)
+                yield [(inputPort, sig, klass.translate_to_string(value))
+                       for inputPort, (sig, klass), value in izip(
+                               nameInput, port_types, element)]
+
+        # setting computing color
+        module.logging.set_computing(module)
+
+        if engine == 'local':
+            map_results = self.execute_local(pipeline_db_module, elements(),
+                                             nameOutput, len(inputList))
+        else:
+            map_results = self.execute_ipython(pipeline_db_module, elements(),
+                                               nameOutput, len(inputList))
+
+        # results come back in order, as the chunks complete
+        reg = vistrails.core.modules.module_registry.get_module_registry()
+        errors = []
+        self.result = []
+        for i, map_execution in enumerate(map_results):
+            if map_execution['errors']:
+                errors.append("ModuleError in element %d: '%s'" % (
+                              i, ', '.join(map_execution['errors'])))
+            elif not errors:
+                serializable = map_execution['serializable']
+                if not serializable:
+                    output = map_execution['output']
                 else:
-                    high_id = 0
-
-                # adding function and parameter to module in pipeline
-                # TODO: 'pos' should not be always 0 here
-                id_scope = IdScope(beginId=long(high_id+1))
-                for elementValue, inputPort in izip(element, nameInput):
-
-                    p_spec = pipeline_db_module.get_port_spec(inputPort, 'input')
-                    descrs = p_spec.descriptors()
-                    if len(descrs) != 1:
-                        raise ModuleError(
-                                self,
-                                "Tuple input ports are not supported")
-                    if not issubclass(descrs[0].module, Constant):
-                        raise ModuleError(
-                                self,
-                                "Module inputs should be Constant types")
-                    type = p_spec.sigstring[1:-1]
-
-                    mod_function = ModuleFunction(id=id_scope.getNewId(ModuleFunction.vtType),
-                                                  pos=0,
-                                                  name=inputPort)
-                    mod_param = ModuleParam(id=0L,
-                                            pos=0,
-                                            type=type,
-                                            val=elementValue)
-
-                    mod_function.add_parameter(mod_param)
-                    pipeline_db_module.add_function(mod_function)
-
-                # serializing module
-                wf = self.serialize_module(pipeline_db_module)
-                workflows.append(wf)
-
-            # getting first connector, ignoring the rest
-            break
+                    d_tuple = vistrails.core.modules.utils.parse_descriptor_string(serializable)
+                    d = reg.get_descriptor_by_name(*d_tuple)
+                    module_klass = d.module
+                    output = module_klass().deserialize(map_execution['output'])
+                self.result.append(output)
+            if 'xml_log' in map_execution:
+                self.add_execution_log(map_execution, vtType)
+            self.logging.update_progress(self, float(i + 1) / len(inputList))
+
+        if errors:
+            raise ModuleError(self, '\n'.join(errors))
+
+        # setting success color
+        module.logging.signalSuccess(module)
+
+    def add_execution_log(self, map_execution, vtType):
+        """
+        Adds the execution log of one element to the log of this execution.
+        """
+        # nothing to do if the execution is not logged
+        if not hasattr(self.logging.log, 'log'):
+            return
+
+        log = map_execution['xml_log']
+        exec_ = None
+        if (vtType == 'abstraction') or (vtType == 'group'):
+            exec_ = unserialize(log, GroupExec)
+        elif (vtType == 'module'):
+            exec_ = unserialize(log, ModuleExec)
+        else:
+            # something is wrong...
+            return
+
+        # assigning new ids to existing annotations
+        exec_annotations = exec_.annotations
+        for i in range(len(exec_annotations)):
+            exec_annotations[i].id = self.logging.log.log.id_scope.getNewId(Annotation.vtType)
+
+        parallel_annotation = Annotation(key='parallel_execution', value=True)
+        parallel_annotation.id = self.logging.log.log.id_scope.getNewId(Annotation.vtType)
+        annotations = [parallel_annotation] + exec_annotations
+        exec_.annotations = annotations
+
+        # before adding the execution log, we need to get the machine information
+        machine = unserialize(map_execution['machine_log'], Machine)
+        machine_id = self.logging.add_machine(machine)
+
+        # recursively add machine information to execution items
+        def add_machine_recursive(exec_):
+            for item in exec_.item_execs:
+                if hasattr(item, 'machine_id'):
+                    item.machine_id = machine_id
+                    if item.vtType in ('abstraction', 'group'):
+                        add_machine_recursive(item)
+
+        exec_.machine_id = machine_id
+        if (vtType == 'abstraction') or (vtType == 'group'):
+            add_machine_recursive(exec_)
+
+        self.logging.add_exec(exec_)
+
+    def get_port_types(self, pipeline_db_module, port_names):
+        """
+        Checks that the mapped input ports can be set from the values of the
+        list, and returns their types, as (signature, Constant subclass) pairs.
+        """
+        types = []
+        for inputPort in port_names:
+            p_spec = pipeline_db_module.get_port_spec(inputPort, 'input')
+            descrs = p_spec.descriptors()
+            if len(descrs) != 1:
+                raise ModuleError(
+                        self,
+                        "Tuple input ports are not supported")
+            if not issubclass(descrs[0].module, Constant):
+                raise ModuleError(
+                        self,
+                        "Module inputs should be Constant types")
+            types.append((p_spec.sigstring[1:-1], descrs[0].module))
+        return types
+
+    def get_chunking(self, total, workers):
+        """
+        Returns the number of elements to send at once and the number of
+        retries, from the BatchSize and Retries ports.
+
+        By default, the list is split in about 4 chunks per worker, of at
+        most MAX_BATCH_SIZE elements.
+        """
+        batch_size = self.force_get_input('BatchSize', None)
+        if batch_size is None:
+            batch_size = min(-(-total // (workers * 4)), MAX_BATCH_SIZE)
+        elif batch_size < 1:
+            raise ModuleError(self, "BatchSize should be positive")
+        retries = self.force_get_input('Retries', DEFAULT_RETRIES)
+        return max(batch_size, 1), retries
+
+    def execute_local(self, pipeline_db_module, elements, nameOutput, total):
+        """
+        Executes the module on the pool of local processes.
+
+        This is a generator, yielding the result of each element in order.
+        """
+        from .local_engine import LocalEngine
+
+        module_xml = self.serialize_module(pipeline_db_module)
+        processes = self.force_get_input('Processes', None)
+
+        def submit(chunk):
+            return LocalEngine.submit(module_xml, pipeline_db_module.id,
+                                      nameOutput, chunk, processes)
+
+        try:
+            LocalEngine.get_pool(processes)
+            workers = LocalEngine.processes
+            batch_size, retries = self.get_chunking(total, workers)
+            for result in iter_chunk_results(elements, submit, batch_size,
+                                             workers * 2, retries):
+                yield result
+        except ModuleError:
+            raise
+        except Exception, e:
+            raise ModuleError(self, "Error from local engine: %s" %
+                              debug.format_exception(e))
+
+    def element_workflow(self, pipeline_db_module, functions):
+        """
+        Serializes the module with the functions of one element added.
+        """
+        element_module = pipeline_db_module.do_copy()
+
+        # getting highest id between functions to guarantee unique ids
+        # TODO: can get current IdScope here?
+        if element_module.functions:
+            high_id = max(function.db_id
+                          for function in element_module.functions)
+        else:
+            high_id = 0
+
+        # adding function and parameter to module in pipeline
+        # TODO: 'pos' should not be always 0 here
+        id_scope = IdScope(beginId=long(high_id+1))
+        for inputPort, type, elementValue in functions:
+            mod_function = ModuleFunction(id=id_scope.getNewId(ModuleFunction.vtType),
+                                          pos=0,
+                                          name=inputPort)
+            mod_param = ModuleParam(id=0L,
+                                    pos=0,
+                                    type=type,
+                                    val=elementValue)
+
+            mod_function.add_parameter(mod_param)
+            element_module.add_function(mod_function)
+
+        # serializing module
+        return self.serialize_module(element_module)
+
+    def execute_ipython(self, pipeline_db_module, elements, nameOutput,
+                        total):
+        """
+        Executes the module on IPython engines, serializing a workflow for
+        each element.
+
+        This is a generator, yielding the result of each element in order.
+        """
+        from IPython.parallel.error import CompositeError
 
         # IPython stuff
         try:
@@ -361,89 +588,26 @@ class Map(Module):
 
             init_view['init'] = True
 
-        # setting computing color
-        module.logging.set_computing(module)
+        # executing function in engines, a chunk of elements at a time
+        # each element returns a dictionary
+        ldview = rc.load_balanced_view()
+
+        def submit(chunk):
+            workflows = [self.element_workflow(pipeline_db_module, functions)
+                         for functions in chunk]
+            return ldview.map_async(execute_wf, workflows,
+                                    [nameOutput] * len(workflows))
 
-        # executing function in engines
-        # each map returns a dictionary
+        batch_size, retries = self.get_chunking(total, len(engines))
         try:
-            ldview = rc.load_balanced_view()
-            map_result = ldview.map_sync(execute_wf, workflows, [nameOutput]*len(workflows))
+            for result in iter_chunk_results(elements, submit, batch_size,
+                                             len(engines) * 2, retries):
+                yield result
         except CompositeError, e:
             self.print_compositeerror(e)
             raise ModuleError(self, "Error from IPython engines:\n"
                               "%s" % self.list_exceptions(e))
 
-        # verifying errors
-        errors = []
-        for engine in range(len(map_result)):
-            if map_result[engine]['errors']:
-                msg = "ModuleError in engine %d: '%s'" % (
-                        engine,
-                        ', '.join(map_result[engine]['errors']))
-                errors.append(msg)
-
-        if errors:
-            raise ModuleError(self, '\n'.join(errors))
-
-        # setting success color
-        module.logging.signalSuccess(module)
-
-        reg = vistrails.core.modules.module_registry.get_module_registry()
-        self.result = []
-        for map_execution in map_result:
-            serializable = map_execution['serializable']
-            output = None
-            if not serializable:
-                output = map_execution['output']
-            else:
-                d_tuple = vistrails.core.modules.utils.parse_descriptor_string(serializable)
-                d = reg.get_descriptor_by_name(*d_tuple)
-                module_klass = d.module
-                output = module_klass().deserialize(map_execution['output'])
-            self.result.append(output)
-
-        # including execution logs
-        for engine in range(len(map_result)):
-            log = map_result[engine]['xml_log']
-            exec_ = None
-            if (vtType == 'abstraction') or (vtType == 'group'):
-                exec_ = unserialize(log, GroupExec)
-            elif (vtType == 'module'):
-                exec_ = unserialize(log, ModuleExec)
-            else:
-                # something is wrong...
-                continue
-
-            # assigning new ids to existing annotations
-            exec_annotations = exec_.annotations
-            for i in range(len(exec_annotations)):
-                exec_annotations[i].id = self.logging.log.log.id_scope.getNewId(Annotation.vtType)
-
-            parallel_annotation = Annotation(key='parallel_execution', value=True)
-            parallel_annotation.id = self.logging.log.log.id_scope.getNewId(Annotation.vtType)
-            annotations = [parallel_annotation] + exec_annotations
-            exec_.annotations = annotations
-
-            # before adding the execution log, we need to get the machine information
-            machine = unserialize(map_result[engine]['machine_log'], Machine)
-            machine_id = self.logging.add_machine(machine)
-
-            # recursively add machine information to execution items
-            def add_machine_recursive(exec_):
-                for item in exec_.item_execs:
-                    if hasattr(item, 'machine_id'):
-                        item.machine_id = machine_id
-                        if item.vtType in ('abstraction', 'group'):
-                            add_machine_recursive(item)
-
-            exec_.machine_id = machine_id
-            if (vtType == 'abstraction') or (vtType == 'group'):
-                add_machine_recursive(exec_)
-
-            self.logging.add_exec(exec_)
-
-
     def serialize_module(self, module):
         """
         Serializes a module to be executed in parallel.
@@ -520,3 +684,145 @@ def get_module(value, signature):
         debug.warning("Could not identify the type of the list element.")
         debug.warning("Type checking is not going to be done inside Map module.")
         return None
+
+###############################################################################
+
+import unittest
+
+
+class TestLocalEngine(unittest.TestCase):
+    def run_map(self, values, engine='local', batch_size=None):
+        from vistrails.tests.utils import execute, intercept_result
+
+        with intercept_result(Map, 'Result') as results:
+            errors = execute([
+                    ('PythonCalc', 'org.vistrails.vistrails.pythoncalc', [
+                        ('value2', [('Float', '2.0')]),
+                        ('op', [('String', '*')]),
+                    ]),
+                    ('Map', 'edu.poly.vistrails.parallel_flow', [
+                        ('InputList', [('List', repr(values))]),
+                        ('InputPort', [('List', "['value1']")]),
+                        ('OutputPort', [('String', 'value')]),
+                        ('Engine', [('String', engine)]),
+                        ('Processes', [('Integer', '2')]),
+                    ] + ([('BatchSize', [('Integer', str(batch_size))])]
+                         if batch_size is not None else [])),
+                ],
+                [
+                    (0, 'self', 1, 'FunctionPort'),
+                ])
+        return errors, results
+
+    def test_map(self):
+        errors, results = self.run_map([1.0, 2.5, 4.0, 2.5])
+        self.assertFalse(errors)
+        self.assertEqual(results, [[2.0, 5.0, 8.0, 5.0]])
+
+    def test_batches(self):
+        values = [float(i) for i in xrange(25)]
+        errors, results = self.run_map(values, batch_size=3)
+        self.assertFalse(errors)
+        self.assertEqual(results, [[v * 2.0 for v in values]])
+
+    def test_empty(self):
+        errors, results = self.run_map([])
+        self.assertFalse(errors)
+        self.assertEqual(results, [[]])
+
+    def test_unknown_engine(self):
+        errors, results = self.run_map([1.0], 'cluster')
+        self.assertEqual(errors.keys(), [1])
+
+    def test_worker_pipelines(self):
+        """Checks that the workers don't keep every module they were sent.
+        """
+        from vistrails.core.vistrail.pipeline import Pipeline
+        from . import local_engine
+
+        local_engine._init_worker()
+        try:
+            module_xml = serialize(Pipeline())
+            nb = local_engine.CACHE_MAX_PIPELINES
+            for i in xrange(nb + 1):
+                # Different XML, as if the module had been edited
+                local_engine._execute_chunk((module_xml + ' ' * i, 0,
+                                             'value', []))
+            self.assertEqual(local_engine._worker_pipelines.keys(),
+                             [module_xml + ' ' * nb])
+        finally:
+            local_engine._worker_interpreter = None
+            local_engine._worker_pipelines.clear()
+
+
+class FakeAsyncResult(object):
+    def __init__(self, results):
+        self.results = results
+
+    def get(self):
+        if isinstance(self.results, Exception):
+            raise self.results
+        return self.results
+
+
+class TestChunkResults(unittest.TestCase):
+    def test_order(self):
+        chunks = []
+        def submit(chunk):
+            chunks.append(chunk)
+            return FakeAsyncResult([dict(errors=[], output=e) for e in chunk])
+        results = iter_chunk_results(xrange(10), submit, 3, 2, 0)
+        self.assertEqual([r['output'] for r in results], range(10))
+        self.assertEqual(chunks, [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]])
+
+    def test_window(self):
+        submitted = []
+        def submit(chunk):
+            submitted.extend(chunk)
+            return FakeAsyncResult([dict(errors=[], output=e) for e in chunk])
+        results = iter_chunk_results(xrange(100), submit, 2, 3, 0)
+        self.assertEqual(results.next()['output'], 0)
+        # first chunk, plus 3 more chunks in flight
+        self.assertEqual(len(submitted), 8)
+
+    def test_retry(self):
+        attempts = {}
+        def submit(chunk):
+            results = []
+            for e in chunk:
+                attempts[e] = attempts.get(e, 0) + 1
+                if e % 3 == 0 and attempts[e] == 1:
+                    results.append(dict(errors=['failed']))
+                else:
+                    results.append(dict(errors=[], output=e))
+            return FakeAsyncResult(results)
+        results = list(iter_chunk_results(xrange(7), submit, 4, 2, 1))
+        self.assertEqual([r['output'] for r in results], range(7))
+        self.assertEqual(attempts, {0: 2, 1: 1, 2: 1, 3: 2, 4: 1, 5: 1, 6: 2})
+
+    def test_retry_exception(self):
+        calls = []
+        def submit(chunk):
+            calls.append(chunk)
+            if len(calls) == 1:
+                return FakeAsyncResult(RuntimeError("engine died"))
+            return FakeAsyncResult([dict(errors=[], output=e) for e in chunk])
+        results = list(iter_chunk_results(xrange(3), submit, 5, 1, 1))
+        self.assertEqual([r['output'] for r in results], range(3))
+        self.assertEqual(calls, [[0, 1, 2], [0, 1, 2]])
+
+        calls[:] = []
+        def submit(chunk):
+            calls.append(chunk)
+            return FakeAsyncResult(RuntimeError("engine died"))
+        with self.assertRaises(RuntimeError):
+            list(iter_chunk_results(xrange(3), submit, 5, 1, 2))
+        self.assertEqual(len(calls), 3)
+
+    def test_errors_kept(self):
+        def submit(chunk):
+            return FakeAsyncResult([dict(errors=['failed %d' % e])
+                                    for e in chunk])
+        results = list(iter_chunk_results(xrange(2), submit, 5, 1, 1))
+        self.assertEqual([r['errors'] for r in results],
+                         [['failed 0'], ['failed 1']])
@@ -1,3 +1,4 @@
+from itertools import izip
 try:
     import numpy
 except ImportError: # pragma: no cover
@@ -23,6 +24,8 @@ class TableObject(object):
     names = None # the names of the columns
     name = None # a name for the table (useful for joins, etc.)
 
+    batch_size = 8192 # default number of rows returned by iter_batches()
+
     def __init__(self, columns, nb_rows, names):
         self.columns = len(columns)
         self.rows = nb_rows
@@ -44,6 +47,26 @@ class TableObject(object):
         else:
             return self._columns[i]
 
+    def iter_batches(self, columns=None, numeric=False, batch_size=None):
+        """Iterates on the rows of the table, a batch at a time.
+
+        Each batch is a list with one entry per requested column (all of them
+        if `columns` is None), holding the values of that column for up to
+        `batch_size` consecutive rows, in the same format get_column() would
+        return them.
+
+        This default implementation slices the full columns; tables that can
+        produce their rows incrementally should override it, so that
+        operations consuming the batches run in bounded memory.
+        """
+        if columns is None:
+            columns = xrange(self.columns)
+        if batch_size is None:
+            batch_size = self.batch_size
+        cols = [self.get_column(col, numeric) for col in columns]
+        for start in xrange(0, self.rows, batch_size):
+            yield [col[start:start + batch_size] for col in cols]
+
     def get_column_by_name(self, name, numeric=False):
         """Gets a column from its name.
 
@@ -85,6 +108,20 @@ class TableObject(object):
         return cls(columns, count, keys)
 
 
+def concatenate_batches(parts, numeric=False):
+    """Concatenates the pieces of a column returned by iter_batches().
+    """
+    if numeric and numpy is not None:
+        if not parts:
+            return numpy.array([], dtype=numpy.float32)
+        return numpy.concatenate(parts)
+    else:
+        result = []
+        for part in parts:
+            result.extend(part)
+        return result
+
+
 class Table(Module):
     _input_ports = [('name', '(org.vistrails.vistrails.basic:String)')]
     _output_ports = [('value', 'Table')]
@@ -295,17 +332,16 @@ class TableToFileMode(FileMode):
         document.append('<tr>\n')
         document.extend('  <th>%s</th>\n' % name for name in names)
         document.append('</tr>\n')
-        columns = [table.get_column(col) for col in xrange(table.columns)]
-        for row in xrange(table.rows):
-            document.append('<tr>\n')
-            for col in xrange(table.columns):
-                elem = columns[col][row]
-                if isinstance(elem, bytes):
-                    elem = elem.decode('utf-8', 'replace')
-                elif not isinstance(elem, unicode):
-                    elem = unicode(elem)
-                document.append('  <td>%s</td>\n' % elem)
-            document.append('</tr>\n')
+        for batch in table.iter_batches():
+            for row in izip(*batch):
+                document.append('<tr>\n')
+                for elem in row:
+                    if isinstance(elem, bytes):
+                        elem = elem.decode('utf-8', 'replace')
+                    elif not isinstance(elem, unicode):
+                        elem = unicode(elem)
+                    document.append('  <td>%s</td>\n' % elem)
+                document.append('</tr>\n')
         document.append('    </table>\n  </body>\n</html>\n')
 
         return ''.join(document)
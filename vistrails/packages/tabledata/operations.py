@@ -2,11 +2,14 @@ try:
     import numpy
 except ImportError: # pragma: no cover
     numpy = None
+from bisect import bisect_left
+from itertools import imap, izip
 import re
 
 from vistrails.core.modules.vistrails_module import ModuleError
 
-from .common import TableObject, Table, choose_column, choose_columns
+from .common import TableObject, Table, choose_column, choose_columns, \
+    concatenate_batches
 
 # FIXME use pandas?
 
@@ -20,20 +23,149 @@ def utf8(obj):
         return bytes(obj)
 
 
+JOIN_TYPES = ['inner', 'left', 'outer']
+
+# join_rows() uses a sort-merge join if both sides have at least this many
+# rows, and the larger one isn't more than this many times bigger
+SORT_MERGE_MIN_ROWS = 1000000
+SORT_MERGE_MAX_RATIO = 8
+
+
+def hash_join(left_keys, right_keys, how='inner'):
+    """Joins two lists of keys using a dictionary of the right keys.
+
+    Returns two lists of row indexes of the same length, the i-th row of the
+    result pairing left row left_rows[i] with right row right_rows[i]; -1
+    indicates a missing row (for the 'left' and 'outer' modes).
+
+    The result is ordered by left row, then by right row; with 'outer', the
+    right rows that matched nothing come last.
+    """
+    # Maps each key to its first right row, and each right row to the next
+    # one with the same key; this avoids creating a list per key
+    right_map = {}
+    next_rows = [-1] * len(right_keys)
+    for j in xrange(len(right_keys) - 1, -1, -1):
+        key = right_keys[j]
+        next_rows[j] = right_map.get(key, -1)
+        right_map[key] = j
+
+    left_rows = []
+    right_rows = []
+    keep_left = how != 'inner'
+    for i, key in enumerate(left_keys):
+        j = right_map.get(key, -1)
+        if j >= 0:
+            while j >= 0:
+                left_rows.append(i)
+                right_rows.append(j)
+                j = next_rows[j]
+        elif keep_left:
+            left_rows.append(i)
+            right_rows.append(-1)
+
+    if how == 'outer':
+        matched = set(right_rows)
+        unmatched = [j for j in xrange(len(right_keys)) if j not in matched]
+        left_rows.extend([-1] * len(unmatched))
+        right_rows.extend(unmatched)
+
+    return left_rows, right_rows
+
+
+def sort_merge_join(left_keys, right_keys, how='inner'):
+    """Joins two lists of keys by sorting the right keys.
+
+    The left keys are located in the sorted right keys by binary search, and
+    every output row is computed with numpy array operations. Returns numpy
+    arrays of row indexes, in the same order and format as hash_join().
+    """
+    left_keys = numpy.asarray(left_keys)
+    right_keys = numpy.asarray(right_keys)
+    right_order = numpy.argsort(right_keys, kind='mergesort')
+    sorted_keys = right_keys[right_order]
+    lower = numpy.searchsorted(sorted_keys, left_keys, 'left')
+    counts = numpy.searchsorted(sorted_keys, left_keys, 'right') - lower
+
+    if how == 'inner':
+        repeats = counts
+    else:
+        # Unmatched left rows appear once, with no right row
+        repeats = numpy.maximum(counts, 1)
+    total = repeats.sum()
+    left_rows = numpy.repeat(numpy.arange(len(left_keys)), repeats)
+    # Position of each output row in the group of its left row
+    offsets = (numpy.arange(total) -
+               numpy.repeat(numpy.cumsum(repeats) - repeats, repeats))
+    positions = numpy.repeat(lower, repeats) + offsets
+    missing = numpy.repeat(counts == 0, repeats)
+    positions[missing] = 0
+    if len(right_order):
+        right_rows = right_order[positions]
+    else:
+        right_rows = numpy.zeros(total, dtype=numpy.intp)
+    right_rows[missing] = -1
+
+    if how == 'outer':
+        matched = numpy.zeros(len(right_keys), dtype=bool)
+        matched[right_rows[right_rows >= 0]] = True
+        unmatched = numpy.flatnonzero(~matched)
+        left_rows = numpy.concatenate([
+                left_rows, -numpy.ones(len(unmatched), dtype=left_rows.dtype)])
+        right_rows = numpy.concatenate([right_rows, unmatched])
+
+    return left_rows, right_rows
+
+
+def join_rows(left_keys, right_keys, how='inner'):
+    """Joins two lists of keys, picking a join algorithm from their sizes.
+
+    The hash join is the fastest, but its dictionary takes about a hundred
+    bytes per right row; when both sides are large, the sort-merge join only
+    needs a few compact numpy arrays, for a moderate slowdown. If one side is
+    much smaller, the hash join's Python loop is dominated by the other side
+    anyway.
+    """
+    if how not in JOIN_TYPES:
+        raise ValueError("Unknown join type %r" % how)
+    small, large = sorted([len(left_keys), len(right_keys)])
+    if (numpy is not None and small >= SORT_MERGE_MIN_ROWS and
+            large <= small * SORT_MERGE_MAX_RATIO):
+        return sort_merge_join(left_keys, right_keys, how)
+    else:
+        return hash_join(left_keys, right_keys, how)
+
+
+def take(column, rows, numeric=False):
+    """Gets the values of a column for some rows, or None/NaN where -1.
+    """
+    if numeric and numpy is not None:
+        rows = numpy.asarray(rows, dtype=numpy.intp)
+        column = numpy.asarray(column, dtype=numpy.float32)
+        if not len(column):
+            return numpy.nan * numpy.ones(len(rows), dtype=numpy.float32)
+        result = column[rows]
+        result[rows < 0] = numpy.nan
+        return result
+    else:
+        return [column[i] if i >= 0 else None for i in rows]
+
+
 class JoinedTables(TableObject):
     def __init__(self, left_t, right_t, left_key_col, right_key_col,
-                 case_sensitive=False, always_prefix=False):
+                 case_sensitive=False, always_prefix=False, how='inner'):
         self.left_t = left_t
         self.right_t = right_t
         self.left_key_col = left_key_col
         self.right_key_col = right_key_col
         self.case_sensitive = case_sensitive
         self.always_prefix = always_prefix
+        self.how = how
 
         self.build_column_names()
-        self.compute_row_map()
+        self.compute_rows()
         self.column_cache = {}
-        self.rows = len(self.row_map)
+        self.rows = len(self.left_rows)
 
     def build_column_names(self):
         left_name = self.left_t.name
@@ -67,46 +199,89 @@ class JoinedTables(TableObject):
         if (index, numeric) in self.column_cache:
             return self.column_cache[(index, numeric)]
 
-        result = []
         if index < self.left_t.columns:
-            column = self.left_t.get_column(index, numeric)
-            for i in xrange(self.left_t.rows):
-                if i in self.row_map:
-                    result.append(column[i])
+            result = take(self.left_t.get_column(index, numeric),
+                          self.left_rows, numeric)
         else:
-            column = self.right_t.get_column(index - self.left_t.columns,
-                                             numeric)
-            for i in xrange(self.left_t.rows):
-                if i in self.row_map:
-                    j = self.row_map[i]
-                    result.append(column[j])
-
-        if numeric and numpy is not None:
-            result = numpy.array(result, dtype=numpy.float32)
+            result = take(self.right_t.get_column(index - self.left_t.columns,
+                                                  numeric),
+                          self.right_rows, numeric)
+
         self.column_cache[(index, numeric)] = result
         return result
 
-    def compute_row_map(self):
-        def build_key_dict(table, key_col):
+    def iter_batches(self, columns=None, numeric=False, batch_size=None):
+        """Iterates on the joined rows, reading the left table in batches.
+
+        Values from the right table are looked up with get_column().
+        """
+        if columns is None:
+            columns = range(self.columns)
+        if batch_size is None:
+            batch_size = self.left_t.batch_size
+        left_count = self.left_t.columns
+        left_columns = [c for c in columns if c < left_count]
+        if left_columns:
+            batches = self.left_t.iter_batches(left_columns, numeric,
+                                               batch_size)
+        else:
+            # We still need to read the left table to know the row numbers
+            batches = self.left_t.iter_batches([self.left_key_col], False,
+                                               batch_size)
+        right_columns = dict(
+                (c, self.right_t.get_column(c - left_count, numeric))
+                for c in columns if c >= left_count)
+
+        left_rows, right_rows = self.left_rows, self.right_rows
+        first_row = 0
+        pos = 0
+        for batch in batches:
+            end_row = first_row + len(batch[0])
+            # Output rows are sorted by left row, so those coming from this
+            # batch are contiguous
+            end = bisect_left(left_rows, end_row, pos, self.left_matched)
+            if end > pos:
+                rows = left_rows[pos:end]
+                if numpy is not None and isinstance(rows, numpy.ndarray):
+                    rows = rows - first_row
+                else:
+                    rows = [i - first_row for i in rows]
+                result = []
+                left_batch = iter(batch)
+                for c in columns:
+                    if c < left_count:
+                        result.append(take(next(left_batch), rows, numeric))
+                    else:
+                        result.append(take(right_columns[c],
+                                           right_rows[pos:end], numeric))
+                yield result
+            pos = end
+            first_row = end_row
+
+        # Right rows that matched nothing, for outer joins
+        for pos in xrange(pos, len(left_rows), batch_size):
+            rows = right_rows[pos:pos + batch_size]
+            no_rows = [-1] * len(rows)
+            yield [take(right_columns[c], rows, numeric) if c >= left_count
+                   else take([], no_rows, numeric)
+                   for c in columns]
+
+    def compute_rows(self):
+        def get_keys(table, key_col):
             column = table.get_column(key_col)
             if self.case_sensitive:
-                key_dict = dict((utf8(val).strip(), i)
-                                for i, val in enumerate(column))
+                return [utf8(val).strip() for val in column]
             else:
-                key_dict = dict((utf8(val).strip().upper(), i)
-                                for i, val in enumerate(column))
-            return key_dict
-
-        right_keys = build_key_dict(self.right_t, self.right_key_col)
+                return [utf8(val).strip().upper() for val in column]
 
-        self.row_map = {}
-        for left_row_idx, key in enumerate(
-                self.left_t.get_column(self.left_key_col)):
-            key = utf8(key).strip()
-            if not self.case_sensitive:
-                key = key.upper()
-            if key in right_keys:
-                self.row_map[left_row_idx] = right_keys[key]
+        self.left_rows, self.right_rows = join_rows(
+                get_keys(self.left_t, self.left_key_col),
+                get_keys(self.right_t, self.right_key_col),
+                self.how)
+        # Rows with a left row come first, the rest is only right rows
+        self.left_matched = len(self.left_rows)
+        while self.left_matched and self.left_rows[self.left_matched - 1] < 0:
+            self.left_matched -= 1
 
 
 class JoinTables(Table):
@@ -116,7 +291,12 @@ class JoinTables(Table):
     match the values in the two selected columns (one from each table). If a
     row from one of the table has a value for the selected field that doesn't
     exist in the other table, that row will not appear in the result
-    (INNER JOIN semantics).
+    (INNER JOIN semantics). Rows that match several rows of the other table
+    appear once per match.
+
+    Set 'join_type' to 'left' to also keep the left rows that have no match,
+    or to 'outer' to keep the unmatched rows of both tables; the missing
+    values are None (or NaN in numeric columns).
     """
     _input_ports = [('left_table', 'Table'),
                     ('right_table', 'Table'),
@@ -127,7 +307,11 @@ class JoinTables(Table):
                     ('case_sensitive', 'basic:Boolean',
                      {"optional": True, "defaults": str(["False"])}),
                     ('always_prefix', 'basic:Boolean',
-                     {"optional": True, "defaults": str(["False"])})]
+                     {"optional": True, "defaults": str(["False"])}),
+                    ('join_type', 'basic:String',
+                     {"optional": True, "defaults": str(["inner"]),
+                      "entry_types": "['enum']",
+                      "values": str([JOIN_TYPES])})]
     _output_ports = [('value', Table)]
 
     def compute(self):
@@ -135,6 +319,9 @@ class JoinTables(Table):
         right_t = self.get_input('right_table')
         case_sensitive = self.get_input('case_sensitive')
         always_prefix = self.get_input('always_prefix')
+        join_type = self.get_input('join_type')
+        if join_type not in JOIN_TYPES:
+            raise ModuleError(self, "Unknown join type %r" % join_type)
 
         def get_column_idx(table, prefix):
             col_name_port = "%s_column_name" % prefix
@@ -154,7 +341,7 @@ class JoinTables(Table):
         right_key_col = get_column_idx(right_t, "right")
 
         table = JoinedTables(left_t, right_t, left_key_col, right_key_col,
-                             case_sensitive, always_prefix)
+                             case_sensitive, always_prefix, join_type)
         self.set_output('value', table)
 
 
@@ -169,6 +356,12 @@ class ProjectedTable(TableObject):
         mapped_idx = self.col_map[index]
         return self.table.get_column(mapped_idx, numeric)
 
+    def iter_batches(self, columns=None, numeric=False, batch_size=None):
+        if columns is None:
+            columns = xrange(self.columns)
+        return self.table.iter_batches([self.col_map[c] for c in columns],
+                                       numeric, batch_size)
+
     @property
     def rows(self):
         return self.table.rows
@@ -220,6 +413,78 @@ class ProjectTable(Table):
         self.set_output("value", projected_table)
 
 
+class SelectedTable(TableObject):
+    """The rows of a table for which a condition on a column holds.
+
+    The rows are filtered as batches are read from the original table; only
+    the number of matching rows is computed upfront. If `array_condition` is
+    given, it is used instead of `condition` on numpy batches, and should
+    return a boolean mask.
+    """
+    def __init__(self, table, col, condition, numeric, array_condition=None):
+        self.table = table
+        self.col = col
+        self.condition = condition
+        self.array_condition = array_condition
+        self.numeric = numeric
+        self.columns = table.columns
+        self.names = table.names
+        self.column_cache = {}
+
+        self.rows = 0
+        for batch in table.iter_batches([col], numeric):
+            self.rows += len(self.matching_rows(batch[0]))
+
+    def matching_rows(self, values):
+        if (self.array_condition is not None and
+                isinstance(values, numpy.ndarray)):
+            return numpy.flatnonzero(self.array_condition(values))
+        condition = self.condition
+        return [i for i, value in enumerate(values) if condition(value)]
+
+    def get_column(self, index, numeric=False):
+        if (index, numeric) in self.column_cache:
+            return self.column_cache[(index, numeric)]
+
+        result = concatenate_batches(
+                [batch[0] for batch in self.iter_batches([index], numeric)],
+                numeric)
+        self.column_cache[(index, numeric)] = result
+        return result
+
+    def iter_batches(self, columns=None, numeric=False, batch_size=None):
+        if columns is None:
+            columns = range(self.columns)
+        if batch_size is None:
+            batch_size = self.table.batch_size
+        if numeric == self.numeric:
+            batches = ((batch[0], batch[1:])
+                       for batch in self.table.iter_batches(
+                               [self.col] + list(columns),
+                               numeric, batch_size))
+        else:
+            # The condition and the requested columns have different types,
+            # read them side by side
+            batches = izip(
+                    (batch[0] for batch in self.table.iter_batches(
+                            [self.col], self.numeric, batch_size)),
+                    self.table.iter_batches(columns, numeric, batch_size))
+        for values, batch in batches:
+            matched = self.matching_rows(values)
+            if not len(matched):
+                continue
+            result = []
+            for part in batch:
+                if numpy is not None and isinstance(part, numpy.ndarray):
+                    part = part[matched]
+                else:
+                    part = [part[i] for i in matched]
+                    if numeric and numpy is not None:
+                        part = numpy.array(part, dtype=numpy.float32)
+                result.append(part)
+            yield result
+
+
 class SelectFromTable(Table):
     """Builds a table from the rows of another table.
 
@@ -259,6 +524,26 @@ class SelectFromTable(Table):
         else:
             raise ValueError("Invalid comparison operator %r" % comparer)
 
+    array_comparers = {'==': 'equal', '!=': 'not_equal',
+                       '<': 'less', '>': 'greater',
+                       '<=': 'less_equal', '>=': 'greater_equal'}
+
+    @staticmethod
+    def make_array_condition(comparand, comparer):
+        """Builds a condition evaluated on a whole numpy array at once.
+
+        Returns None if the comparison cannot be vectorized (text and regex
+        comparisons), in which case make_condition() is used for each value.
+        """
+        if numpy is None or not isinstance(comparand, float):
+            return None
+        try:
+            op = getattr(numpy, SelectFromTable.array_comparers[comparer])
+        except KeyError:
+            return None
+        # Compare in double precision, like float(v) does for each value
+        return lambda values: op(values.astype(numpy.float64), comparand)
+
     def compute(self):
         table = self.get_input('table')
 
@@ -284,19 +569,15 @@ class SelectFromTable(Table):
 
         condition = self.make_condition(comparand, comparer)
         numeric = isinstance(comparand, float)
-        column = table.get_column(idx, numeric)
-        matched_rows = [i
-                        for i, col_val in enumerate(column)
-                        if condition(col_val)]
-        columns = []
-        for col in xrange(table.columns):
-            column = table.get_column(col)
-            columns.append([column[row] for row in matched_rows])
-        selected_table = TableObject(columns, len(matched_rows), table.names)
+        selected_table = SelectedTable(
+                table, idx, condition, numeric,
+                self.make_array_condition(comparand, comparer))
         self.set_output('value', selected_table)
 
 
 class AggregatedTable(TableObject):
+    ops = ['sum', 'count', 'average', 'min', 'max']
+
     def __init__(self, table, op, col, group_col):
         self.table = table
         self.op = op
@@ -306,42 +587,135 @@ class AggregatedTable(TableObject):
         self.build_map()
 
     def build_map(self):
+        """Groups the rows, aggregating while reading the table in batches.
+
+        Only one entry per group is kept in memory: the index of the first row
+        of the group, the number of rows and the running aggregate.
+        """
+        op = self.op
+        if op in self.ops and op != 'count':
+            batches = izip(
+                    (b[0] for b in self.table.iter_batches([self.group_col])),
+                    (b[0] for b in self.table.iter_batches([self.col], True)))
+        else:
+            batches = ((b[0], None)
+                       for b in self.table.iter_batches([self.group_col]))
+
+        if numpy is not None:
+            aggregate_batch = self.aggregate_array
+        else:
+            aggregate_batch = self.aggregate_list
+
         agg_map = {}
-        for i, val in enumerate(self.table.get_column(self.group_col)):
-            if val in agg_map:
-                agg_map[val].append(i)
-            else:
-                agg_map[val] = [i]
-        self.agg_rows = [(min(rows), rows) for rows in agg_map.itervalues()]
-        self.agg_rows.sort()
+        row = 0
+        for keys, values in batches:
+            for key, first, count, value in aggregate_batch(keys, values):
+                try:
+                    group = agg_map[key]
+                except KeyError:
+                    agg_map[key] = [row + first, count, value]
+                else:
+                    group[1] += count
+                    if op == 'sum' or op == 'average':
+                        group[2] += value
+                    elif op == 'min':
+                        if value < group[2]:
+                            group[2] = value
+                    elif op == 'max':
+                        if value > group[2]:
+                            group[2] = value
+            row += len(keys)
+
+        self.agg_rows = sorted(agg_map.itervalues())
         self.rows = len(self.agg_rows)
         self.columns = 2
         if self.table.names is not None:
             self.names = [self.table.names[self.group_col],
                           self.table.names[self.col]]
 
+    def aggregate_list(self, keys, values):
+        """Aggregates a batch value by value.
+
+        Returns a list of (key, first index, row count, aggregate) tuples.
+        """
+        op = self.op
+        groups = {}
+        for i, key in enumerate(keys):
+            try:
+                group = groups[key]
+            except KeyError:
+                if op == 'sum' or op == 'average':
+                    value = 0 + values[i]
+                elif values is not None:
+                    value = values[i]
+                else:
+                    value = None
+                groups[key] = [key, i, 1, value]
+            else:
+                group[2] += 1
+                if op == 'sum' or op == 'average':
+                    group[3] += values[i]
+                elif op == 'min':
+                    if values[i] < group[3]:
+                        group[3] = values[i]
+                elif op == 'max':
+                    if values[i] > group[3]:
+                        group[3] = values[i]
+        return groups.itervalues()
+
+    def aggregate_array(self, keys, values):
+        """Aggregates a batch using numpy.
+
+        The keys are grouped by numpy.unique(), then the values are summed with
+        numpy.bincount() or reduced over the sorted groups with reduceat().
+        """
+        if not isinstance(keys, numpy.ndarray):
+            # Sorting typed arrays is much faster, but mixed types have to be
+            # kept as objects so that e.g. 1 and '1' remain different keys
+            types = set(imap(type, keys))
+            if len(types) == 1 and types.pop() in (bytes, unicode, int, float):
+                keys = numpy.array(keys)
+            else:
+                keys = numpy.array(keys, dtype=object)
+        uniques, first, inverse = numpy.unique(keys, return_index=True,
+                                               return_inverse=True)
+        counts = numpy.bincount(inverse)
+        op = self.op
+        if op == 'sum' or op == 'average':
+            aggregates = numpy.bincount(inverse, weights=values,
+                                        minlength=len(uniques)).tolist()
+        elif op == 'min' or op == 'max':
+            order = numpy.argsort(inverse, kind='mergesort')
+            starts = numpy.cumsum(counts) - counts
+            ufunc = numpy.minimum if op == 'min' else numpy.maximum
+            aggregates = ufunc.reduceat(numpy.asarray(values)[order],
+                                        starts).tolist()
+        else:
+            aggregates = [None] * len(uniques)
+        return izip(uniques.tolist(), first.tolist(), counts.tolist(),
+                    aggregates)
+
     def get_column(self, index, numeric=False):
-        def average(value_iter):
-            # value_iter can only be used once
-            sum = 0
-            count = 0
-            for count, v in enumerate(value_iter):
-                sum += v
-            return sum / (count+1)
-        op_map = {'sum': sum,
-                  'average': average,
-                  'min': min,
-                  'max': max}
         if index == 0:
-            col = self.table.get_column(self.group_col, numeric)
-            return [col[x[0]] for x in self.agg_rows]
+            # agg_rows is sorted by first row
+            result = []
+            wanted = iter(x[0] for x in self.agg_rows)
+            next_row = next(wanted, None)
+            row = 0
+            for batch in self.table.iter_batches([self.group_col], numeric):
+                keys = batch[0]
+                while next_row is not None and next_row < row + len(keys):
+                    result.append(keys[next_row - row])
+                    next_row = next(wanted, None)
+                row += len(keys)
+            return result
         else:
             if self.op == 'count':
-                return [len(x[1]) for x in self.agg_rows]
-            elif self.op in op_map:
-                col = self.table.get_column(self.col, True)
-                return [op_map[self.op](col[idx] for idx in x[1])
-                        for x in self.agg_rows]
+                return [x[1] for x in self.agg_rows]
+            elif self.op == 'average':
+                return [x[2] / x[1] for x in self.agg_rows]
+            elif self.op in self.ops:
+                return [x[2] for x in self.agg_rows]
             else:
                 raise ValueError('Unknown operation: "%s"' % self.op)
 
@@ -484,6 +858,63 @@ class TestJoin(unittest.TestCase):
         self.assertEqual(table.get_column(1, False), ['one', '2', 'five'])
 
 
+class TestJoinEngine(unittest.TestCase):
+    def test_engines(self):
+        """Checks that the hash and sort-merge joins agree.
+        """
+        import random
+        rng = random.Random(2)
+        left = [str(rng.randint(0, 400)) for i in xrange(1500)]
+        right = [str(rng.randint(200, 600)) for i in xrange(1200)]
+        for how in JOIN_TYPES:
+            expected = hash_join(left, right, how)
+            result = sort_merge_join(left, right, how)
+            self.assertEqual(list(result[0]), expected[0])
+            self.assertEqual(list(result[1]), expected[1])
+        self.assertIsInstance(join_rows(left, right)[0], list)
+        global SORT_MERGE_MIN_ROWS
+        old_min_rows = SORT_MERGE_MIN_ROWS
+        SORT_MERGE_MIN_ROWS = 1000
+        try:
+            self.assertIsInstance(join_rows(left, right)[0], numpy.ndarray)
+            self.assertIsInstance(join_rows(left[:100], right)[0], list)
+        finally:
+            SORT_MERGE_MIN_ROWS = old_min_rows
+
+    def test_modes(self):
+        """Joins with duplicate keys in all modes.
+        """
+        left, right = ['a', 'b', 'c', 'b'], ['b', 'd', 'b', 'a']
+        for join in (hash_join, sort_merge_join):
+            rows = join(left, right, 'inner')
+            self.assertEqual((list(rows[0]), list(rows[1])),
+                             ([0, 1, 1, 3, 3], [3, 0, 2, 0, 2]))
+            rows = join(left, right, 'left')
+            self.assertEqual((list(rows[0]), list(rows[1])),
+                             ([0, 1, 1, 2, 3, 3], [3, 0, 2, -1, 0, 2]))
+            rows = join(left, right, 'outer')
+            self.assertEqual((list(rows[0]), list(rows[1])),
+                             ([0, 1, 1, 2, 3, 3, -1], [3, 0, 2, -1, 0, 2, 1]))
+
+    def test_outer_table(self):
+        """Reads an outer join, with missing values.
+        """
+        left = TableObject([['a', 'b', 'c'], ['1', '2', '3']], 3,
+                           ['key', 'x'])
+        right = TableObject([['d', 'b'], ['4', '5']], 2, ['key', 'y'])
+        table = JoinedTables(left, right, 0, 0, how='outer')
+        self.assertEqual(table.rows, 4)
+        self.assertEqual(table.get_column(0), ['a', 'b', 'c', None])
+        self.assertEqual(table.get_column(2), [None, 'b', None, 'd'])
+        y = table.get_column(3, True)
+        self.assertTrue(numpy.isnan(y[0]))
+        self.assertEqual(list(y[[1, 3]]), [5.0, 4.0])
+        batches = list(table.iter_batches([1, 3], batch_size=2))
+        self.assertEqual(batches, [[['1', '2'], [None, '5']],
+                                   [['3'], [None]],
+                                   [[None], ['4']]])
+
+
 class TestProjection(unittest.TestCase):
     def do_project(self, project_functions, error=None):
         with intercept_result(ProjectTable, 'value') as results:
@@ -645,6 +1076,103 @@ class TestSelect(unittest.TestCase):
             ])
         self.assertEqual(table.get_column(0, False), ['22', '43', '-7'])
 
+class TestBatches(unittest.TestCase):
+    def make_table(self):
+        table = TableObject([['a', 'b', 'a', 'c', 'b', 'a'],
+                             ['1', '4', '2', '8', '16', '32']],
+                            6, ['key', 'value'])
+        table.batch_size = 4
+        return table
+
+    def test_select(self):
+        """Filters a table a batch at a time.
+        """
+        table = SelectedTable(self.make_table(), 1,
+                              SelectFromTable.make_condition(3.0, '>'), True)
+        self.assertEqual(table.rows, 4)
+        self.assertEqual(list(table.iter_batches(batch_size=2)),
+                         [[['b'], ['4']], [['c'], ['8']],
+                          [['b', 'a'], ['16', '32']]])
+        self.assertEqual(list(table.get_column(1, True)), [4, 8, 16, 32])
+        self.assertEqual(table.get_column(0), ['b', 'c', 'b', 'a'])
+
+    def test_project(self):
+        """Reads batches through a projection.
+        """
+        table = ProjectedTable(self.make_table(), [1, 1], ['v1', 'v2'])
+        batches = list(table.iter_batches(numeric=True, batch_size=4))
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(list(batches[1][1]), [16, 32])
+
+    def test_join(self):
+        """Joins a table that is read in batches.
+        """
+        right = TableObject([['c', 'a'], ['x', 'y']], 2, ['key', 'other'])
+        table = JoinedTables(self.make_table(), right, 0, 0)
+        self.assertEqual(table.rows, 4)
+        batches = list(table.iter_batches([1, 3], batch_size=4))
+        self.assertEqual(batches, [[['1', '2', '8'], ['y', 'y', 'x']],
+                                   [['32'], ['y']]])
+        batches = list(table.iter_batches([3], batch_size=4))
+        self.assertEqual(batches, [[['y', 'y', 'x']], [['y']]])
+
+    def test_aggregate(self):
+        """Aggregates over several batches.
+        """
+        table = AggregatedTable(self.make_table(), 'sum', 1, 0)
+        self.assertEqual(table.get_column(0), ['a', 'b', 'c'])
+        self.assertEqual(table.get_column(1), [35, 20, 8])
+        table = AggregatedTable(self.make_table(), 'count', 1, 0)
+        self.assertEqual(table.get_column(1), [3, 2, 1])
+        table = AggregatedTable(self.make_table(), 'max', 1, 0)
+        self.assertEqual(table.get_column(1), [32, 16, 8])
+
+
+class TestVectorized(unittest.TestCase):
+    def make_table(self):
+        import random
+        rng = random.Random(4)
+        keys = [rng.choice(['a', 'b', 'c', 'd', 7]) for i in xrange(1000)]
+        values = [str(rng.randint(-50, 50) / 4.0) for i in xrange(1000)]
+        table = TableObject([keys, values], 1000, ['key', 'value'])
+        table.batch_size = 300
+        return table
+
+    def test_select(self):
+        """Compares the numpy selection with the per-value conditions.
+        """
+        table = self.make_table()
+        for comparer in SelectFromTable.array_comparers:
+            condition = SelectFromTable.make_condition(2.5, comparer)
+            array_condition = SelectFromTable.make_array_condition(
+                    2.5, comparer)
+            self.assertIsNotNone(array_condition)
+            selected = SelectedTable(table, 1, condition, True,
+                                     array_condition)
+            expected = SelectedTable(table, 1, condition, True)
+            self.assertEqual(selected.rows, expected.rows)
+            self.assertEqual(selected.get_column(0), expected.get_column(0))
+            self.assertEqual(list(selected.get_column(1, True)),
+                             list(expected.get_column(1, True)))
+        self.assertIsNone(SelectFromTable.make_array_condition('a', '=~'))
+        self.assertIsNone(SelectFromTable.make_array_condition('a', '=='))
+
+    def test_aggregate(self):
+        """Compares the numpy aggregation with the per-value one.
+        """
+        table = self.make_table()
+        for op in AggregatedTable.ops:
+            aggregated = AggregatedTable(table, op, 1, 0)
+            expected = AggregatedTable(table, op, 1, 0)
+            expected.aggregate_array = expected.aggregate_list
+            expected.build_map()
+            self.assertEqual(aggregated.get_column(0),
+                             expected.get_column(0))
+            for v1, v2 in izip(aggregated.get_column(1),
+                               expected.get_column(1)):
+                self.assertAlmostEqual(v1, v2, places=3)
+
+
 class TestAggregate(unittest.TestCase):
     def do_aggregate(self, agg_functions):
         with intercept_result(AggregateColumn, 'value') as results:
@@ -1,10 +1,20 @@
 import csv
+import hashlib
+from itertools import imap, islice, izip
+import json
+import os
+import shutil
+import tempfile
 try:
     import numpy
 except ImportError: # pragma: no cover
     numpy = None
 
-from ..common import TableObject, Table, InternalModuleError
+from vistrails.core import debug
+from vistrails.core.system import current_dot_vistrails
+
+from ..common import TableObject, Table, InternalModuleError, \
+    concatenate_batches
 
 
 def count_lines(fp):
@@ -14,17 +24,62 @@ def count_lines(fp):
     return lines
 
 
-# FIXME : test coverage for CSVTable
+class MappedStrings(object):
+    """A column of strings from the cache, read from disk when sliced.
+
+    The values are stored end to end in a data file, and their boundaries in
+    a memory-mapped array of offsets.
+    """
+    def __init__(self, filename, offsets):
+        self.filename = filename
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, key):
+        start, stop, step = key.indices(len(self))
+        if step != 1:
+            raise ValueError("MappedStrings only supports contiguous slices")
+        if start >= stop:
+            return []
+        offsets = self.offsets[start:stop + 1].tolist()
+        with open(self.filename, 'rb') as fp:
+            fp.seek(offsets[0])
+            block = fp.read(offsets[-1] - offsets[0])
+        first = offsets[0]
+        return [block[offsets[i] - first:offsets[i + 1] - first]
+                for i in xrange(stop - start)]
+
+    def tolist(self):
+        return self[:]
+
+
 class CSVTable(TableObject):
+    """A table read from a CSV file.
+
+    The file is parsed in a single pass, a batch of rows at a time, the first
+    time a column is requested. Columns whose values can all be converted are
+    kept as float32 arrays, and only the others as lists of strings. The row
+    count is obtained by reading the records, without building the columns.
+
+    If `cache_dir` is set, the numeric columns are written there in batches
+    while parsing, along with the text columns, and are memory-mapped instead
+    of parsing the file again as long as its size and modification time don't
+    change.
+    """
     def __init__(self, csv_file, header_present, delimiter,
-                 skip_lines=0, dialect=None, use_sniffer=True):
+                 skip_lines=0, dialect=None, use_sniffer=True,
+                 cache_dir=None):
         self._rows = None
+        self._data = None
 
         self.header_present = header_present
         self.delimiter = delimiter
         self.filename = csv_file
         self.skip_lines = skip_lines
         self.dialect = dialect
+        self.cache_dir = cache_dir
 
         (self.columns, self.names, self.delimiter,
          self.header_present, self.dialect) = \
@@ -87,44 +142,338 @@ class CSVTable(TableObject):
 
         return column_count, column_names, delimiter, header_present, dialect
 
-    def get_column(self, index, numeric=False):
-        if (index, numeric) in self.column_cache:
-            return self.column_cache[(index, numeric)]
+    def _iter_records(self):
+        """Iterates on the records of the file, padded to the column count.
+        """
+        with open(self.filename, 'rb') as fp:
+            for i in xrange(self.skip_lines):
+                line = fp.readline()
+                if not line:
+                    raise InternalModuleError("skip_lines greater than "
+                                              "the number of lines in the "
+                                              "file")
+            if self.dialect is not None:
+                reader = csv.reader(fp, dialect=self.dialect)
+            else:
+                reader = csv.reader(fp, delimiter=self.delimiter)
+
+            nb_columns = self.columns
+            for row in reader:
+                if not row:
+                    continue
+                if len(row) < nb_columns:
+                    row += [''] * (nb_columns - len(row))
+                yield row
 
-        if numeric and numpy is not None:
-            result = numpy.loadtxt(
-                    self.filename,
-                    dtype=numpy.float32,
-                    delimiter=self.delimiter,
-                    skiprows=self.skip_lines,
-                    usecols=[index])
+    @staticmethod
+    def to_numeric(column):
+        """Converts a sequence of strings to floats, raising ValueError.
+        """
+        if numpy is not None:
+            return numpy.fromiter((float(e) for e in column),
+                                  dtype=numpy.float32,
+                                  count=len(column))
         else:
-            with open(self.filename, 'rb') as fp:
-                for i in xrange(self.skip_lines):
-                    line = fp.readline()
-                    if not line:
-                        raise InternalModuleError("skip_lines greater than "
-                                                  "the number of lines in the "
-                                                  "file")
-                if self.dialect is not None:
-                    reader = csv.reader(fp, dialect=self.dialect)
+            return [float(e) for e in column]
+
+    def parse(self, directory=None):
+        """Reads all the columns from the file in a single pass.
+
+        The records are read `batch_size` at a time; each column is converted
+        to float32 batch by batch, until a value fails to convert. Only the
+        columns that are not numeric are kept as lists of strings; their
+        values from the batches that were already converted are read back
+        afterwards, from the beginning of the file.
+
+        If `directory` is set, the numeric columns are appended to raw
+        'num%d.dat' files there instead of being kept in memory, and their
+        entries in the returned list are True.
+
+        Returns a list of columns of strings and a list of numeric columns,
+        exactly one of which is None for each column, and the row count.
+        """
+        nb_columns = self.columns
+        strings = [None] * nb_columns
+        numbers = [[] for i in xrange(nb_columns)]
+        text_from = {} # column -> rows converted before it turned out text
+        rows = 0
+        records = self._iter_records()
+        while True:
+            batch = list(islice(records, self.batch_size))
+            if not batch:
+                break
+            for col, column in enumerate(islice(izip(*batch), nb_columns)):
+                if strings[col] is not None:
+                    strings[col].extend(column)
+                    continue
+                try:
+                    number = self.to_numeric(column)
+                except ValueError:
+                    strings[col] = list(column)
+                    numbers[col] = None
+                    text_from[col] = rows
+                    if directory is not None and rows:
+                        os.remove(os.path.join(directory, 'num%d.dat' % col))
+                    continue
+                if directory is not None:
+                    with open(os.path.join(directory, 'num%d.dat' % col),
+                              'ab') as fp:
+                        number.tofile(fp)
                 else:
-                    reader = csv.reader(fp, delimiter=self.delimiter)
+                    numbers[col].append(number)
+            rows += len(batch)
+            del batch
+
+        if text_from:
+            self._read_prefixes(strings, text_from)
+        for col, parts in enumerate(numbers):
+            if parts is not None:
+                if directory is not None:
+                    numbers[col] = True
+                else:
+                    numbers[col] = concatenate_batches(parts, True)
+        return strings, numbers, rows
+
+    def _read_prefixes(self, strings, text_from):
+        """Reads the first strings of columns that were converted at first.
 
-                result = [row[index] for row in reader]
+        `text_from` maps these columns to the number of rows that were read
+        before they turned out not to be numeric.
+        """
+        prefixes = dict((col, []) for col, start in text_from.iteritems()
+                        if start)
+        if not prefixes:
+            return
+        end = max(text_from.itervalues())
+        for row_nb, row in enumerate(islice(self._iter_records(), end)):
+            for col, prefix in prefixes.iteritems():
+                if row_nb < text_from[col]:
+                    prefix.append(row[col])
+        for col, prefix in prefixes.iteritems():
+            prefix.extend(strings[col])
+            strings[col] = prefix
+
+    def iter_batches(self, columns=None, numeric=False, batch_size=None):
+        """Iterates on batches of rows, reading the file incrementally.
+
+        If the requested columns have already been loaded or are in the
+        cache, they are sliced instead.
+        """
+        self._read_cached()
+        if columns is None:
+            columns = range(self.columns)
+        if batch_size is None:
+            batch_size = self.batch_size
+        if self._data is not None and (
+                numeric or
+                all(self._data[0][col] is not None for col in columns)):
+            return self._slice_batches(columns, numeric, batch_size)
+        else:
+            return self._read_batches(columns, numeric, batch_size)
+
+    def _slice_batches(self, columns, numeric, batch_size):
+        strings, numbers = self._data
+        if numeric:
+            cols = [numbers[col] for col in columns]
+            for col, column in izip(columns, cols):
+                if column is None:
+                    raise ValueError("Column %d contains non-numeric values" %
+                                     col)
+        else:
+            cols = [strings[col] for col in columns]
+        for start in xrange(0, self._rows, batch_size):
+            batch = [column[start:start + batch_size] for column in cols]
+            if not numeric:
+                batch = [part if isinstance(part, list) else part.tolist()
+                         for part in batch]
+            yield batch
+
+    def _read_batches(self, columns, numeric, batch_size):
+        batch = [[] for col in columns]
+        appends = [(column.append, col) for column, col in izip(batch, columns)]
+        count = 0
+        for row in self._iter_records():
+            for append, col in appends:
+                append(row[col])
+            count += 1
+            if count == batch_size:
+                if numeric:
+                    batch = [self.to_numeric(column) for column in batch]
+                yield batch
+                batch = [[] for col in columns]
+                appends = [(column.append, col)
+                           for column, col in izip(batch, columns)]
+                count = 0
+        if count:
             if numeric:
-                result = [float(e) for e in result]
+                batch = [self.to_numeric(column) for column in batch]
+            yield batch
+
+    def _cache_location(self):
+        """Returns the cache directory and stamp for this table.
+
+        The directory depends on the file and on the parsing options, while
+        the stamp records the size and modification time of the file.
+        """
+        filename = os.path.abspath(self.filename)
+        if self.dialect is not None and not isinstance(self.dialect,
+                                                       basestring):
+            dialect = (self.dialect.delimiter, self.dialect.quotechar,
+                       self.dialect.doublequote, self.dialect.escapechar,
+                       self.dialect.skipinitialspace)
+        else:
+            dialect = self.dialect
+        key = repr((filename, self.delimiter, self.skip_lines, dialect,
+                    self.columns))
+        stat = os.stat(filename)
+        return (os.path.join(self.cache_dir, hashlib.sha1(key).hexdigest()),
+                [stat.st_size, stat.st_mtime])
+
+    @staticmethod
+    def _map_array(filename, dtype, count):
+        if count == 0:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.memmap(filename, dtype=dtype, mode='r', shape=(count,))
+
+    def read_cache(self, directory, stamp):
+        """Memory-maps the columns saved by write_cache().
+
+        Returns None if they are missing or out of date.
+        """
+        try:
+            with open(os.path.join(directory, 'meta.json'), 'rb') as fp:
+                meta = json.load(fp)
+            if meta['stamp'] != stamp:
+                return None
+            rows = meta['rows']
+            strings = []
+            numbers = []
+            for i, is_numeric in enumerate(meta['numeric']):
+                if is_numeric:
+                    strings.append(None)
+                    numbers.append(self._map_array(
+                            os.path.join(directory, 'num%d.dat' % i),
+                            numpy.float32, rows))
+                else:
+                    strings.append(MappedStrings(
+                            os.path.join(directory, 'str%d.dat' % i),
+                            self._map_array(
+                                    os.path.join(directory, 'off%d.dat' % i),
+                                    numpy.int64, rows + 1)))
+                    numbers.append(None)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        if len(strings) != self.columns:
+            return None
+        return strings, numbers, rows
+
+    def _write_strings(self, directory, col, column):
+        """Saves a text column as a data file and an array of offsets.
+        """
+        with open(os.path.join(directory, 'str%d.dat' % col), 'wb') as fp:
+            for start in xrange(0, len(column), self.batch_size):
+                fp.write(''.join(column[start:start + self.batch_size]))
+        offsets = numpy.zeros(len(column) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.fromiter(imap(len, column), dtype=numpy.int64,
+                                    count=len(column)),
+                     out=offsets[1:])
+        offsets.tofile(os.path.join(directory, 'off%d.dat' % col))
+
+    def write_cache(self, directory, stamp):
+        """Parses the file into the given cache directory.
+
+        Returns the memory-mapped columns, or None if they couldn't be saved.
+        """
+        temp_dir = tempfile.mkdtemp(prefix='csv_', dir=self.cache_dir)
+        try:
+            strings, numbers, rows = self.parse(temp_dir)
+            for col, column in enumerate(strings):
+                if column is not None:
+                    self._write_strings(temp_dir, col, column)
+            del strings
+            with open(os.path.join(temp_dir, 'meta.json'), 'wb') as fp:
+                json.dump({'stamp': stamp, 'rows': rows,
+                           'numeric': [n is not None for n in numbers]}, fp)
+            if os.path.exists(directory):
+                shutil.rmtree(directory)
+            os.rename(temp_dir, directory)
+        except (IOError, OSError), e:
+            debug.warning("Couldn't cache columns of %s" % self.filename, e)
+            return None
+        finally:
+            if os.path.exists(temp_dir):
+                shutil.rmtree(temp_dir, ignore_errors=True)
+        return self.read_cache(directory, stamp)
+
+    def _read_cached(self):
+        """Uses the cached columns if they are up to date, without parsing.
+        """
+        if (self._data is None and self.cache_dir is not None and
+                numpy is not None):
+            try:
+                data = self.read_cache(*self._cache_location())
+            except OSError:
+                data = None
+            if data is not None:
+                strings, numbers, self._rows = data
+                self._data = strings, numbers
+
+    def _load(self):
+        if self._data is not None:
+            return self._data
+        data = None
+        if self.cache_dir is not None and numpy is not None:
+            try:
+                if not os.path.isdir(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+                directory, stamp = self._cache_location()
+            except OSError, e:
+                debug.warning("Couldn't use column cache %s" % self.cache_dir,
+                              e)
+                self.cache_dir = None
+                return self._load()
+            data = self.read_cache(directory, stamp)
+            if data is None:
+                data = self.write_cache(directory, stamp)
+        if data is None:
+            data = self.parse()
+        strings, numbers, self._rows = data
+        self._data = strings, numbers
+        return self._data
+
+    def get_column(self, index, numeric=False):
+        if (index, numeric) in self.column_cache:
+            return self.column_cache[(index, numeric)]
+
+        strings, numbers = self._load()
+        if numeric:
+            result = numbers[index]
+            if result is None:
+                raise ValueError("Column %d contains non-numeric values" %
+                                 index)
+        else:
+            result = strings[index]
+            if result is None:
+                # Numeric columns are not kept as strings, read it back
+                result = []
+                for batch in self._read_batches([index], False,
+                                                self.batch_size):
+                    result.extend(batch[0])
+            elif not isinstance(result, list):
+                result = result.tolist()
 
         self.column_cache[(index, numeric)] = result
         return result
 
     @property
     def rows(self):
-        if self._rows is not None:
-            return self._rows
-        with open(self.filename, 'rb') as fp:
-            self._rows = count_lines(fp)
-        self._rows -= self.skip_lines
+        if self._rows is None:
+            self._read_cached()
+        if self._rows is None:
+            rows = 0
+            for row in self._iter_records():
+                rows += 1
+            self._rows = rows
         return self._rows
 
 
@@ -135,6 +484,10 @@ class CSVFile(Table):
     able to guess the actual format of the file in most cases, or you can use
     the 'delimiter', 'header_present' and 'skip_lines' ports to force how the
     file will be read.
+
+    The file is parsed in a single pass. If 'cache_columns' is set, the parsed
+    columns are also saved in your .vistrails directory, from which they are
+    memory-mapped until the file changes.
     """
     _input_ports = [
             ('file', '(org.vistrails.vistrails.basic:File)'),
@@ -147,7 +500,9 @@ class CSVFile(Table):
             ('skip_lines', '(org.vistrails.vistrails.basic:Integer)',
              {'optional': True, 'defaults': "['0']"}),
             ('dialect', '(org.vistrails.vistrails.basic:String)',
-             {'optional': True})]
+             {'optional': True}),
+            ('cache_columns', '(org.vistrails.vistrails.basic:Boolean)',
+             {'optional': True, 'defaults': "['False']"})]
     _output_ports = [
             ('column_count', '(org.vistrails.vistrails.basic:Integer)'),
             ('column_names', '(org.vistrails.vistrails.basic:List)'),
@@ -160,10 +515,15 @@ class CSVFile(Table):
         skip_lines = self.get_input('skip_lines')
         dialect = self.force_get_input('dialect', None)
         sniff_header = self.get_input('sniff_header')
+        if self.get_input('cache_columns'):
+            cache_dir = os.path.join(current_dot_vistrails(),
+                                     'tabledata_cache')
+        else:
+            cache_dir = None
 
         try:
             table = CSVTable(csv_file, header_present, delimiter, skip_lines,
-                             dialect, sniff_header)
+                             dialect, sniff_header, cache_dir)
         except InternalModuleError, e:
             e.raise_module_error(self)
 
@@ -278,6 +638,129 @@ class CSVTestCase(unittest.TestCase):
                          ['col moutarde', '4', 'not a number', '7'])
 
 
+class CSVTableTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import os
+        cls._test_dir = os.path.join(
+                os.path.dirname(__file__),
+                os.pardir,
+                'test_files')
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp(prefix='vt_csv_')
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def test_single_pass(self):
+        """Checks that all the columns come from a single parse.
+        """
+        table = CSVTable(self._test_dir + '/test.csv', True, None)
+        parses = []
+        parse = table.parse
+        def counting_parse(*args):
+            parses.append(1)
+            return parse(*args)
+        table.parse = counting_parse
+        self.assertEqual(table.rows, 3)
+        self.assertEqual(parses, [])
+        self.assertEqual(list(table.get_column(0, True)), [-1.0, 2.0, 6.0])
+        self.assertEqual(table.get_column(1), ['2', '3', '14.5'])
+        self.assertEqual(table.get_column(2),
+                         ['4', 'not a number', '7'])
+        self.assertRaises(ValueError, table.get_column, 2, True)
+        self.assertEqual(len(parses), 1)
+
+    def test_batches(self):
+        """Reads the file in batches without loading whole columns.
+        """
+        table = CSVTable(self._test_dir + '/test.csv', True, None)
+        def failing_parse():
+            self.fail("Whole file was parsed")
+        table.parse = failing_parse
+        self.assertEqual(list(table.iter_batches([2, 0], batch_size=2)),
+                         [[['4', 'not a number'], ['-1', '2']],
+                          [['7'], ['6']]])
+        batches = list(table.iter_batches([1], True, batch_size=2))
+        self.assertEqual([list(b[0]) for b in batches], [[2.0, 3.0], [14.5]])
+        self.assertRaises(ValueError, list, table.iter_batches([2], True))
+
+    def test_typed_columns(self):
+        """Keeps strings only for the columns that are not numeric.
+        """
+        filename = os.path.join(self._temp_dir, 'mixed.csv')
+        with open(filename, 'wb') as fp:
+            fp.write('a,b,c\n1,x,5\n2,y,6\n3,z,NA\n4,w,8\n5,v,9\n')
+        table = CSVTable(filename, True, ',', use_sniffer=False)
+        table.batch_size = 2
+        strings, numbers = table._load()
+        self.assertEqual(strings[0], None)
+        self.assertEqual(list(numbers[0]), [1.0, 2.0, 3.0, 4.0, 5.0])
+        self.assertEqual(strings[1], ['x', 'y', 'z', 'w', 'v'])
+        self.assertEqual(numbers[1], None)
+        # Column 'c' was converted for the first batch
+        self.assertEqual(strings[2], ['5', '6', 'NA', '8', '9'])
+        self.assertEqual(numbers[2], None)
+        self.assertEqual(table.get_column(0), ['1', '2', '3', '4', '5'])
+        self.assertEqual(list(table.iter_batches([0, 2], batch_size=3)),
+                         [[['1', '2', '3'], ['5', '6', 'NA']],
+                          [['4', '5'], ['8', '9']]])
+
+    def test_ragged(self):
+        """Reads a file with short rows and blank lines.
+        """
+        filename = os.path.join(self._temp_dir, 'ragged.csv')
+        with open(filename, 'wb') as fp:
+            fp.write('a,b,c\n1,2,3\n\n4,5\n')
+        table = CSVTable(filename, True, ',', use_sniffer=False)
+        self.assertEqual(table.rows, 2)
+        self.assertEqual(table.get_column(2), ['3', ''])
+        self.assertEqual(list(table.get_column(1, True)), [2.0, 5.0])
+
+    @unittest.skipIf(numpy is None, "numpy not available")
+    def test_cache(self):
+        """Reads the columns back from the memory-mapped cache.
+        """
+        filename = os.path.join(self._temp_dir, 'data.csv')
+        cache_dir = os.path.join(self._temp_dir, 'cache')
+        with open(filename, 'wb') as fp:
+            fp.write('x;name\n1.5;one\n2.5;two\n')
+
+        table = CSVTable(filename, True, None, cache_dir=cache_dir)
+        table.batch_size = 1
+        self.assertEqual(list(table.get_column(0, True)), [1.5, 2.5])
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        self.assertEqual(sorted(os.listdir(os.path.join(
+                                    cache_dir, os.listdir(cache_dir)[0]))),
+                         ['meta.json', 'num0.dat', 'off1.dat', 'str1.dat'])
+
+        table = CSVTable(filename, True, None, cache_dir=cache_dir)
+        def failing_parse():
+            self.fail("File was parsed again")
+        table.parse = failing_parse
+        self.assertEqual(table.rows, 2)
+        column = table.get_column(0, True)
+        self.assertIsInstance(column, numpy.memmap)
+        self.assertEqual(list(column), [1.5, 2.5])
+        self.assertEqual(table.get_column(0), ['1.5', '2.5'])
+        self.assertEqual(table.get_column(1), ['one', 'two'])
+        self.assertEqual(list(table.iter_batches([1], batch_size=1)),
+                         [[['one']], [['two']]])
+        self.assertRaises(ValueError, table.get_column, 1, True)
+        del table, column
+
+        # Changing the file invalidates the cache
+        with open(filename, 'wb') as fp:
+            fp.write('x;name\n1.5;one\n2.5;two\n3.5;three\n')
+        stat = os.stat(filename)
+        os.utime(filename, (stat.st_atime, stat.st_mtime + 10))
+        table = CSVTable(filename, True, None, cache_dir=cache_dir)
+        self.assertEqual(table.rows, 3)
+        self.assertEqual(table.get_column(1), ['one', 'two', 'three'])
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+
 class TestCountlines(unittest.TestCase):
     def test_countlines(self):
         # Simple
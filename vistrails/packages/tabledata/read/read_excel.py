@@ -54,6 +54,25 @@ class ExcelTable(TableObject):
         self.column_cache[(index, numeric)] = result
         return result
 
+    def iter_batches(self, columns=None, numeric=False, batch_size=None):
+        """Iterates on batches of rows, read directly from the sheet.
+        """
+        if columns is None:
+            columns = range(self.columns)
+        if batch_size is None:
+            batch_size = self.batch_size
+        first = 1 if self.header_present else 0
+        for start in xrange(first, first + self.rows, batch_size):
+            end = min(start + batch_size, first + self.rows)
+            batch = [self.sheet.col_values(col, start, end)
+                     for col in columns]
+            if numeric and numpy is not None:
+                batch = [numpy.array(part, dtype=numpy.float32)
+                         for part in batch]
+            elif numeric:
+                batch = [[float(e) for e in part] for part in batch]
+            yield batch
+
 
 class ExcelSpreadsheet(Table):
     """Reads a table from a Microsoft Excel file.
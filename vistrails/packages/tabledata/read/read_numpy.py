@@ -15,6 +15,9 @@ class NumPyArray(Module):
 
     If the array you are reading is not a simple one-dimensional array, you can
     use the shape port to indicate its expected structure.
+
+    Set 'memory_map' to map the file read-only instead of loading it, so that
+    tables built from the array are read in batches as they are consumed.
     """
     NPY_FMT = object()
 
@@ -41,7 +44,9 @@ class NumPyArray(Module):
             ('file', '(org.vistrails.vistrails.basic:File)'),
             ('datatype', '(org.vistrails.vistrails.basic:String)',
              {'entry_types': "['enum']", 'values': "[%r]" % FORMAT_MAP.keys()}),
-            ('shape', '(org.vistrails.vistrails.basic:List)')]
+            ('shape', '(org.vistrails.vistrails.basic:List)'),
+            ('memory_map', '(org.vistrails.vistrails.basic:Boolean)',
+             {'optional': True, 'defaults': "['False']"})]
     _output_ports = [
             ('value', '(org.vistrails.vistrails.basic:List)')]
 
@@ -54,10 +59,13 @@ class NumPyArray(Module):
                 dtype = self.NPY_FMT
             else:
                 dtype = numpy.float32
+        memory_map = self.get_input('memory_map')
         if dtype is self.NPY_FMT:
             # Numpy's ".NPY" format
             # Written with: numpy.save('xxx.npy', array)
-            array = numpy.load(filename)
+            array = numpy.load(filename, mmap_mode='r' if memory_map else None)
+        elif memory_map:
+            array = numpy.memmap(filename, dtype, mode='r')
         else:
             # Numpy's plain binary format
             # Written with: array.tofile('xxx.dat')
@@ -142,3 +150,26 @@ class NumpyTestCase(unittest.TestCase):
                 ]))
         self.assertEqual(len(results), 1)
         self.assertEqual(list(results[0]), [1.0, 7.0, 5.0, 3.0, 6.0, 1.0])
+
+    def test_memory_map(self):
+        """Uses NumPyArray to map arrays instead of loading them.
+        """
+        from ..identifiers import identifier
+        from vistrails.tests.utils import execute, intercept_result
+
+        with intercept_result(NumPyArray, 'value') as results:
+            self.assertFalse(execute([
+                    ('read|NumPyArray', identifier, [
+                        ('file', [('File', self._test_dir + '/random.npy')]),
+                        ('memory_map', [('Boolean', 'True')]),
+                    ]),
+                    ('read|NumPyArray', identifier, [
+                        ('datatype', [('String', 'float32')]),
+                        ('file', [('File', self._test_dir + '/random.dat')]),
+                        ('memory_map', [('Boolean', 'True')]),
+                    ]),
+                ]))
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertIsInstance(result, numpy.memmap)
+            self.assertEqual(sorted(result), [1.0, 1.0, 3.0, 5.0, 6.0, 7.0])
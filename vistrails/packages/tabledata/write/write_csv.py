@@ -39,17 +39,16 @@ class WriteCSV(Module):
                 else:
                     fp.write(delimiter.join(table.names) + '\n')
 
-            cols = [iter(table.get_column(i)) for i in xrange(table.columns)]
-
-            if not cols:
+            if not table.columns:
                 raise ModuleError(
                         self,
                         "Table has no columns")
 
             line = 0
-            for l in izip(*cols):
-                fp.write(delimiter.join(str(e) for e in l) + '\n')
-                line += 1
+            for batch in table.iter_batches():
+                for l in izip(*batch):
+                    fp.write(delimiter.join(str(e) for e in l) + '\n')
+                    line += 1
 
             rows = table.rows
             if line != rows: # pragma: no cover
@@ -1,3 +1,5 @@
+from itertools import izip
+
 from vistrails.core.bundles.pyimport import py_import
 from vistrails.core import debug
 from vistrails.core.modules.vistrails_module import Module, ModuleError
@@ -36,13 +38,15 @@ class WriteExcelSpreadsheet(Module):
         fileobj = self.interpreter.filePool.create_file(suffix='.xls')
         fname = fileobj.name
 
-        for c in xrange(table.columns):
-            column = table.get_column(c)
-            for r, e in enumerate(column):
-                sheet.write(r, c, e)
-            if r+1 != rows: # pragma: no cover
-                debug.warning("WriteExcelSpreadsheet wrote %d lines instead "
-                              "of expected %d" % (r, rows))
+        r = 0
+        for batch in table.iter_batches():
+            for row in izip(*batch):
+                for c, e in enumerate(row):
+                    sheet.write(r, c, e)
+                r += 1
+        if r != rows: # pragma: no cover
+            debug.warning("WriteExcelSpreadsheet wrote %d lines instead "
+                          "of expected %d" % (r, rows))
 
         workbook.save(fname)
         self.set_output('file', fileobj)
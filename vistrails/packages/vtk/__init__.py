@@ -40,6 +40,9 @@ the world. http://www.vtk.org"""
 from identifiers import *
 import vistrails.core
 
+# This must be here because of VisTrails protocol
+from vtk_config import configuration
+
 def package_dependencies():
     import vistrails.core.packagemanager
     manager = vistrails.core.packagemanager.get_package_manager()
@@ -48,6 +48,7 @@ from vistrails.core.modules.output_modules import OutputModule, ImageFileMode, \
 from vistrails.core.modules.vistrails_module import Module, ModuleError
 import vistrails.core.system
 from .identifiers import identifier as vtk_pkg_identifier
+from .vtk_config import configuration
 from .wrapper import VTKInstanceWrapper
 
 ################################################################################
@@ -139,6 +140,28 @@ class vtkBaseModule(Module):
             name = port_name
         return getattr(cls.vtkClass, name).__doc__
 
+    def needs_update(self):
+        """needs_update() -> bool
+        Whether Update() should be called on the vtkInstance in compute().
+
+        In demand-driven mode, an algorithm whose outputs are only connected
+        through GetOutputPort ports is not updated: the downstream modules
+        connect to its vtkAlgorithmOutput and VTK executes it when they are
+        updated, in a single pass and only for the data they request.
+
+        """
+        if not hasattr(self.vtkInstance, 'Update'):
+            return False
+        if not (configuration.demandDriven and
+                issubclass(self.vtkClass, vtk.vtkAlgorithm)):
+            return True
+        connected = [function for function in self.outputPorts
+                     if function != 'self']
+        # Sinks have no connected ports
+        if not connected:
+            return True
+        return any(function[:13] != 'GetOutputPort' for function in connected)
+
     # @classmethod
     # def provide_input_port_documentation(cls, port_name):
     #     return cls.get_doc(port_name)
@@ -225,7 +248,7 @@ class vtkBaseModule(Module):
                 call_it(port, p)
 
         # Call update if appropriate
-        if hasattr(self.vtkInstance, 'Update'):
+        if self.needs_update():
             is_aborted = False
             isAlgorithm = issubclass(self.vtkClass, vtk.vtkAlgorithm)
             cbId = None
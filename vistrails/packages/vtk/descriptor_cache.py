@@ -0,0 +1,142 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+"""Stores the modules and ports built by introspecting VTK.
+
+Building the VTK modules instantiates every class and parses the docstrings
+of all their methods, which is most of VisTrails' startup time. The result
+only depends on the VTK version and on the code of this package, so it is
+pickled in the .vistrails directory and the next startups fill the registry
+from it instead.
+
+The cache contains:
+  modules: list of (name, base module name, abstract), bases first
+  ports: dict of module name -> list of
+      (type, name, sigstring, optional, labels, docstring)
+  vtkcell_modules: list of the module names that get a SetVTKCell port
+"""
+
+import cPickle
+import os
+
+import vtk
+
+from vistrails.core import debug
+from vistrails.core.system import current_dot_vistrails
+from identifiers import version as package_version
+
+# Increase this when the format of the cache changes
+CACHE_FORMAT = 1
+
+_sources = ['init.py', 'fix_classes.py', 'vtk_parser.py', 'class_tree.py']
+
+def get_cache_filename():
+    return os.path.join(current_dot_vistrails(), 'vtk_descriptors.cache')
+
+def get_cache_key(has_spreadsheet):
+    """Returns what the introspection depends on.
+
+    The modification times of the sources of this package are included so
+    that the cache gets rebuilt when they are changed.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    mtimes = []
+    for name in _sources:
+        try:
+            mtimes.append(os.path.getmtime(os.path.join(directory, name)))
+        except OSError:
+            mtimes.append(None)
+    return (CACHE_FORMAT, vtk.vtkVersion().GetVTKSourceVersion(),
+            package_version, has_spreadsheet, tuple(mtimes))
+
+def load_cache(key):
+    """Returns the cached descriptors for this key, or None.
+    """
+    filename = get_cache_filename()
+    if not os.path.isfile(filename):
+        return None
+    try:
+        with open(filename, 'rb') as fp:
+            cached_key, cache = cPickle.load(fp)
+    except Exception, e:
+        debug.warning("Couldn't read the VTK descriptor cache %s" % filename,
+                      e)
+        return None
+    if cached_key != key:
+        return None
+    # Check that every class still exists, since the registry can't be
+    # rolled back once we start filling it
+    if not all(hasattr(vtk, name) for name, base, abstract
+               in cache['modules'][1:]):
+        return None
+    return cache
+
+def save_cache(key, cache):
+    filename = get_cache_filename()
+    temp_filename = filename + '.tmp'
+    try:
+        with open(temp_filename, 'wb') as fp:
+            cPickle.dump((key, cache), fp, cPickle.HIGHEST_PROTOCOL)
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(temp_filename, filename)
+    except (IOError, OSError), e:
+        debug.warning("Couldn't write the VTK descriptor cache %s" %
+                      filename, e)
+
+def build_cache(registry, base_descriptor, vtkcell_modules):
+    """Reads back the modules and ports from the registry, after they were
+    created from the VTK classes.
+    """
+    modules = []
+    ports = {}
+    def visit(descriptor, base_name):
+        modules.append((descriptor.name, base_name,
+                        descriptor.module_abstract()))
+        module_ports = ports[descriptor.name] = []
+        for spec in descriptor.port_specs_list:
+            labels = spec.labels
+            if not any(labels):
+                labels = None
+            module_ports.append((spec.type, spec.name, spec.sigstring,
+                                 bool(spec.optional), labels,
+                                 spec.docstring()))
+        for child in descriptor.children:
+            visit(child, descriptor.name)
+    visit(base_descriptor, None)
+    return dict(modules=modules,
+                ports=ports,
+                vtkcell_modules=[module.__name__
+                                 for module in vtkcell_modules])
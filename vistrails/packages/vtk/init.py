@@ -57,7 +57,8 @@ import warnings
 import vtk
 
 from base_module import vtkBaseModule, vtkRendererOutput
-from class_tree import ClassTree
+from class_tree import ClassTree, TreeNode
+import descriptor_cache
 import fix_classes
 import inspectors
 import offscreen
@@ -1090,6 +1091,18 @@ def createModule(baseModule, node):
         except (TypeError, NotImplementedError): # VTK raises type error on abstract classes
             return True
         return False
+    module = addModule(baseModule, node, is_abstract())
+    for child in node.children:
+        if child.name in disallowed_classes:
+            continue
+        createModule(module, child)
+
+def addModule(baseModule, node, abstract):
+    """ addModule(baseModule: a Module subclass, node: TreeNode,
+                  abstract: bool) -> Module
+    Construct the module for the class of node and add it to the registry
+
+    """
     module = new_module(baseModule, node.name,
                        class_dict(baseModule, node),
                        docstring=getattr(vtk, node.name).__doc__
@@ -1101,12 +1114,9 @@ def createModule(baseModule, node):
     else:
         module.vtkClass = node.klass
     registry = get_module_registry()
-    registry.add_module(module, abstract=is_abstract(), 
+    registry.add_module(module, abstract=abstract,
                         signatureCallable=vtk_hasher)
-    for child in node.children:
-        if child.name in disallowed_classes:
-            continue
-        createModule(module, child)
+    return module
 
 def createAllModules(g):
     """ createAllModules(g: ClassTree) -> None
@@ -1138,6 +1148,41 @@ def createAllModules(g):
                     continue
                 createModule(vtkObjectBase, child)
 
+def createAllModulesFromCache(cache, delayed):
+    """ createAllModulesFromCache(cache: dict, delayed: object) -> None
+    Add all modules and their ports into the module registry from the
+    descriptor cache, without introspecting the VTK classes
+
+    """
+    registry = get_module_registry()
+    vtkObjectBase = new_module(vtkBaseModule, 'vtkObjectBase')
+    vtkObjectBase.vtkClass = vtk.vtkObjectBase
+    registry.add_module(vtkObjectBase)
+    modules = {'vtkObjectBase': vtkObjectBase}
+    for name, base_name, abstract in cache['modules'][1:]:
+        modules[name] = addModule(modules[base_name],
+                                  TreeNode(getattr(vtk, name)), abstract)
+
+    for name, ports in cache['ports'].iteritems():
+        module = modules[name]
+        _upgrade_self_to_instance_modules.add(module)
+        for (port_type, port_name, sigstring, optional, labels,
+                docstring) in ports:
+            if port_type == 'input':
+                registry.add_input_port(module, port_name, sigstring,
+                                        optional, labels=labels,
+                                        docstring=docstring)
+            else:
+                registry.add_output_port(module, port_name, sigstring,
+                                         optional, docstring=docstring)
+
+    # See the RenderWindow case in addSetGetPorts
+    if cache['vtkcell_modules']:
+        from vtkcell import VTKCell
+        for name in cache['vtkcell_modules']:
+            delayed.add_input_port.append((modules[name], 'SetVTKCell',
+                                           VTKCell, False))
+
 
 ################################################################################
 
@@ -1154,26 +1199,37 @@ def initialize():
     if version < [5, 0, 0]:
         raise RuntimeError("You need to upgrade your VTK install to version "
                            ">= 5.0.0")
-    inheritanceGraph = ClassTree(vtk)
-    inheritanceGraph.create()
+    registry = get_module_registry()
+    has_spreadsheet = registry.has_module(
+            '%s.spreadsheet' % get_vistrails_default_pkg_prefix(),
+            'SpreadsheetCell')
 
     # Transfer Function constant
     tf_widget.initialize()
 
     delayed = InstanceObject(add_input_port=[])
     # Add VTK modules
-    registry = get_module_registry()
     registry.add_module(vtkBaseModule)
     registry.add_module(vtkRendererOutput)
-    createAllModules(inheritanceGraph)
-    setAllPorts(registry.get_descriptor_by_name(identifier,
-                                                'vtkObjectBase'),
-                delayed)
+    # Introspecting VTK is slow, we only do it if the cache is out of date
+    cache_key = descriptor_cache.get_cache_key(has_spreadsheet)
+    cache = descriptor_cache.load_cache(cache_key)
+    if cache is not None:
+        createAllModulesFromCache(cache, delayed)
+    else:
+        inheritanceGraph = ClassTree(vtk)
+        inheritanceGraph.create()
+        createAllModules(inheritanceGraph)
+        base_descriptor = registry.get_descriptor_by_name(vtk_pkg_identifier,
+                                                          'vtkObjectBase')
+        setAllPorts(base_descriptor, delayed)
+        cache = descriptor_cache.build_cache(
+                registry, base_descriptor,
+                [args[0] for args in delayed.add_input_port])
+        descriptor_cache.save_cache(cache_key, cache)
 
     # Register the VTKCell and VTKHandler type if the spreadsheet is up
-    if registry.has_module('%s.spreadsheet' % \
-                           get_vistrails_default_pkg_prefix(),
-                           'SpreadsheetCell'):
+    if has_spreadsheet:
         import vtkhandler
         import vtkcell
         import vtkviewcell
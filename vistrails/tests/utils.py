@@ -1,6 +1,8 @@
 import contextlib
 import logging
+import os
 import sys
+import tempfile
 
 try:
     import cStringIO as StringIO
@@ -11,7 +13,8 @@ from vistrails.core.modules.vistrails_module import Module
 
 
 def execute(modules, connections=[], add_port_specs=[],
-            enable_pkg=True, full_results=False):
+            enable_pkg=True, full_results=False, control_params=[],
+            view=None):
     """Build a pipeline and execute it.
 
     This is useful to simply build a pipeline in a test case, and run it. When
@@ -44,6 +47,15 @@ def execute(modules, connections=[], add_port_specs=[],
     It is useful to test modules that can have custom ports through a
     configuration widget.
 
+    control_params is a list of control parameters to set on modules, with the
+    following format:
+        [
+            (mod_id, 'name', 'value'),
+        ]
+
+    view is the view the interpreter reports the execution to, a DummyView if
+    None.
+
     The function returns the 'errors' dict it gets from the interpreter, so you
     should use a construct like self.assertFalse(execute(...)) if the execution
     is not supposed to fail.
@@ -73,6 +85,8 @@ def execute(modules, connections=[], add_port_specs=[],
     from vistrails.core.utils import DummyView
     from vistrails.core.vistrail.connection import Connection
     from vistrails.core.vistrail.module import Module
+    from vistrails.core.vistrail.module_control_param import \
+        ModuleControlParam
     from vistrails.core.vistrail.module_function import ModuleFunction
     from vistrails.core.vistrail.module_param import ModuleParam
     from vistrails.core.vistrail.pipeline import Pipeline
@@ -135,6 +149,11 @@ def execute(modules, connections=[], add_port_specs=[],
                         functions=function_list)
         for port_spec in port_spec_per_module.get(i, []):
             module.add_port_spec(port_spec)
+        for j, (mod_id, cp_name, cp_value) in enumerate(control_params):
+            if mod_id == i:
+                module.add_control_parameter(
+                        ModuleControlParam(id=j, name=cp_name,
+                                           value=cp_value))
         pipeline.add_module(module)
         module_list.append(module)
 
@@ -156,12 +175,14 @@ def execute(modules, connections=[], add_port_specs=[],
                          signature=d_sig),
                 ]))
 
+    if view is None:
+        view = DummyView()
     interpreter = Interpreter.get()
     result = interpreter.execute(
             pipeline,
             locator=XMLFileLocator('foo.xml'),
             current_version=1,
-            view=DummyView())
+            view=view)
     if full_results:
         return result
     else:
@@ -228,6 +249,41 @@ def intercept_results(*args):
     return contextlib.nested(*ctx)
 
 
+@contextlib.contextmanager
+def record_view_calls():
+    """This gives a view that records the process making each call to it.
+
+    It is used as a context manager, giving the view to pass to execute() and
+    a list that receives the (pid, method name) of every call when the
+    context exits, including the calls made from forked processes:
+    with record_view_calls() as (view, calls):
+        self.assertFalse(execute(..., view=view))
+    self.assertEqual(set(pid for pid, name in calls), set([os.getpid()]))
+    """
+    from vistrails.core.utils import DummyView
+
+    fd, filename = tempfile.mkstemp(prefix='vt_view_')
+    os.close(fd)
+
+    class RecordingView(DummyView):
+        def __getattribute__(self, name):
+            attr = DummyView.__getattribute__(self, name)
+            if name.startswith('set_module_'):
+                with open(filename, 'ab') as fp:
+                    fp.write('%d %s\n' % (os.getpid(), name))
+            return attr
+
+    calls = []
+    try:
+        yield RecordingView(), calls
+    finally:
+        with open(filename, 'rb') as fp:
+            for line in fp:
+                pid, name = line.split()
+                calls.append((int(pid), name))
+        os.remove(filename)
+
+
 @contextlib.contextmanager
 def capture_stream(stream):
     lines = []